@@ -1,2 +1,99 @@
 VOSK_MODEL = "vosk-model-small-ru-0.22"   # or use "vosk-model-ru-0.42"
-GOOGLE_SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
\ No newline at end of file
+VOSK_LARGE_MODEL = None   # например "vosk-model-ru-0.42": обе модели держатся в памяти (см. VOSK_LARGE_*)
+AUDIO2TEXT_MODEL = "whisper"   # бэкенд распознавания речи (stt_utilities): "whisper", "vosk" или "local_whisper"
+GOOGLE_SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+# LLM: дедлайны (в секундах) для каждого этапа конвейера и хеджирование медленных запросов
+LLM_STAGE_TIMEOUTS = {"classification": 20.0, "extraction": 30.0}
+LLM_DEFAULT_TIMEOUT = 30.0
+LLM_HEDGE_ENABLED = True
+LLM_HEDGE_PERCENTILE = 0.9   # второй запрос отправляется, если первый не ответил за p90
+LLM_HEDGE_MIN_SAMPLES = 20   # пока статистики меньше, используется LLM_HEDGE_DEFAULT_DELAY
+LLM_HEDGE_DEFAULT_DELAY = 6.0
+LLM_HEDGE_MIN_DELAY = 1.5
+
+# VAD: обрезка тишины и разбиение длинных голосовых на фрагменты (энергия - RMS сэмплов s16le)
+VAD_FRAME_MS = 30
+VAD_MIN_ENERGY = 200.0   # кадр тише этого уровня всегда считается тишиной
+VAD_NOISE_RATIO = 3.0    # кадр - речь, если он громче уровня шума в N раз
+VAD_MIN_SILENCE_MS = 600   # паузы короче не разрывают участок речи
+VAD_PADDING_MS = 200   # запас тишины вокруг участка речи
+VAD_MAX_SEGMENT_SEC = 30.0   # более длинная речь делится на фрагменты для параллельного распознавания
+
+# Очередь голосовых сообщений: сколько сообщений обрабатывается одновременно (по всем чатам)
+VOICE_MAX_CONCURRENCY = 3
+
+# Google Sheets: квоты (запросов в минуту на сервисный аккаунт) и повторы при 429/5xx
+SHEETS_READ_PER_MINUTE = 60
+SHEETS_WRITE_PER_MINUTE = 60
+SHEETS_MAX_RETRIES = 5
+SHEETS_BACKOFF_BASE = 1.0   # секунды; задержка растёт как base * 2^attempt со случайным разбросом
+SHEETS_BACKOFF_MAX = 32.0
+
+# Логирование больших объектов (log_payload, только уровень DEBUG): доля записей и лимит в минуту на ключ
+LOG_PAYLOAD_SAMPLE_RATE = 0.2
+LOG_PAYLOAD_MAX_PER_MINUTE = 10
+LOG_PAYLOAD_MAX_LENGTH = 2000
+
+# Трассировка этапов обработки (tracing_utilities): интервалы пишутся в cache/traces.jsonl (или TRACE_PATH)
+TRACE_ENABLED = True
+TRACE_MAX_BYTES = 20 * 1024 * 1024   # при превышении файл переименовывается в traces.jsonl.1
+
+# Здоровье процесса: /health отвечает 503, если event loop просыпается с опозданием больше порога
+EVENT_LOOP_LAG_INTERVAL = 0.5
+HEALTH_MAX_EVENT_LOOP_LAG = 2.0
+
+# Правки сообщений Telegram: частые правки одного сообщения объединяются, а в одном чате отправляются
+# не чаще раза в TELEGRAM_CHAT_EDIT_INTERVAL секунд (лимит Bot API - около 1 сообщения в секунду на чат)
+TELEGRAM_EDIT_DEBOUNCE = 0.3
+TELEGRAM_CHAT_EDIT_INTERVAL = 1.0
+TELEGRAM_EDIT_MAX_RETRIES = 2   # повторы после RetryAfter
+
+# Временные аудиофайлы в voice_messages: удаляются после обработки сообщения (если не VOICE_FILES_RETENTION),
+# а фоновая очистка держит папку в пределах возраста и размера (сначала удаляются давно не использованные)
+VOICE_FILES_RETENTION = False
+VOICE_FILES_MAX_AGE = 24 * 3600   # секунды
+VOICE_FILES_MAX_BYTES = 500 * 1024 * 1024
+VOICE_FILES_MIN_AGE = 10 * 60   # более новые файлы могут быть в обработке и не удаляются по размеру
+VOICE_FILES_CLEANUP_INTERVAL = 10 * 60
+
+# Голосовые сообщения скачиваются и декодируются в памяти (буферы переиспользуются);
+# более длинные или крупные сообщения скачиваются в файл в voice_messages
+VOICE_MEMORY_MAX_DURATION = 300   # секунды
+VOICE_MEMORY_MAX_BYTES = 5 * 1024 * 1024
+VOICE_BUFFER_POOL_SIZE = 4   # сколько свободных буферов хранится для повторного использования
+
+# Локальный Whisper (бэкенд "local_whisper", нужен пакет faster-whisper): модель CTranslate2 с int8 на CPU
+LOCAL_WHISPER_MODEL = "small"   # размер модели ("base", "small", "medium") или путь к конвертированной модели
+LOCAL_WHISPER_COMPUTE_TYPE = "int8"
+LOCAL_WHISPER_THREADS = 4   # потоков CPU на декодирование
+LOCAL_WHISPER_LANGUAGE = "ru"
+LOCAL_WHISPER_BEAM_SIZE = 1   # 1 - жадное декодирование (быстрее на CPU)
+LOCAL_WHISPER_BATCH_SIZE = 8   # фрагментов речи (из одного или нескольких голосовых) в одном пакете
+LOCAL_WHISPER_BATCH_WAIT = 0.05   # секунды: сколько ждать фрагменты других голосовых из очереди
+
+# Vosk: распознавание по грамматике из категорий, счетов и числительных (быстрее и точнее на названиях).
+# Работает только с моделями, поддерживающими грамматику (малые модели vosk-model-small-*)
+VOSK_GRAMMAR_ENABLED = False
+
+# Vosk с двумя моделями (VOSK_LARGE_MODEL): большая - для коротких голосовых, пока очередь почти пуста
+# и распознавание не занято другими голосовыми,
+# малая (VOSK_MODEL) - для длинных голосовых и под нагрузкой
+VOSK_LARGE_MAX_DURATION = 30   # секунды
+VOSK_LARGE_MAX_QUEUE_DEPTH = 0   # голосовых в очереди (queue.voice.depth)
+VOSK_LARGE_MAX_RUNNING = 1   # голосовых в обработке, включая текущее (queue.voice.running)
+
+# Подсказка Whisper (категории и счета): строится один раз на версию снимка категорий и обрезается
+# до лимита Whisper; первыми идут категории и счета, чаще встречающиеся в последних операциях
+WHISPER_PROMPT_MAX_TOKENS = 224
+WHISPER_PROMPT_USAGE_ROWS = 500   # сколько последних строк листов расходов и доходов учитывать
+WHISPER_PROMPT_USAGE_RETRY = 300   # секунды: после ошибки чтения частот подсказка строится без них
+
+# Воспоминания (#memory) в системных подсказках LLM: если их больше MEMORY_RETRIEVAL_MIN_COUNT,
+# добавляются только относящиеся к сообщению (TF-IDF), не больше MEMORY_CONTEXT_MAX_TOKENS
+MEMORY_RETRIEVAL_MIN_COUNT = 10
+MEMORY_CONTEXT_MAX_TOKENS = 400
+
+# Воспоминания (лист #memory) кэшируются в процессе; изменения через бота попадают в кэш сразу,
+# правки в самой таблице - не позже чем через MEMORY_CACHE_TTL секунд
+MEMORY_CACHE_TTL = 300
@@ -94,8 +94,9 @@ create_directories() {
     log_success "Directories setup complete"
 }
 
-# Audio cleanup functionality removed - voice messages will accumulate
-# Consider manual cleanup if disk space becomes an issue
+# Audio cleanup is done by the application itself: temp files are removed once a voice
+# message is processed, and a background janitor enforces VOICE_FILES_MAX_AGE / VOICE_FILES_MAX_BYTES
+# (see config.py and lib/utilities/janitor_utilities.py)
 
 # Health check setup
 setup_health_check() {
@@ -113,7 +114,7 @@ show_config() {
     log "Development mode: ${DEV:-false}"
     log "Python version: $(python --version)"
     log "Working directory: $(pwd)"
-    log "Audio cleanup: Disabled (voice files will accumulate)"
+    log "Audio cleanup: in-process janitor (see VOICE_FILES_* in config.py)"
     log "=============================================="
 }
 
@@ -11,6 +11,15 @@ YELLOW='\033[1;33m'
 BLUE='\033[0;34m'
 NC='\033[0m' # No Color
 
+# Base URL of the application HTTP server (/health, /metrics)
+get_base_url() {
+    local scheme="http"
+    if [ -n "$HTTP_CERT_PATH" ]; then
+        scheme="https"
+    fi
+    echo "${scheme}://127.0.0.1:${HTTP_PORT:-8080}"
+}
+
 # Health check function
 check_health() {
     local exit_code=0
@@ -43,10 +52,10 @@ check_health() {
     fi
     
     # Check 4: Google credentials file exists and is readable
-    if [ ! -f "/app/google_service_account_credentials.json" ]; then
+    if [ ! -f "/app/.google_service_account_credentials.json" ]; then
         echo -e "${RED}Google credentials file not found${NC}" >&2
         exit_code=1
-    elif [ ! -r "/app/google_service_account_credentials.json" ]; then
+    elif [ ! -r "/app/.google_service_account_credentials.json" ]; then
         echo -e "${RED}Google credentials file not readable${NC}" >&2
         exit_code=1
     fi
@@ -71,14 +80,24 @@ check_health() {
         exit_code=1
     fi
     
-    # Check 6: Disk space (warn if low)
+    # Check 6: HTTP health endpoint (application is running, event loop is not blocked)
+    local health
+    if ! health=$(curl -sSk --max-time 5 -w '\n%{http_code}' "$(get_base_url)/health"); then
+        echo -e "${RED}Health endpoint is not responding${NC}" >&2
+        exit_code=1
+    elif [ "$(echo "$health" | tail -1)" != "200" ]; then
+        echo -e "${RED}Health endpoint reports: $(echo "$health" | head -1)${NC}" >&2
+        exit_code=1
+    fi
+    
+    # Check 7: Disk space (warn if low)
     local disk_usage=$(df /app | tail -1 | awk '{print $5}' | sed 's/%//')
     if [ "$disk_usage" -gt 90 ]; then
         echo -e "${YELLOW}Warning: Disk usage is ${disk_usage}%${NC}" >&2
         # Don't fail health check for high disk usage, just warn
     fi
     
-    # Check 7: Memory usage (warn if high)
+    # Check 8: Memory usage (warn if high)
     local memory_usage=$(free | grep Mem | awk '{printf "%.0f", $3/$2 * 100}')
     if [ "$memory_usage" -gt 90 ]; then
         echo -e "${YELLOW}Warning: Memory usage is ${memory_usage}%${NC}" >&2
@@ -126,11 +145,22 @@ check_health_verbose() {
         echo "Directory not found"
     fi
     
+    echo -e "${BLUE}=== Application Health ===${NC}"
+    curl -sSk --max-time 5 "$(get_base_url)/health" || echo "Health endpoint not available"
+    echo
+    
+    echo -e "${BLUE}=== Key Metrics ===${NC}"
+    curl -sSk --max-time 5 "$(get_base_url)/metrics" \
+        | grep -E '^familyfinance_(event_loop_lag|queue_voice_(depth|running)|.*errors_total|.*timeouts_total|cache_.*_total) ' \
+        || echo "Metrics endpoint not available"
+    
     echo -e "${BLUE}=== Environment Variables ===${NC}"
     echo "OPENAI_API_KEY: $([ -n "$OPENAI_API_KEY" ] && echo 'Set' || echo 'Not set')"
     echo "TELEGRAM_TOKEN: $([ -n "$TELEGRAM_TOKEN" ] && echo 'Set' || echo 'Not set')"
     echo "GOOGLE_SPREADSHEET_ID: $([ -n "$GOOGLE_SPREADSHEET_ID" ] && echo 'Set' || echo 'Not set')"
     echo "DEV: ${DEV:-Not set}"
+    echo "Mode: $([ -n "$TELEGRAM_WEBHOOK_URL" ] && echo "webhook ($TELEGRAM_WEBHOOK_URL)" || echo 'polling')"
+    echo "HTTP_PORT: ${HTTP_PORT:-8080}"
     echo "AUDIO_CLEANUP_DAYS: ${AUDIO_CLEANUP_DAYS:-7}"
     echo "AUDIO_CLEANUP_ON_START: ${AUDIO_CLEANUP_ON_START:-true}"
     echo "AUDIO_CLEANUP_PERIODIC: ${AUDIO_CLEANUP_PERIODIC:-true}"
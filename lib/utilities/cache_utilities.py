@@ -0,0 +1,168 @@
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Optional
+
+from lib.utilities.metrics_utilities import increment
+from lib.utilities.os_utilities import get_cache_path
+
+
+# LOGGING
+
+
+from lib.utilities.log_utilities import get_logger
+LOGGER = get_logger(__name__)
+
+
+# public
+
+
+class JsonFileStore:
+    """
+    Небольшое key-value хранилище в JSON-файле: переживает перезапуск процесса,
+    ограничено по количеству записей и сроку жизни (вытесняются самые старые).
+    """
+    def __init__(self, path: str, max_entries: int = 500, ttl_seconds: float = 7 * 24 * 3600):
+        self._path = path
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = None  # загружаются при первом обращении
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._load().get(key)
+        if entry is None or time.time() - entry["updated_at"] > self._ttl_seconds:
+            return None
+        return entry["value"]
+
+    def set(self, key: str, value: dict) -> None:
+        with self._lock:
+            entries = self._load()
+            entries[key] = {"value": value, "updated_at": time.time()}
+            self._evict(entries)
+            self._save(entries)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if self._load().pop(key, None) is not None:
+                self._save(self._entries)
+
+    def _load(self) -> dict:
+        if self._entries is None:
+            try:
+                with open(self._path, encoding="utf-8") as file:
+                    self._entries = json.load(file)
+            except FileNotFoundError:
+                self._entries = {}
+            except (OSError, ValueError) as e:
+                LOGGER.error(f"Cache file {self._path} is unreadable, starting empty: {e}")
+                self._entries = {}
+        return self._entries
+
+    def _evict(self, entries: dict) -> None:
+        expired = [key for key, entry in entries.items() if time.time() - entry["updated_at"] > self._ttl_seconds]
+        oldest = sorted(entries, key=lambda key: entries[key]["updated_at"])[:max(0, len(entries) - self._max_entries)]
+        for key in set(expired + oldest):
+            del entries[key]
+
+    def _save(self, entries: dict) -> None:
+        # атомарная запись: файл не останется наполовину записанным при падении процесса
+        os.makedirs(os.path.dirname(os.path.abspath(self._path)), exist_ok=True)  # папка создаётся при первой записи
+        temp_path = self._path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(entries, file, ensure_ascii=False)
+        os.replace(temp_path, self._path)
+
+
+def get_cached_transcription(model: str, file_unique_id: str = None, content_hash: str = None) -> Optional[str]:
+    """
+    Возвращает сохранённый текст голосового сообщения, распознанный той же моделью.
+    Попадание отмечается в текущем transcription_lookup (счётчики - один раз на сообщение, а не на ключ).
+
+    Args:
+        model (str): Модель распознавания (Audio2TextModels).
+        file_unique_id (str, optional): Telegram file_unique_id (одинаков у пересланных копий).
+        content_hash (str, optional): sha256 содержимого аудиофайла.
+
+    Returns:
+        str | None: Текст или None, если в кэше нет подходящей записи.
+    """
+    for key in _get_transcription_keys(file_unique_id, content_hash):
+        entry = _TRANSCRIPTION_CACHE.get(key)
+        if entry and entry["model"] == model:
+            LOGGER.info(f"Transcription cache hit: {key}")
+            if lookup := _LOOKUP.get():
+                lookup.hit = True
+            return entry["text"]
+    return None
+
+
+@contextmanager
+def transcription_lookup():
+    """
+    Учитывает одно распознавание голосового сообщения в cache.transcription.hits или .misses,
+    сколько бы ключей (file_unique_id, sha256) ни проверялось внутри блока. При ошибке ничего не учитывается.
+
+    Пример:
+        with transcription_lookup():
+            text = await get_text(...)
+    """
+    lookup = _Lookup()
+    token = _LOOKUP.set(lookup)  # объект общий и для задач, созданных внутри блока
+    try:
+        yield lookup
+    finally:
+        _LOOKUP.reset(token)
+    increment("cache.transcription.hits" if lookup.hit else "cache.transcription.misses")
+
+
+def cache_transcription(text: str, model: str, file_unique_id: str = None, content_hash: str = None) -> None:
+    """
+    Сохраняет распознанный текст и модель под всеми известными ключами сообщения.
+    """
+    for key in _get_transcription_keys(file_unique_id, content_hash):
+        _TRANSCRIPTION_CACHE.set(key, {"text": text, "model": model})
+
+
+def get_file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while block := file.read(64 * 1024):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+async def hash_chunks(chunks: AsyncIterator[bytes], digest) -> AsyncIterator[bytes]:
+    """
+    Пропускает поток без изменений, обновляя digest (например, hashlib.sha256()) каждым блоком.
+    """
+    async for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+
+
+# private
+
+
+class _Lookup:
+    hit = False
+
+
+_LOOKUP: contextvars.ContextVar[Optional[_Lookup]] = contextvars.ContextVar("transcription_lookup", default=None)
+
+
+def _get_transcription_keys(file_unique_id: str = None, content_hash: str = None) -> list[str]:
+    keys = []
+    if file_unique_id:
+        keys.append(f"file:{file_unique_id}")
+    if content_hash:
+        keys.append(f"sha256:{content_hash}")
+    return keys
+
+
+_TRANSCRIPTION_CACHE = JsonFileStore(os.path.join(get_cache_path(), "transcriptions.json"))
@@ -0,0 +1,113 @@
+import os
+from typing import Any
+
+from lib.utilities.cache_utilities import JsonFileStore
+from lib.utilities.os_utilities import get_cache_path
+from lib.utilities.tracing_utilities import span
+
+
+# LOGGING
+
+
+from lib.utilities.log_utilities import get_logger
+LOGGER = get_logger(__name__)
+
+
+# public
+
+
+class VoiceStage:
+    """
+    Этапы обработки голосового сообщения в порядке выполнения.
+    Этапы extract/validate/persist/render выполняются для каждой операции отдельно.
+    """
+    download = "download"
+    transcribe = "transcribe"
+    classify = "classify"
+    extract = "extract"
+    validate = "validate"
+    persist = "persist"
+    render = "render"
+
+
+class Checkpoint:
+    """
+    Сохранённые результаты этапов обработки одного сообщения. Каждый результат записывается на диск
+    сразу после завершения этапа, поэтому повтор (или перезапуск процесса) продолжает обработку
+    с последнего завершённого этапа.
+
+    Args:
+        key (str): Ключ сообщения (например, Telegram file_unique_id).
+    """
+    def __init__(self, key: str):
+        self.key = key
+        self._results = _CHECKPOINTS.get(key) or {}
+        if self._results:
+            LOGGER.info(f"Resuming '{key}' from checkpoint, completed stages: {list(self._results)}")
+
+    def is_done(self, stage: str, index: int = None) -> bool:
+        return _get_stage_key(stage, index) in self._results
+
+    def get(self, stage: str, index: int = None, default: Any = None) -> Any:
+        return self._results.get(_get_stage_key(stage, index), default)
+
+    def save(self, stage: str, result: Any, index: int = None) -> None:
+        self._results[_get_stage_key(stage, index)] = result
+        _CHECKPOINTS.set(self.key, self._results)
+
+    def clear(self) -> None:
+        self._results = {}
+        _CHECKPOINTS.delete(self.key)
+
+
+def has_stage(key: str, stage: str, index: int = None) -> bool:
+    """
+    Есть ли сохранённый результат этапа у сообщения key (без загрузки Checkpoint).
+    """
+    return _get_stage_key(stage, index) in (_CHECKPOINTS.get(key) or {})
+
+
+def save_stage(key: str, stage: str, result: Any, index: int = None) -> None:
+    """
+    Записывает результат этапа в существующую контрольную точку сообщения key (например, когда этап
+    выполнен вне конвейера - кнопкой пользователя). Если точки нет (очищена или устарела), ничего не делает.
+    """
+    if results := _CHECKPOINTS.get(key):
+        results[_get_stage_key(stage, index)] = result
+        _CHECKPOINTS.set(key, results)
+
+
+async def run_stage(checkpoint: Checkpoint, stage: str, coroutine_function, *args, index: int = None) -> Any:
+    """
+    Выполняет этап, если его результата ещё нет в checkpoint, и сохраняет результат.
+
+    Args:
+        checkpoint (Checkpoint): Контрольная точка сообщения.
+        stage (str): Этап (VoiceStage).
+        coroutine_function: Корутина этапа; результат должен сериализоваться в JSON.
+        *args: Аргументы корутины.
+        index (int, optional): Номер операции для поэтапной обработки операций.
+
+    Returns:
+        Any: Результат этапа (сохранённый или только что вычисленный).
+    """
+    with span(f"stage.{stage}", index=index) as current:
+        if checkpoint.is_done(stage, index):
+            LOGGER.info(f"Stage '{_get_stage_key(stage, index)}' restored from checkpoint")
+            current.set_attribute("restored", True)
+            return checkpoint.get(stage, index)
+
+        result = await coroutine_function(*args)
+        checkpoint.save(stage, result, index)
+        return result
+
+
+# private
+
+
+def _get_stage_key(stage: str, index: int = None) -> str:
+    return stage if index is None else f"{stage}:{index}"
+
+
+_CHECKPOINTS = JsonFileStore(os.path.join(get_cache_path(), "checkpoints.json"),
+                             max_entries=200, ttl_seconds=2 * 24 * 3600)
@@ -1,9 +1,25 @@
+import asyncio
+import io
 import os
 import subprocess
+import wave
+from typing import AsyncIterator
 
 from lib.utilities.os_utilities import get_ffmpeg_executable_path
+from lib.utilities.tracing_utilities import traced
 
 
+# LOGGING
+
+
+from lib.utilities.log_utilities import get_logger
+LOGGER = get_logger(__name__)
+
+
+SAMPLE_RATE = 16000  # частота дискретизации для распознавания речи
+
+
+@traced("ffmpeg.convert")
 def convert_oga_to_wav(input_file: str) -> str:
     """
     :return: path to .wav file
@@ -24,3 +40,100 @@ def convert_oga_to_wav(input_file: str) -> str:
 
     except subprocess.CalledProcessError as e:
         print(f"Ошибка при конвертации: {e}")
+
+
+
+@traced("ffmpeg.decode")
+def decode_to_pcm(audio: bytes | memoryview) -> bytes:
+    """
+    Декодирует аудио из памяти (например, .oga из Telegram) в PCM s16le SAMPLE_RATE моно:
+    данные передаются в stdin ffmpeg без записи на диск.
+
+    Args:
+        audio (bytes | memoryview): Содержимое аудиофайла.
+
+    Returns:
+        bytes: PCM s16le.
+    """
+    command = [
+        get_ffmpeg_executable_path(),
+        '-loglevel', 'error',
+        '-i', 'pipe:0',
+        '-f', 's16le',
+        '-ar', str(SAMPLE_RATE),
+        '-ac', '1',
+        'pipe:1',
+    ]
+    result = subprocess.run(command, input=audio, capture_output=True, check=True)
+    return result.stdout
+
+
+def read_wav_pcm(wav_file: str) -> tuple[bytes, int]:
+    """
+    Читает PCM из WAV-файла (ожидается 16 бит моно, как после convert_oga_to_wav).
+
+    Returns:
+        tuple[bytes, int]: PCM s16le и частота дискретизации.
+    """
+    with wave.open(wav_file, "rb") as wf:
+        return wf.readframes(wf.getnframes()), wf.getframerate()
+
+
+def pcm_to_wav_bytes(pcm: bytes, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """
+    Упаковывает PCM s16le моно в WAV в памяти (например, для загрузки в Whisper).
+    """
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm)
+    return buffer.getvalue()
+
+
+async def stream_to_pcm(chunks: AsyncIterator[bytes], read_size: int = 8000) -> AsyncIterator[bytes]:
+    """
+    Декодирует поток аудио (например, .oga из Telegram) в PCM s16le 16 кГц моно через ffmpeg,
+    отдавая PCM по мере декодирования, не дожидаясь окончания входного потока.
+
+    Args:
+        chunks (AsyncIterator[bytes]): Входной поток аудио.
+        read_size (int): Размер читаемого блока PCM в байтах.
+
+    Yields:
+        bytes: Очередной блок PCM.
+    """
+    process = await asyncio.create_subprocess_exec(
+        get_ffmpeg_executable_path(),
+        '-loglevel', 'error',
+        '-i', 'pipe:0',
+        '-f', 's16le',
+        '-ar', str(SAMPLE_RATE),
+        '-ac', '1',
+        'pipe:1',
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+    )
+    writer = asyncio.create_task(_feed_stdin(process, chunks))
+
+    try:
+        while data := await process.stdout.read(read_size):
+            yield data
+        await writer
+    finally:
+        if not writer.done():
+            writer.cancel()
+        if process.returncode is None:
+            process.kill()
+        if await process.wait() not in (0, -9):
+            LOGGER.error(f"ffmpeg exited with code {process.returncode}")
+
+
+async def _feed_stdin(process: asyncio.subprocess.Process, chunks: AsyncIterator[bytes]) -> None:
+    try:
+        async for chunk in chunks:
+            process.stdin.write(chunk)
+            await process.stdin.drain()
+    finally:
+        process.stdin.close()
@@ -1,8 +1,15 @@
+import json
 import logging
 
 import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter
 from datetime import datetime, timedelta
 from enum import Enum
+from functools import lru_cache
 from typing import Union, Optional
 
 from dotenv import load_dotenv
@@ -10,16 +17,22 @@ from pydantic import BaseModel, Field
 
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.model import JsonModel
 
 from lib.utilities.date_utilities import get_google_sheets_current_date
-from config import GOOGLE_SCOPES
+from config import GOOGLE_SCOPES, SHEETS_READ_PER_MINUTE, SHEETS_WRITE_PER_MINUTE, SHEETS_MAX_RETRIES, \
+    SHEETS_BACKOFF_BASE, SHEETS_BACKOFF_MAX, MEMORY_CACHE_TTL
+from lib.utilities.metrics_utilities import observe_latency, increment
 from lib.utilities.os_utilities import _get_root_path
+from lib.utilities.rate_limit_utilities import PriorityTokenBucket, Priority
+from lib.utilities.tracing_utilities import span, traced, set_span_attribute
 
 
 # LOGGING
 
 
-from lib.utilities.log_utilities import get_logger
+from lib.utilities.log_utilities import get_logger, log_payload
 LOGGER = get_logger(__name__)
 
 
@@ -27,6 +40,7 @@ load_dotenv()
 SPREADSHEET_ID = os.getenv("GOOGLE_SPREADSHEET_ID")
 
 
+@lru_cache(maxsize=1)
 def _authenticate_with_google():
     """
     Аутентифицирует пользователя с помощью Google Service Account и возвращает объект учётных данных.
@@ -44,15 +58,80 @@ def _authenticate_with_google():
     return creds
 
 
+def _get_service():
+    """
+    Возвращает клиент Sheets API текущего потока: httplib2 не потокобезопасен, а запросы к таблице
+    выполняются из разных потоков (asyncio.to_thread).
+    """
+    if not hasattr(_THREAD_LOCAL, "service"):
+        _THREAD_LOCAL.service = build("sheets", "v4", credentials=_authenticate_with_google(), cache_discovery=False,
+                                       model=_RawJsonModel())
+    return _THREAD_LOCAL.service
+
+
+def _execute(request, is_write: bool = False, priority: int = Priority.user_read) -> dict:
+    """
+    Выполняет запрос к Sheets API с учётом квоты: ждёт токен в общем лимитере и повторяет запрос
+    с экспоненциальной задержкой (со случайным разбросом) при 429 и 5xx.
+
+    Args:
+        request: Запрос googleapiclient (HttpRequest).
+        is_write (bool): Запрос изменяет таблицу (квота на запись).
+        priority (int): Приоритет запроса (Priority).
+
+    Returns:
+        dict: Ответ Sheets API.
+
+    Raises:
+        HttpError: Если запрос завершился ошибкой, которую нельзя повторить, или закончились попытки.
+    """
+    kind = "write" if is_write else "read"
+    bucket = _WRITE_BUCKET if is_write else _READ_BUCKET
+    for attempt in range(SHEETS_MAX_RETRIES + 1):
+        waited = bucket.acquire(priority)
+        set_span_attribute("quota_wait_ms", round(waited * 1000))
+        if waited > 0.1:
+            LOGGER.info(f"Sheets {kind} request waited {waited:.1f}s for quota (priority {priority})")
+        started = time.monotonic()
+        try:
+            response = request.execute()
+            observe_latency(f"sheets.{kind}", time.monotonic() - started)
+            return response
+        except HttpError as e:
+            if e.resp.status not in _RETRY_STATUSES or attempt == SHEETS_MAX_RETRIES:
+                increment(f"sheets.{kind}.errors")
+                raise
+            delay = _get_backoff_delay(attempt, e.resp.get("retry-after"))
+            set_span_attribute("retries", attempt + 1)
+            increment(f"sheets.{kind}.retries")
+            LOGGER.warning(f"Sheets {kind} request failed with {e.resp.status}, "
+                           f"retry {attempt + 1}/{SHEETS_MAX_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def _get_backoff_delay(attempt: int, retry_after: str = None) -> float:
+    delay = random.uniform(0, min(SHEETS_BACKOFF_MAX, SHEETS_BACKOFF_BASE * 2 ** attempt))
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, float(retry_after))
+    return delay
+
+
+_THREAD_LOCAL = threading.local()
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+_READ_BUCKET = PriorityTokenBucket(SHEETS_READ_PER_MINUTE)
+_WRITE_BUCKET = PriorityTokenBucket(SHEETS_WRITE_PER_MINUTE)
+
+
+@lru_cache(maxsize=1)
 def _get_sheet_ids() -> dict:
     """
-    Получает идентификаторы всех листов в Google Spreadsheet.
+    Получает идентификаторы всех листов в Google Spreadsheet (один раз за время работы процесса).
 
     Returns:
         dict: Словарь с названиями листов и их идентификаторами.
     """
-    request = _SERVICE.spreadsheets().get(spreadsheetId=SPREADSHEET_ID)
-    response = request.execute()
+    request = _get_service().spreadsheets().get(spreadsheetId=SPREADSHEET_ID)
+    response = _execute(request)
 
     sheet_ids = {}
     for sheet in (sheets := response.get('sheets', [])):
@@ -62,19 +141,10 @@ def _get_sheet_ids() -> dict:
         sheet_ids[title] = sheet_id
 
     LOGGER.info(f"Sheet IDs: {sheet_ids}")
-    
-    # Подробное логирование для отладки
-    for name, id in sheet_ids.items():
-        LOGGER.info(f"Sheet: '{name}', ID: {id}")
 
     return sheet_ids
 
 
-_CREDS = _authenticate_with_google()
-_SERVICE = build("sheets", "v4", credentials=_CREDS)
-_SHEETS_IDS = _get_sheet_ids()
-
-
 class _GoogleBaseEnumClass(Enum):
     """
     Базовый класс для перечислений Google с дополнительными методами.
@@ -102,6 +172,7 @@ class Category:
     _incomes = []  # категории доходов
     _accounts = []  # счета
     _last_update_time = None  # последнее обновление
+    _version = 0  # версия снимка: увеличивается при изменении категорий или счетов
 
     def __init__(self):
         raise RuntimeError("Создание экземпляров класса Category не допускается. "
@@ -122,20 +193,34 @@ class Category:
         cls._update()
         return cls._accounts
 
+    @classmethod
+    def get_version(cls) -> int:
+        """
+        Версия снимка категорий и счетов: меняется, только когда они изменились в таблице.
+        Используется как ключ кэшей, построенных из категорий (грамматика Vosk, подсказка Whisper).
+        """
+        cls._update()
+        return cls._version
+
     @classmethod
     def _update(cls):
-        LOGGER.info("Update started.")
         if cls._last_update_time is None or datetime.now() - cls._last_update_time >= timedelta(minutes=5):
             LOGGER.info("Updating categories...")  # Для демонстрации, что метод вызывается
-            cls._expenses = get_values(cell_range=ConfigRange.expenses, transform_to_single_list=True)
-            cls._incomes = get_values(cell_range=ConfigRange.incomes, transform_to_single_list=True)
-            cls._accounts = get_values(cell_range=ConfigRange.accounts, transform_to_single_list=True)
+            with span("sheets.categories_update"):
+                expenses = get_values(cell_range=ConfigRange.expenses, transform_to_single_list=True,
+                                      priority=Priority.background)
+                incomes = get_values(cell_range=ConfigRange.incomes, transform_to_single_list=True,
+                                     priority=Priority.background)
+                accounts = get_values(cell_range=ConfigRange.accounts, transform_to_single_list=True,
+                                      priority=Priority.background)
+            if (expenses, incomes, accounts) != (cls._expenses, cls._incomes, cls._accounts):
+                cls._expenses, cls._incomes, cls._accounts = expenses, incomes, accounts
+                cls._version += 1
             cls._last_update_time = datetime.now()
-            LOGGER.info(f"{cls._expenses=}")
-            LOGGER.info(f"{cls._incomes=}")
-            LOGGER.info(f"{cls._accounts=}")
-        else:
-            LOGGER.info("Update not required: Less than 5 minutes since the last update.")
+            LOGGER.info("Categories updated: %d expenses, %d incomes, %d accounts",
+                        len(cls._expenses), len(cls._incomes), len(cls._accounts))
+            log_payload(LOGGER, "Categories", {"expenses": cls._expenses, "incomes": cls._incomes,
+                                               "accounts": cls._accounts})
 
 
 class Formulas(str, _GoogleBaseEnumClass):
@@ -294,22 +379,24 @@ class RequestData(BaseModel):
         return True, message
 
 
-def get_values(cell_range: str or ConfigRange, transform_to_single_list: bool = False) -> list:
+@traced("sheets.get_values")
+def get_values(cell_range: str or ConfigRange, transform_to_single_list: bool = False,
+               priority: int = Priority.user_read) -> list:
     """
     Получает значения из Google Sheets по указанному диапазону.
 
     Args:
         cell_range (str | ConfigRange): Диапазон ячеек.
         transform_to_single_list (bool): Преобразовать в одномерный список.
+        priority (int): Приоритет запроса в лимитере квоты (Priority).
 
     Returns:
         list: Список значений из Google Sheets.
     """
-    sheet = _SERVICE.spreadsheets()
-    result = (
-        sheet.values()
-        .get(spreadsheetId=SPREADSHEET_ID, range=cell_range)
-        .execute()
+    sheet = _get_service().spreadsheets()
+    result = _execute(
+        sheet.values().get(spreadsheetId=SPREADSHEET_ID, range=cell_range),
+        priority=priority
     )
     values = result.get("values", [])
 
@@ -323,6 +410,31 @@ def get_values(cell_range: str or ConfigRange, transform_to_single_list: bool =
     return values
 
 
+@traced("sheets.get_usage_counts")
+def get_usage_counts(rows: int, priority: int = Priority.background) -> Counter:
+    """
+    Считает, сколько раз категории и счета встречаются в последних rows операциях листов расходов
+    и доходов (новые строки вставляются над 7-й строкой). Оба листа читаются одним запросом.
+
+    Args:
+        rows (int): Количество последних строк каждого листа.
+        priority (int): Приоритет запроса в лимитере квоты (Priority).
+
+    Returns:
+        Counter: Название категории или счёта -> количество операций.
+    """
+    ranges = [f"'{list_name}'!C7:D{6 + rows}" for list_name in (ListName.expenses, ListName.incomes)]
+    result = _execute(
+        _get_service().spreadsheets().values().batchGet(spreadsheetId=SPREADSHEET_ID, ranges=ranges),
+        priority=priority
+    )
+    counts = Counter()
+    for value_range in result.get("valueRanges", []):
+        for row in value_range.get("values", []):
+            counts.update(value for value in row[:2] if value)
+    return counts
+
+
 def get_insert_row_above_request(list_name:  ListName, insert_above_row: int) -> dict:
     """
     Создает запрос для вставки новой строки в Google Sheets.
@@ -337,16 +449,14 @@ def get_insert_row_above_request(list_name:  ListName, insert_above_row: int) ->
     Raises:
         ValueError: Если ID листа не найден или равен 0.
     """
-    sheet_id = _SHEETS_IDS.get(list_name)
+    sheet_ids = _get_sheet_ids()
+    sheet_id = sheet_ids.get(list_name)
     
-    # Подробное логирование для отладки
-    LOGGER.info(f"Getting sheet_id for list_name: '{list_name}' (type: {type(list_name)})")
-    LOGGER.info(f"Available sheet keys: {list(_SHEETS_IDS.keys())}")
-    LOGGER.info(f"Sheet ID found: {sheet_id}")
+    LOGGER.debug("Sheet ID for '%s': %s", list_name, sheet_id)
     
     if sheet_id is None or sheet_id == 0:
         # Если ID не найден или равен 0, выведем ошибку
-        raise ValueError(f"Invalid sheet ID {sheet_id} for list name '{list_name}'. Available sheets: {list(_SHEETS_IDS.keys())}")
+        raise ValueError(f"Invalid sheet ID {sheet_id} for list name '{list_name}'. Available sheets: {list(sheet_ids.keys())}")
     
     insert_row_above_request = {
         "insertDimension": {
@@ -375,7 +485,7 @@ def get_update_cells_request(list_name: ListName, values_to_update: list, row_in
     """
     update_cells_request = {
         "updateCells": {
-            "start": {"sheetId": _SHEETS_IDS.get(list_name),
+            "start": {"sheetId": _get_sheet_ids().get(list_name),
                       "rowIndex": row_index,
                       "columnIndex": column_index},
             "rows": [{"values": values_to_update}],
@@ -395,65 +505,63 @@ def get_values_to_update_for_request(request_data: RequestData) -> list:
     Returns:
         list: Список значений для обновления в формате Google Sheets API.
     """
-    if request_data.list_name in (ListName.expenses, ListName.incomes):
-        if request_data.list_name == ListName.expenses:
-            categoty = request_data.expenses_category
-        else:
-            categoty = request_data.incomes_category
-        values_to_update = [
-            {"userEnteredValue": {"numberValue": request_data.date}},  # A3
-            {"userEnteredValue": {"formulaValue": Formulas.month}},  # B3
-            {"userEnteredValue": {"stringValue": categoty}},  # C3
-            {"userEnteredValue": {"stringValue": request_data.account}},  # D3
-            {"userEnteredValue": {"numberValue": request_data.amount}},  # E3
-            {"userEnteredValue": {"formulaValue": Formulas.sum_currency}},  # F3
-            {"userEnteredValue": {"stringValue": request_data.status}},  # G3
-            {"userEnteredValue": {"formulaValue": Formulas.main_sum}},  # H3
-            {"userEnteredValue": {"formulaValue": Formulas.main_sum_currency}},  # I3
-            {"userEnteredValue": {"stringValue": request_data.comment}},  # J3
-            # {"userEnteredValue": {"stringValue": request_data.debtor}},  # K3
-        ]
-        
-        # Add Telegram message ID to appropriate column based on list type
-        if request_data.telegram_message_id:
-            if request_data.list_name == ListName.expenses:
-                # Add empty cell for K3 (debtor) and telegram_message_id for L3
-                values_to_update.extend([
-                    {"userEnteredValue": {"stringValue": ""}},  # K3 - debtor
-                    {"userEnteredValue": {"stringValue": request_data.telegram_message_id}}  # L3
-                ])
-            elif request_data.list_name == ListName.incomes:
-                # Add telegram_message_id for K3
-                values_to_update.append(
-                    {"userEnteredValue": {"stringValue": request_data.telegram_message_id}}  # K3
-                )
-        return values_to_update
-
-    elif request_data.list_name == ListName.transfers:
-        values_to_update = [
-            {"userEnteredValue": {"numberValue": request_data.date}},  # A3
-            {"userEnteredValue": {"formulaValue": Formulas.month}},  # B3
-            {"userEnteredValue": {"stringValue": request_data.transfer_type}},  # C3
-            {"userEnteredValue": {"stringValue": request_data.account}},  # D3
-            {"userEnteredValue": {"stringValue": request_data.replenishment_account}},  # E3
-            {"userEnteredValue": {"numberValue": request_data.amount}},  # F3
-            {"userEnteredValue": {"formulaValue": Formulas.sum_currency}},  # G3
-            {"userEnteredValue": {"numberValue": request_data.replenishment_amount}},  # H3
-            {"userEnteredValue": {"formulaValue": Formulas.replenishment_currency_sum}},  # I3
-            {"userEnteredValue": {"stringValue": request_data.status}},  # J3
-            {"userEnteredValue": {"stringValue": request_data.comment}},  # K3
-        ]
-        
-        # Add Telegram message ID for transfers in column M
-        if request_data.telegram_message_id:
-            values_to_update.extend([
-                {"userEnteredValue": {"boolValue": False}},  # L3 - "Долг возвращен"
-                {"userEnteredValue": {"stringValue": request_data.telegram_message_id}}  # M3
-            ])
+    return _ROW_TEMPLATES[request_data.list_name].get_values(request_data)
 
-        return values_to_update
 
+class RawJson(str):
+    """
+    Тело запроса, уже сериализованное в JSON: клиент Sheets API отправляет его без json.dumps.
+    """
 
+
+class RowTemplate:
+    """
+    Прекомпилированная строка листа операций: формулы (неизменные ячейки) сериализуются в JSON один раз,
+    при записи строки заполняются только ячейки со значениями из RequestData.
+
+    Args:
+        cells (tuple): Ячейки по порядку столбцов: Formulas (неизменная ячейка) или кортеж
+            (тип значения Sheets API, функция RequestData -> значение).
+        optional_tail (int): Сколько последних ячеек (Telegram Message ID и предшествующие)
+            записывается, только если задан telegram_message_id.
+    """
+    def __init__(self, *cells, optional_tail: int = 0):
+        self._optional_tail = optional_tail
+        self._cells = []  # (готовая ячейка, None) или (None, (тип значения, функция))
+        self._fragments = []  # JSON-фрагменты: готовые ячейки целиком, для значений - префикс ячейки
+        for cell in cells:
+            if isinstance(cell, Formulas):
+                static_cell = {"userEnteredValue": {"formulaValue": cell.value}}
+                self._cells.append((static_cell, None))
+                self._fragments.append(_dumps(static_cell))
+            else:
+                value_type, getter = cell
+                self._cells.append((None, (value_type, getter)))
+                self._fragments.append(f'{{"userEnteredValue":{{"{value_type}":')
+
+    def get_values(self, request_data: RequestData) -> list:
+        """
+        Значения ячеек строки в формате Sheets API (неизменные ячейки - общие объекты, их нельзя изменять).
+        """
+        return [static_cell if static_cell is not None else {"userEnteredValue": {cell[0]: cell[1](request_data)}}
+                for static_cell, cell in self._get_cells(request_data)]
+
+    def to_json(self, request_data: RequestData) -> str:
+        """
+        JSON-массив ячеек строки, собранный из готовых фрагментов (то же, что json.dumps(get_values(...))).
+        """
+        parts = []
+        for fragment, (static_cell, cell) in zip(self._fragments, self._get_cells(request_data)):
+            parts.append(fragment if static_cell is not None else f"{fragment}{_dumps(cell[1](request_data))}}}}}")
+        return f"[{','.join(parts)}]"
+
+    def _get_cells(self, request_data: RequestData) -> list:
+        if self._optional_tail and not request_data.telegram_message_id:
+            return self._cells[:-self._optional_tail]
+        return self._cells
+
+
+@traced("sheets.delete_row")
 def delete_row_by_telegram_id(list_name: ListName, telegram_message_id: str) -> bool:
     """
     Удаляет строку из Google Sheets по Telegram message ID.
@@ -479,10 +587,10 @@ def delete_row_by_telegram_id(list_name: ListName, telegram_message_id: str) ->
             
         # Получаем все значения из столбца с Telegram IDs
         range_name = f"{list_name}!{column}:${column}"
-        result = _SERVICE.spreadsheets().values().get(
+        result = _execute(_get_service().spreadsheets().values().get(
             spreadsheetId=SPREADSHEET_ID,
             range=range_name
-        ).execute()
+        ))
         
         values = result.get('values', [])
         
@@ -501,7 +609,7 @@ def delete_row_by_telegram_id(list_name: ListName, telegram_message_id: str) ->
         delete_request = {
             "deleteDimension": {
                 "range": {
-                    "sheetId": _SHEETS_IDS.get(list_name),
+                    "sheetId": _get_sheet_ids().get(list_name),
                     "dimension": "ROWS",
                     "startIndex": row_to_delete - 1,  # -1 так как API использует 0-based индексы
                     "endIndex": row_to_delete
@@ -513,10 +621,10 @@ def delete_row_by_telegram_id(list_name: ListName, telegram_message_id: str) ->
             "requests": [delete_request]
         }
         
-        response = _SERVICE.spreadsheets().batchUpdate(
+        response = _execute(_get_service().spreadsheets().batchUpdate(
             spreadsheetId=SPREADSHEET_ID,
             body=batch_update_request
-        ).execute()
+        ), is_write=True, priority=Priority.user_write)
         
         LOGGER.info(f"Successfully deleted row {row_to_delete} with telegram_message_id {telegram_message_id} from {list_name}")
         return True
@@ -526,6 +634,7 @@ def delete_row_by_telegram_id(list_name: ListName, telegram_message_id: str) ->
         return False
 
 
+@traced("sheets.insert_row")
 def insert_and_update_row_batch_update(request_data: RequestData):
     """
     Выполняет пакетное обновление Google Sheets: вставляет новую строку и обновляет её значения.
@@ -546,113 +655,269 @@ def insert_and_update_row_batch_update(request_data: RequestData):
     insert_row_request = get_insert_row_above_request(list_name=request_data.list_name,
                                                       insert_above_row=7)
 
-    update_cells_request = get_update_cells_request(list_name=request_data.list_name,
-                                                    values_to_update=get_values_to_update_for_request(request_data))
+    # строка собирается из прекомпилированного шаблона листа сразу в JSON (см. RowTemplate)
+    start = {"sheetId": _get_sheet_ids().get(request_data.list_name), "rowIndex": 6, "columnIndex": 0}
+    row_json = _ROW_TEMPLATES[request_data.list_name].to_json(request_data)
+    update_cells_json = f'{{"updateCells":{{"start":{_dumps(start)},"rows":[{{"values":{row_json}}}],' \
+                        f'"fields":"userEnteredValue"}}}}'
 
-    body = {"requests": [insert_row_request, update_cells_request]}
+    body = RawJson(f'{{"requests":[{_dumps(insert_row_request)},{update_cells_json}]}}')
 
-    request = _SERVICE.spreadsheets().batchUpdate(spreadsheetId=SPREADSHEET_ID, body=body)
-    response = request.execute()
+    request = _get_service().spreadsheets().batchUpdate(spreadsheetId=SPREADSHEET_ID, body=body)
+    response = _execute(request, is_write=True, priority=Priority.user_write)
 
-    LOGGER.info(f"{response=}")
+    log_payload(LOGGER, "Sheets batchUpdate response", response)
 
     return response
 
 
+class Memory(BaseModel):
+    """
+    Воспоминание пользователя: одна строка листа #memory (A - текст, B - постоянный идентификатор).
+    """
+    id: str
+    text: str
+
+
 def get_memories() -> list[str]:
     """
-    Получает список сохранённых воспоминаний из ячейки A1 листа #memory.
-    
+    Получает список текстов сохранённых воспоминаний (см. get_memory_items).
+
     Returns:
         list[str]: Список воспоминаний. Пустой список, если воспоминаний нет.
     """
-    try:
-        cell_range = f"{ListName.memory}!A1"
-        values = get_values(cell_range)
-        
-        if not values or not values[0] or not values[0][0]:
-            return []
-        
-        memories_text = values[0][0]
-        memories = [m.strip() for m in memories_text.split('\n') if m.strip()]
-        return memories
-    except Exception as e:
-        LOGGER.error(f"Ошибка при получении воспоминаний: {e}")
-        return []
+    return [memory.text for memory in get_memory_items()]
+
 
+def get_memory_items() -> list[Memory]:
+    """
+    Получает сохранённые воспоминания из локального кэша; лист #memory перечитывается не чаще,
+    чем раз в MEMORY_CACHE_TTL секунд (изменения через бота попадают в кэш сразу).
 
+    Returns:
+        list[Memory]: Воспоминания в порядке строк листа. Пустой список, если их нет или лист недоступен.
+    """
+    with _MEMORY_LOCK:
+        if _MEMORY_CACHE.is_fresh():
+            return list(_MEMORY_CACHE.items)
+        stale = _MEMORY_CACHE.items
+
+    # лист читает один поток за раз (перевод старого формата выполняется один раз); пока он читает,
+    # остальные получают устаревший кэш, а если кэша ещё нет - ждут
+    if not _MEMORY_SHEET_LOCK.acquire(blocking=stale is None):
+        return list(stale)
+    try:
+        with _MEMORY_LOCK:
+            if _MEMORY_CACHE.is_fresh():
+                return list(_MEMORY_CACHE.items)
+            version = _MEMORY_CACHE.version
+        try:
+            items = _load_memories()
+        except Exception as e:
+            LOGGER.error(f"Ошибка при получении воспоминаний: {e}")
+            return list(stale or [])
+        with _MEMORY_LOCK:
+            # если во время чтения воспоминание добавили или удалили, прочитанный снимок уже устарел
+            if _MEMORY_CACHE.version == version:
+                _MEMORY_CACHE.items, _MEMORY_CACHE.loaded = items, time.monotonic()
+            return list(_MEMORY_CACHE.items if _MEMORY_CACHE.items is not None else items)
+    finally:
+        _MEMORY_SHEET_LOCK.release()
+
+
+@traced("sheets.add_memory")
 def add_memory(memory_text: str) -> bool:
     """
-    Добавляет новое воспоминание в ячейку A1 листа #memory.
-    
+    Добавляет воспоминание новой строкой листа #memory одним запросом values.append
+    (без чтения листа, поэтому одновременные добавления не затирают друг друга). Запрос выполняется
+    под _MEMORY_SHEET_LOCK, чтобы не попасть между чтением и перезаписью листа при переводе старого формата.
+
     Args:
         memory_text (str): Текст воспоминания для добавления.
-        
+
     Returns:
         bool: True если успешно добавлено, False в случае ошибки.
     """
     try:
-        current_memories = get_memories()
-        current_memories.append(memory_text.strip())
-        
-        new_memories_text = '\n'.join(current_memories)
-        
-        body = {
-            "values": [[new_memories_text]]
-        }
-        
-        cell_range = f"{ListName.memory}!A1"
-        request = _SERVICE.spreadsheets().values().update(
+        memory = Memory(id=uuid.uuid4().hex[:8], text=memory_text.strip())
+        request = _get_service().spreadsheets().values().append(
             spreadsheetId=SPREADSHEET_ID,
-            range=cell_range,
+            range=f"'{ListName.memory}'!A:B",
             valueInputOption="RAW",
-            body=body
+            insertDataOption="INSERT_ROWS",
+            body={"values": [[memory.text, memory.id]]}
         )
-        response = request.execute()
-        
-        LOGGER.info(f"Воспоминание добавлено: {memory_text}")
+        with _MEMORY_SHEET_LOCK:  # перевод старого формата переписывает строки и затёр бы добавленную
+            _execute(request, is_write=True, priority=Priority.user_write)
+
+        with _MEMORY_LOCK:
+            _MEMORY_CACHE.version += 1
+            if _MEMORY_CACHE.items is not None and memory not in _MEMORY_CACHE.items:
+                _MEMORY_CACHE.items.append(memory)
+
+        LOGGER.info(f"Воспоминание добавлено: {memory.text}")
         return True
     except Exception as e:
         LOGGER.error(f"Ошибка при добавлении воспоминания: {e}")
         return False
 
 
-def delete_memory(memory_index: int) -> bool:
+@traced("sheets.delete_memory")
+def delete_memory(memory_id: str) -> bool:
     """
-    Удаляет воспоминание по индексу из ячейки A1 листа #memory.
-    
+    Удаляет строку воспоминания из листа #memory по его идентификатору. Поиск строки и удаление
+    выполняются под _MEMORY_SHEET_LOCK, поэтому другие удаления и перевод старого формата
+    не сдвигают строки между ними; перед удалением идентификатор ещё раз проверяется в самой строке.
+
     Args:
-        memory_index (int): Индекс воспоминания для удаления (0-based).
-        
+        memory_id (str): Идентификатор воспоминания (Memory.id).
+
     Returns:
-        bool: True если успешно удалено, False в случае ошибки.
+        bool: True если успешно удалено, False если не найдено или произошла ошибка.
     """
     try:
-        current_memories = get_memories()
-        
-        if memory_index < 0 or memory_index >= len(current_memories):
-            LOGGER.error(f"Неверный индекс воспоминания: {memory_index}")
-            return False
-        
-        deleted_memory = current_memories.pop(memory_index)
-        
-        new_memories_text = '\n'.join(current_memories) if current_memories else ""
-        
-        body = {
-            "values": [[new_memories_text]]
-        }
-        
-        cell_range = f"{ListName.memory}!A1"
-        request = _SERVICE.spreadsheets().values().update(
-            spreadsheetId=SPREADSHEET_ID,
-            range=cell_range,
-            valueInputOption="RAW",
-            body=body
-        )
-        response = request.execute()
-        
-        LOGGER.info(f"Воспоминание удалено: {deleted_memory}")
+        with _MEMORY_SHEET_LOCK:
+            # строку ищем по идентификатору перед удалением: номера строк меняются после чужих удалений
+            ids = [row[0] if row else "" for row in get_values(f"'{ListName.memory}'!B:B")]
+            if memory_id not in ids:
+                LOGGER.error(f"Воспоминание не найдено: {memory_id}")
+                return False
+            row_index = ids.index(memory_id)
+
+            # строку могли сдвинуть вручную в таблице, пока шёл поиск
+            if get_values(f"'{ListName.memory}'!B{row_index + 1}") != [[memory_id]]:
+                LOGGER.error(f"Строка воспоминания {memory_id} сдвинулась, удаление отменено")
+                return False
+
+            delete_request = {
+                "deleteDimension": {
+                    "range": {
+                        "sheetId": _get_sheet_ids().get(ListName.memory),
+                        "dimension": "ROWS",
+                        "startIndex": row_index,
+                        "endIndex": row_index + 1
+                    }
+                }
+            }
+            _execute(_get_service().spreadsheets().batchUpdate(
+                spreadsheetId=SPREADSHEET_ID,
+                body={"requests": [delete_request]}
+            ), is_write=True, priority=Priority.user_write)
+
+        with _MEMORY_LOCK:
+            _MEMORY_CACHE.version += 1
+            if _MEMORY_CACHE.items is not None:
+                _MEMORY_CACHE.items = [memory for memory in _MEMORY_CACHE.items if memory.id != memory_id]
+
+        LOGGER.info(f"Воспоминание удалено: {memory_id}")
         return True
     except Exception as e:
         LOGGER.error(f"Ошибка при удалении воспоминания: {e}")
         return False
+
+
+class _MemoryCache:
+    items: Optional[list[Memory]] = None
+    loaded: float = 0.0
+    version: int = 0  # увеличивается при каждом добавлении и удалении через бота
+
+    def is_fresh(self) -> bool:
+        return self.items is not None and time.monotonic() - self.loaded < MEMORY_CACHE_TTL
+
+
+_MEMORY_CACHE = _MemoryCache()
+_MEMORY_LOCK = threading.Lock()  # только для _MEMORY_CACHE, без сетевых запросов внутри
+_MEMORY_SHEET_LOCK = threading.Lock()  # чтение с переводом формата, добавление и удаление строк #memory
+
+
+@traced("sheets.get_memories")
+def _load_memories() -> list[Memory]:
+    """
+    Читает лист #memory. Строки без идентификатора (старый формат: все воспоминания в ячейке A1,
+    разделённые переносом строки, или строки, добавленные в таблице вручную) разбиваются по строкам
+    текста, получают идентификаторы и переписываются одним запросом.
+    """
+    rows = get_values(f"'{ListName.memory}'!A:B")
+    if all(len(row) >= 2 and row[1] for row in rows if row and row[0]):
+        return [Memory(text=row[0], id=row[1]) for row in rows if row and row[0]]
+
+    memories = []
+    for row in rows:
+        if row and row[0] and len(row) >= 2 and row[1]:
+            memories.append(Memory(text=row[0], id=row[1]))
+        elif row and row[0]:
+            memories.extend(Memory(id=uuid.uuid4().hex[:8], text=line.strip())
+                            for line in row[0].split("\n") if line.strip())
+
+    values = [[memory.text, memory.id] for memory in memories]
+    values += [["", ""]] * max(0, len(rows) - len(values))  # очистить оставшиеся строки
+    _execute(_get_service().spreadsheets().values().update(
+        spreadsheetId=SPREADSHEET_ID,
+        range=f"'{ListName.memory}'!A1:B{max(1, len(values))}",
+        valueInputOption="RAW",
+        body={"values": values}
+    ), is_write=True, priority=Priority.user_write)
+    LOGGER.info(f"Воспоминания переведены в формат 'одна строка - одно воспоминание': {len(memories)}")
+    return memories
+
+
+class _RawJsonModel(JsonModel):
+    """
+    JsonModel, пропускающий тела RawJson без повторной сериализации. Тело отдаётся байтами UTF-8:
+    _dumps не экранирует кириллицу, а строку httplib2 кодирует в Latin-1 и content-length считает в символах.
+    """
+    def serialize(self, body_value):
+        if isinstance(body_value, RawJson):
+            return body_value.encode("utf-8")
+        return super().serialize(body_value)
+
+
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode  # один кодировщик вместо json.dumps(...)
+
+
+_STRING, _NUMBER, _BOOL = "stringValue", "numberValue", "boolValue"
+
+_ROW_TEMPLATES = {
+    # ↙️Расходы: A-J, K - должник, L - Telegram Message ID
+    ListName.expenses: RowTemplate((_NUMBER, lambda data: data.date),
+                                   Formulas.month,
+                                   (_STRING, lambda data: data.expenses_category),
+                                   (_STRING, lambda data: data.account),
+                                   (_NUMBER, lambda data: data.amount),
+                                   Formulas.sum_currency,
+                                   (_STRING, lambda data: data.status),
+                                   Formulas.main_sum,
+                                   Formulas.main_sum_currency,
+                                   (_STRING, lambda data: data.comment),
+                                   (_STRING, lambda data: ""),
+                                   (_STRING, lambda data: data.telegram_message_id),
+                                   optional_tail=2),
+    # ↗️Доходы: A-J, K - Telegram Message ID
+    ListName.incomes: RowTemplate((_NUMBER, lambda data: data.date),
+                                  Formulas.month,
+                                  (_STRING, lambda data: data.incomes_category),
+                                  (_STRING, lambda data: data.account),
+                                  (_NUMBER, lambda data: data.amount),
+                                  Formulas.sum_currency,
+                                  (_STRING, lambda data: data.status),
+                                  Formulas.main_sum,
+                                  Formulas.main_sum_currency,
+                                  (_STRING, lambda data: data.comment),
+                                  (_STRING, lambda data: data.telegram_message_id),
+                                  optional_tail=1),
+    # 🔄Переводы: A-K, L - "Долг возвращен", M - Telegram Message ID
+    ListName.transfers: RowTemplate((_NUMBER, lambda data: data.date),
+                                    Formulas.month,
+                                    (_STRING, lambda data: data.transfer_type),
+                                    (_STRING, lambda data: data.account),
+                                    (_STRING, lambda data: data.replenishment_account),
+                                    (_NUMBER, lambda data: data.amount),
+                                    Formulas.sum_currency,
+                                    (_NUMBER, lambda data: data.replenishment_amount),
+                                    Formulas.replenishment_currency_sum,
+                                    (_STRING, lambda data: data.status),
+                                    (_STRING, lambda data: data.comment),
+                                    (_BOOL, lambda data: False),
+                                    (_STRING, lambda data: data.telegram_message_id),
+                                    optional_tail=2),
+}
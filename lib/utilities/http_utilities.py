@@ -0,0 +1,161 @@
+import asyncio
+import json
+import ssl
+import time
+from http import HTTPStatus
+from typing import Awaitable, Callable, Optional
+
+from pydantic import BaseModel
+
+from lib.utilities.metrics_utilities import observe_latency, increment
+
+
+# LOGGING
+
+
+from lib.utilities.log_utilities import get_logger
+LOGGER = get_logger(__name__)
+
+
+# public
+
+
+class HttpRequest(BaseModel):
+    """
+    Входящий HTTP-запрос (заголовки - в нижнем регистре).
+    """
+    method: str
+    path: str
+    headers: dict[str, str] = {}
+    body: bytes = b""
+
+
+class HttpResponse(BaseModel):
+    """
+    Ответ обработчика HTTP-запроса.
+    """
+    status: int = 200
+    body: bytes = b""
+    content_type: str = "text/plain; charset=utf-8"
+
+    @classmethod
+    def json(cls, data, status: int = 200) -> "HttpResponse":
+        return cls(status=status,
+                   body=json.dumps(data, ensure_ascii=False).encode(),
+                   content_type="application/json; charset=utf-8")
+
+
+class HttpServer:
+    """
+    Минимальный асинхронный HTTP/1.1 сервер на asyncio (keep-alive, Content-Length, TLS) для
+    webhook Telegram и служебных маршрутов (/health, /metrics). Работает в event loop бота.
+
+    Args:
+        max_body_size (int): Максимальный размер тела запроса в байтах.
+        idle_timeout (float): Время ожидания следующего запроса в keep-alive соединении.
+    """
+    def __init__(self, max_body_size: int = 1024 * 1024, idle_timeout: float = 60.0):
+        self._max_body_size = max_body_size
+        self._idle_timeout = idle_timeout
+        self._routes: dict[tuple[str, str], Callable[[HttpRequest], Awaitable[HttpResponse]]] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def add_route(self, method: str, path: str, handler: Callable[[HttpRequest], Awaitable[HttpResponse]]) -> None:
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self, host: str, port: int, ssl_context: ssl.SSLContext = None) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, host, port, ssl=ssl_context)
+        scheme = "https" if ssl_context else "http"
+        LOGGER.info(f"HTTP server listening on {scheme}://{host}:{port}, routes: {list(self._routes)}")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self._idle_timeout)
+                except _BadRequest as e:
+                    writer.write(_serialize(HttpResponse(status=e.status), keep_alive=False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                writer.write(_serialize(await self._dispatch(request), keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[HttpRequest]:
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        try:
+            method, target, _ = request_line.decode("latin-1").split()
+        except ValueError:
+            raise _BadRequest(HTTPStatus.BAD_REQUEST)
+
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise _BadRequest(HTTPStatus.BAD_REQUEST)
+        if length > self._max_body_size:
+            raise _BadRequest(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        body = await reader.readexactly(length) if length else b""
+        return HttpRequest(method=method.upper(), path=target.split("?")[0], headers=headers, body=body)
+
+    async def _dispatch(self, request: HttpRequest) -> HttpResponse:
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            return HttpResponse(status=HTTPStatus.NOT_FOUND)
+
+        started = time.monotonic()
+        try:
+            return await handler(request)
+        except Exception as e:
+            increment("http.errors")
+            LOGGER.error(f"HTTP handler {request.method} {request.path} failed: {e}")
+            return HttpResponse(status=HTTPStatus.INTERNAL_SERVER_ERROR)
+        finally:
+            observe_latency("http.request", time.monotonic() - started)
+
+
+def get_ssl_context(cert_path: str, key_path: str) -> ssl.SSLContext:
+    """
+    Создаёт серверный TLS-контекст (подходит и для самоподписанного сертификата).
+    """
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_path, key_path)
+    return context
+
+
+# private
+
+
+class _BadRequest(Exception):
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status
+
+
+def _serialize(response: HttpResponse, keep_alive: bool) -> bytes:
+    head = (f"HTTP/1.1 {response.status} {HTTPStatus(response.status).phrase}\r\n"
+            f"Content-Type: {response.content_type}\r\n"
+            f"Content-Length: {len(response.body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + response.body
@@ -0,0 +1,108 @@
+import asyncio
+import os
+import time
+
+from config import VOICE_FILES_RETENTION, VOICE_FILES_MAX_AGE, VOICE_FILES_MAX_BYTES, VOICE_FILES_MIN_AGE, \
+    VOICE_FILES_CLEANUP_INTERVAL
+from lib.utilities.metrics_utilities import increment, set_gauge
+from lib.utilities.os_utilities import get_voice_messages_path
+
+
+# LOGGING
+
+
+from lib.utilities.log_utilities import get_logger
+LOGGER = get_logger(__name__)
+
+
+# public
+
+
+def remove_voice_files(*paths: str) -> int:
+    """
+    Удаляет временные аудиофайлы обработанного сообщения (.oga, .wav).
+    Ничего не делает, если включено хранение файлов (VOICE_FILES_RETENTION).
+
+    Args:
+        *paths (str): Пути к файлам; None пропускаются.
+
+    Returns:
+        int: Освобождено байт.
+    """
+    if VOICE_FILES_RETENTION:
+        return 0
+    reclaimed = sum(_remove_file(path) for path in paths if path)
+    increment("janitor.reclaimed_bytes", reclaimed)
+    return reclaimed
+
+
+def cleanup_directory(path: str, max_age: float = VOICE_FILES_MAX_AGE, max_bytes: int = VOICE_FILES_MAX_BYTES,
+                      min_age: float = VOICE_FILES_MIN_AGE) -> int:
+    """
+    Удаляет файлы старше max_age, затем - давно не использованные (LRU по времени доступа или изменения),
+    пока размер папки больше max_bytes. Файлы моложе min_age по размеру не удаляются.
+
+    Args:
+        path (str): Папка.
+        max_age (float): Максимальный возраст файла в секундах.
+        max_bytes (int): Максимальный суммарный размер файлов в байтах.
+        min_age (float): Минимальный возраст файла для удаления по размеру в секундах.
+
+    Returns:
+        int: Освобождено байт.
+    """
+    now = time.time()
+    files = []  # (время последнего использования, размер, путь)
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    files.append((max(stat.st_atime, stat.st_mtime), stat.st_size, entry.path))
+            except FileNotFoundError:
+                continue
+    files.sort()
+
+    reclaimed = 0
+    total = sum(size for _, size, _ in files)
+    for used, size, file_path in files:
+        if now - used <= max_age and (total <= max_bytes or now - used < min_age):
+            continue
+        removed = _remove_file(file_path)
+        reclaimed += removed
+        total -= removed
+
+    set_gauge("voice_files.bytes", total)
+    increment("janitor.reclaimed_bytes", reclaimed)
+    return reclaimed
+
+
+async def run_janitor(path: str = None, interval: float = VOICE_FILES_CLEANUP_INTERVAL) -> None:
+    """
+    Фоновая задача: раз в interval секунд очищает папку (по умолчанию voice_messages) через cleanup_directory.
+    Обход папки выполняется в отдельном потоке, чтобы не блокировать event loop.
+    """
+    path = path or get_voice_messages_path(create=True)
+    while True:
+        try:
+            reclaimed = await asyncio.to_thread(cleanup_directory, path)
+            if reclaimed:
+                LOGGER.info(f"Janitor reclaimed {reclaimed / 1024 / 1024:.1f} MB in {path}")
+        except OSError as e:
+            LOGGER.error(f"Janitor failed to clean {path}: {e}")
+        await asyncio.sleep(interval)
+
+
+# private
+
+
+def _remove_file(path: str) -> int:
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return 0
+    except OSError as e:
+        LOGGER.warning(f"Failed to remove {path}: {e}")
+        return 0
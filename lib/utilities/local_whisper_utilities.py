@@ -0,0 +1,207 @@
+import asyncio
+import bisect
+from functools import lru_cache
+from typing import Awaitable, Callable, Optional
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+try:
+    import faster_whisper
+    import numpy as np  # устанавливается вместе с faster-whisper
+    from faster_whisper import WhisperModel
+except ImportError as e:  # опциональная зависимость, нужна только бэкенду "local_whisper"
+    raise ImportError("Backend 'local_whisper' requires faster-whisper: pip install faster-whisper") from e
+
+from config import LOCAL_WHISPER_MODEL, LOCAL_WHISPER_COMPUTE_TYPE, LOCAL_WHISPER_THREADS, LOCAL_WHISPER_LANGUAGE, \
+    LOCAL_WHISPER_BEAM_SIZE, LOCAL_WHISPER_BATCH_SIZE, LOCAL_WHISPER_BATCH_WAIT
+from lib.utilities.checkpoint_utilities import Checkpoint
+from lib.utilities.ffmpeg_utilities import SAMPLE_RATE
+from lib.utilities.metrics_utilities import set_gauge
+from lib.utilities.openai_utilities import get_finance_prompt
+from lib.utilities.stt_utilities import Audio2TextModels, load_voice_pcm
+from lib.utilities.tracing_utilities import traced, span
+from lib.utilities.vad_utilities import split_speech
+
+
+# LOGGING
+
+
+from lib.utilities.log_utilities import get_logger
+LOGGER = get_logger(__name__)
+
+
+# public
+
+
+async def transcribe_voice(update: Update,
+                           context: ContextTypes.DEFAULT_TYPE,
+                           on_partial: Optional[Callable[[str], Awaitable[None]]] = None,
+                           checkpoint: Checkpoint = None) -> tuple[str, str]:
+    """
+    Бэкенд "local_whisper": Whisper (faster-whisper, CTranslate2, int8) на CPU без отправки аудио в сеть.
+    Фрагменты речи голосовых, распознаваемых одновременно, декодируются одним пакетом.
+
+    Returns:
+        tuple[str, str]: Распознанный текст и sha256 аудиофайла.
+    """
+    audio = await load_voice_pcm(update, context, Audio2TextModels.local_whisper, checkpoint)
+    if audio.cached_text is not None:
+        return audio.cached_text, audio.content_hash
+
+    segments = split_speech(audio.pcm, audio.sample_rate)
+    if not segments:
+        LOGGER.info("No speech detected in voice message")
+        return "", audio.content_hash
+
+    text = await _BATCHER.transcribe([_to_float32(segment) for segment in segments])
+    LOGGER.info(text)
+    return text, audio.content_hash
+
+
+@traced("local_whisper.transcribe")
+def audio2text_segments(pcm_segments: list[bytes], prompt: str = None) -> str:
+    """
+    Синхронно распознаёт фрагменты одной записи (PCM s16le 16 кГц моно), например для бенчмарка.
+
+    Returns:
+        str: Распознанный текст фрагментов в исходном порядке.
+    """
+    return _transcribe_batch([[_to_float32(segment) for segment in pcm_segments]], prompt)[0]
+
+
+def warm_up() -> None:
+    """
+    Загружает модель заранее (при старте бота), а не при первом сообщении.
+    """
+    _get_model()
+
+
+# private
+
+
+class _Batcher:
+    """
+    Собирает фрагменты речи голосовых, ожидающих распознавания одновременно, в один пакетный вызов модели:
+    первый запрос ждёт остальных не дольше max_wait секунд или до max_batch фрагментов.
+
+    Args:
+        max_batch (int): Максимальное число фрагментов в пакете.
+        max_wait (float): Время ожидания фрагментов других голосовых в секундах.
+    """
+    def __init__(self, max_batch: int, max_wait: float):
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None  # создаётся внутри event loop
+        self._worker: Optional[asyncio.Task] = None
+
+    async def transcribe(self, segments: list[np.ndarray]) -> str:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((segments, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._queue.get()]
+            deadline = loop.time() + self._max_wait
+            while sum(len(segments) for segments, _ in items) < self._max_batch:
+                try:
+                    items.append(await asyncio.wait_for(self._queue.get(), max(0.0, deadline - loop.time())))
+                except asyncio.TimeoutError:
+                    break
+
+            set_gauge("local_whisper.batch_notes", len(items))
+            try:
+                texts = await asyncio.to_thread(_transcribe_batch, [segments for segments, _ in items])
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future), text in zip(items, texts):
+                    if not future.done():
+                        future.set_result(text)
+
+
+_BATCHER = _Batcher(LOCAL_WHISPER_BATCH_SIZE, LOCAL_WHISPER_BATCH_WAIT)
+
+
+@lru_cache(maxsize=None)
+def _get_model() -> WhisperModel:
+    """
+    Загружает модель один раз за время жизни процесса.
+    """
+    LOGGER.info(f"Loading faster-whisper model '{LOCAL_WHISPER_MODEL}' ({LOCAL_WHISPER_COMPUTE_TYPE}, "
+                f"{LOCAL_WHISPER_THREADS} threads)")
+    return WhisperModel(LOCAL_WHISPER_MODEL, device="cpu", compute_type=LOCAL_WHISPER_COMPUTE_TYPE,
+                        cpu_threads=LOCAL_WHISPER_THREADS)
+
+
+@lru_cache(maxsize=None)
+def _get_pipeline():
+    """
+    Пакетный конвейер faster-whisper (версия 1.1+); None - в старых версиях пакета.
+    """
+    pipeline_class = getattr(faster_whisper, "BatchedInferencePipeline", None)
+    return pipeline_class(model=_get_model()) if pipeline_class else None
+
+
+def _transcribe_batch(notes: list[list[np.ndarray]], prompt: str = None) -> list[str]:
+    """
+    Распознаёт фрагменты нескольких голосовых одним вызовом: фрагменты склеиваются в одну запись,
+    границы передаются в clip_timestamps, а распознанные сегменты возвращаются голосовым по времени начала.
+
+    Returns:
+        list[str]: Текст каждого голосового в порядке notes.
+    """
+    prompt = get_finance_prompt() if prompt is None else prompt
+    chunks = [(note_index, segment) for note_index, segments in enumerate(notes) for segment in segments]
+    pipeline = _get_pipeline()
+
+    texts = [[] for _ in notes]
+    if pipeline is None or len(chunks) == 1:
+        for note_index, segment in chunks:
+            texts[note_index].append(_transcribe_segment(segment, prompt))
+        return [" ".join(filter(None, note_texts)) for note_texts in texts]
+
+    starts, clip_timestamps, offset = [], [], 0
+    for _, segment in chunks:
+        starts.append(offset / SAMPLE_RATE)
+        clip_timestamps.append({"start": offset / SAMPLE_RATE, "end": (offset + len(segment)) / SAMPLE_RATE})
+        offset += len(segment)
+
+    with span("local_whisper.batch", notes=len(notes), segments=len(chunks)):
+        segments, _ = pipeline.transcribe(np.concatenate([segment for _, segment in chunks]),
+                                          language=LOCAL_WHISPER_LANGUAGE,
+                                          beam_size=LOCAL_WHISPER_BEAM_SIZE,
+                                          batch_size=LOCAL_WHISPER_BATCH_SIZE,
+                                          initial_prompt=prompt or None,
+                                          vad_filter=False,
+                                          clip_timestamps=clip_timestamps)
+        for segment in segments:
+            # сегмент принадлежит фрагменту, внутри которого он начинается (с допуском на округление)
+            chunk_index = max(0, bisect.bisect_right(starts, segment.start + 0.01) - 1)
+            texts[chunks[chunk_index][0]].append(segment.text.strip())
+
+    return [" ".join(filter(None, note_texts)) for note_texts in texts]
+
+
+def _transcribe_segment(segment: np.ndarray, prompt: str) -> str:
+    with span("local_whisper.segment"):
+        segments, _ = _get_model().transcribe(segment,
+                                              language=LOCAL_WHISPER_LANGUAGE,
+                                              beam_size=LOCAL_WHISPER_BEAM_SIZE,
+                                              initial_prompt=prompt or None,
+                                              vad_filter=False)
+        return " ".join(part.text.strip() for part in segments)
+
+
+def _to_float32(pcm: bytes) -> np.ndarray:
+    # faster-whisper принимает float32 16 кГц (SAMPLE_RATE после ffmpeg)
+    return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
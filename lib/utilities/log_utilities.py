@@ -1,10 +1,23 @@
+import atexit
+import contextvars
+import copy
+import json
 import logging
 import os
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional
+
+from config import LOG_PAYLOAD_SAMPLE_RATE, LOG_PAYLOAD_MAX_PER_MINUTE, LOG_PAYLOAD_MAX_LENGTH
 
 
 def get_logger(name: str = "main"):
     """
     Создаёт и возвращает логгер с заданным именем.
+    Записи передаются через очередь в отдельный поток, поэтому вывод логов не блокирует event loop.
 
     Args:
         name (str): Имя логгера.
@@ -14,17 +27,155 @@ def get_logger(name: str = "main"):
     """
     # Проверяем, существует ли логгер с таким именем
     logger = logging.getLogger(name)
-    if not logger.hasHandlers():
+    if not logger.handlers:
         # Если обработчиков нет, настраиваем логгер
-        formatter = logging.Formatter(
-            fmt="%(name)s %(asctime)s %(levelname)s %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S"
-        )
-        handler = logging.StreamHandler()
-        handler.setFormatter(formatter)
-
         logger.setLevel(logging.DEBUG if os.getenv("DEV") else logging.INFO)
-        logger.addHandler(handler)
+        logger.addHandler(_get_queue_handler())
         logger.propagate = False  # Отключаем распространение сообщений к родительским логгерам
 
     return logger
+
+
+def setup_root_logging(level: int = logging.INFO) -> None:
+    """
+    Направляет корневой логгер (сторонние библиотеки) в ту же очередь и формат, что и get_logger.
+    """
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _get_queue_handler() not in root.handlers:
+        root.addHandler(_get_queue_handler())
+
+
+def get_correlation_id() -> str:
+    return _CORRELATION_ID.get()
+
+
+def set_correlation_id(value: str) -> None:
+    """
+    Помечает идентификатором (например, сообщения Telegram) все последующие записи текущей задачи asyncio.
+    Наследуется задачами и asyncio.to_thread, созданными после вызова.
+    """
+    _CORRELATION_ID.set(value)
+
+
+def log_payload(logger: logging.Logger, message: str, payload: Any, key: str = None) -> None:
+    """
+    Логирует большой объект (ответ API, данные запроса) на уровне DEBUG с выборкой и ограничением
+    частоты. Объект не форматируется, если запись не будет выведена; длинный вывод обрезается.
+
+    Args:
+        logger (logging.Logger): Логгер.
+        message (str): Описание объекта.
+        payload (Any): Объект.
+        key (str, optional): Ключ ограничения частоты; по умолчанию - message.
+    """
+    if logger.isEnabledFor(logging.DEBUG) and _PAYLOAD_SAMPLER.should_log(key or message):
+        logger.debug("%s: %s", message, _Truncated(payload, LOG_PAYLOAD_MAX_LENGTH))
+
+
+# private
+
+
+_CORRELATION_ID: contextvars.ContextVar[str] = contextvars.ContextVar("correlation_id", default="-")
+_FORMAT = "%(name)s %(asctime)s %(levelname)s [%(correlation_id)s] %(message)s"
+_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class _CorrelationFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = _CORRELATION_ID.get()
+        return True
+
+
+class _JsonFormatter(logging.Formatter):
+    """
+    Одна JSON-строка на запись (LOG_FORMAT=json) для сбора логов внешними системами.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        data = {"time": self.formatTime(record, _DATE_FORMAT),
+                "level": record.levelname,
+                "logger": record.name,
+                "correlation_id": getattr(record, "correlation_id", "-"),
+                "message": record.getMessage()}
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class _Truncated:
+    """
+    Откладывает repr объекта до форматирования записи и обрезает результат.
+    """
+    def __init__(self, payload: Any, max_length: int):
+        self._payload = payload
+        self._max_length = max_length
+
+    def __str__(self) -> str:
+        text = repr(self._payload)
+        if len(text) > self._max_length:
+            return f"{text[:self._max_length]}... ({len(text)} chars)"
+        return text
+
+
+class _LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler, который не форматирует запись в вызывающем потоке (стандартный prepare вызывает
+    format и очищает args и exc_info): в очередь кладётся копия записи, а сообщение, repr объектов
+    (_Truncated) и traceback формируются в потоке QueueListener.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return copy.copy(record)
+
+
+class _PayloadSampler:
+    """
+    Пропускает долю sample_rate записей, но не более max_per_minute в минуту для каждого ключа.
+    """
+    def __init__(self, sample_rate: float, max_per_minute: int):
+        self._sample_rate = sample_rate
+        self._max_per_minute = max_per_minute
+        self._lock = threading.Lock()
+        self._windows: dict[str, tuple[float, int]] = {}  # key -> (начало минуты, количество)
+
+    def should_log(self, key: str) -> bool:
+        if random.random() >= self._sample_rate:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            started, count = self._windows.get(key, (now, 0))
+            if now - started >= 60:
+                started, count = now, 0
+            if count >= self._max_per_minute:
+                return False
+            self._windows[key] = (started, count + 1)
+            return True
+
+
+_PAYLOAD_SAMPLER = _PayloadSampler(LOG_PAYLOAD_SAMPLE_RATE, LOG_PAYLOAD_MAX_PER_MINUTE)
+_QUEUE_HANDLER: Optional[QueueHandler] = None
+_QUEUE_LOCK = threading.Lock()
+
+
+def _get_queue_handler() -> QueueHandler:
+    """
+    Общий QueueHandler: запись (с correlation_id текущего контекста) кладётся в очередь,
+    а QueueListener выводит её в stderr из отдельного потока.
+    """
+    global _QUEUE_HANDLER
+    with _QUEUE_LOCK:
+        if _QUEUE_HANDLER is None:
+            if os.getenv("LOG_FORMAT", "").lower() == "json":
+                formatter = _JsonFormatter()
+            else:
+                formatter = logging.Formatter(fmt=_FORMAT, datefmt=_DATE_FORMAT)
+            stream_handler = logging.StreamHandler()
+            stream_handler.setFormatter(formatter)
+
+            log_queue = queue.SimpleQueue()
+            listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+            listener.start()
+            atexit.register(listener.stop)  # дописать оставшиеся записи при завершении процесса
+
+            _QUEUE_HANDLER = _LazyQueueHandler(log_queue)
+            _QUEUE_HANDLER.addFilter(_CorrelationFilter())
+    return _QUEUE_HANDLER
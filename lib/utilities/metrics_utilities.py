@@ -0,0 +1,204 @@
+import asyncio
+import os
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, deque
+from typing import Optional
+
+
+# public
+
+
+class LatencyWindow:
+    """
+    Скользящее окно последних измерений задержки для расчёта перцентилей.
+    """
+    def __init__(self, size: int = 500):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Возвращает перцентиль q (0..1) по окну или None, если измерений нет.
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(q * len(samples)))
+        return samples[index]
+
+    def summary(self) -> dict:
+        return {"count": len(self),
+                "p50": self.percentile(0.5),
+                "p90": self.percentile(0.9),
+                "p99": self.percentile(0.99)}
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными границами (в секундах) для экспорта в формате Prometheus.
+    В отличие от LatencyWindow хранит все измерения с момента запуска, а не последние.
+    """
+    def __init__(self, buckets: tuple = None):
+        self.buckets = buckets or LATENCY_BUCKETS
+        self._counts = [0] * (len(self.buckets) + 1)  # последний - больше всех границ (+Inf)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._counts[bisect_left(self.buckets, value)] += 1
+            self._sum += value
+
+    def get_cumulative_counts(self) -> tuple[list[int], float]:
+        """
+        Returns:
+            tuple[list[int], float]: Накопленные количества для каждой границы и +Inf, сумма значений.
+        """
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative, running = [], 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total
+
+
+def get_latency_window(name: str) -> LatencyWindow:
+    """
+    Возвращает (создаёт при необходимости) окно задержек с заданным именем.
+    """
+    with _LOCK:
+        if name not in _WINDOWS:
+            _WINDOWS[name] = LatencyWindow()
+        return _WINDOWS[name]
+
+
+def observe_latency(name: str, seconds: float) -> None:
+    get_latency_window(name).observe(seconds)
+    with _LOCK:
+        if name not in _HISTOGRAMS:
+            _HISTOGRAMS[name] = Histogram()
+        histogram = _HISTOGRAMS[name]
+    histogram.observe(seconds)
+
+
+def increment(name: str, value: int = 1) -> None:
+    with _LOCK:
+        _COUNTERS[name] += value
+
+
+def get_counter(name: str) -> int:
+    with _LOCK:
+        return _COUNTERS[name]
+
+
+def set_gauge(name: str, value: float) -> None:
+    with _LOCK:
+        _GAUGES[name] = value
+
+
+def get_gauge(name: str) -> Optional[float]:
+    with _LOCK:
+        return _GAUGES.get(name)
+
+
+def get_metrics_snapshot() -> dict:
+    """
+    Возвращает снимок всех счётчиков, текущих значений и перцентилей задержек.
+
+    Returns:
+        dict: {"counters": {...}, "gauges": {...}, "latency": {name: {"count", "p50", "p90", "p99"}}}
+    """
+    with _LOCK:
+        counters = dict(_COUNTERS)
+        gauges = dict(_GAUGES)
+        windows = dict(_WINDOWS)
+    return {"counters": counters,
+            "gauges": gauges,
+            "latency": {name: window.summary() for name, window in windows.items()}}
+
+
+def render_prometheus(prefix: str = "familyfinance") -> str:
+    """
+    Возвращает все метрики в текстовом формате Prometheus (exposition format 0.0.4):
+    счётчики - <name>_total, значения - gauge, задержки - гистограммы <name>_seconds.
+    """
+    with _LOCK:
+        counters = dict(_COUNTERS)
+        gauges = dict(_GAUGES)
+        histograms = dict(_HISTOGRAMS)
+
+    lines = []
+    for name, value in sorted(counters.items()):
+        metric = _get_metric_name(prefix, name) + "_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+    for name, value in sorted(gauges.items()):
+        metric = _get_metric_name(prefix, name)
+        lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+    for name, histogram in sorted(histograms.items()):
+        metric = _get_metric_name(prefix, name) + "_seconds"
+        cumulative, total = histogram.get_cumulative_counts()
+        lines.append(f"# TYPE {metric} histogram")
+        for bound, count in zip(list(histogram.buckets) + ["+Inf"], cumulative):
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {count}')
+        lines += [f"{metric}_sum {total}", f"{metric}_count {cumulative[-1]}"]
+    return "\n".join(lines) + "\n"
+
+
+def get_rss_bytes() -> int:
+    """
+    Текущий размер резидентной памяти процесса (RSS) в байтах. Вне Linux - пиковый RSS.
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024  # macOS - байты, Linux - килобайты
+
+
+async def monitor_event_loop_lag(interval: float = 0.5) -> None:
+    """
+    Фоновая задача: измеряет, насколько позже запланированного просыпается event loop
+    (блокирующий код в корутинах), и пишет это в gauge event_loop.lag и гистограмму.
+    """
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.monotonic() - started - interval)
+        set_gauge("event_loop.lag", lag)
+        observe_latency("event_loop.lag", lag)
+
+
+# private
+
+
+_LOCK = threading.Lock()
+_WINDOWS: dict[str, LatencyWindow] = {}
+_COUNTERS: Counter = Counter()
+_GAUGES: dict[str, float] = {}
+_HISTOGRAMS: dict[str, Histogram] = {}
+
+
+def _get_metric_name(prefix: str, name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", f"{prefix}_{name}")
@@ -1,35 +1,53 @@
+import asyncio
 import logging
+import time
+from collections import Counter
+from functools import lru_cache
 
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import json
+from typing import Optional
 
 from pydantic import BaseModel
 
+from config import LLM_STAGE_TIMEOUTS, LLM_DEFAULT_TIMEOUT, LLM_HEDGE_ENABLED, LLM_HEDGE_PERCENTILE, \
+    LLM_HEDGE_MIN_SAMPLES, LLM_HEDGE_DEFAULT_DELAY, LLM_HEDGE_MIN_DELAY, WHISPER_PROMPT_MAX_TOKENS, \
+    WHISPER_PROMPT_USAGE_ROWS, WHISPER_PROMPT_USAGE_RETRY, MEMORY_RETRIEVAL_MIN_COUNT, MEMORY_CONTEXT_MAX_TOKENS
 from lib.utilities import google_utilities
-from lib.utilities.google_utilities import Status, ConfigRange, OperationTypes, Category, get_memories
+from lib.utilities.metrics_utilities import get_latency_window, observe_latency, increment, get_counter
+from lib.utilities.tracing_utilities import span, traced, set_span_attribute
+from lib.utilities.google_utilities import Status, OperationTypes, Category, get_memories
+from lib.utilities.retrieval_utilities import MemoryIndex, get_memory_index, tokenize, estimate_tokens
 
 
 # LOGGING
 
 
-from lib.utilities.log_utilities import get_logger
+from lib.utilities.log_utilities import get_logger, log_payload
 LOGGER = get_logger(__name__)
 
 
 # public
 
 CLIENT = OpenAI()
+ASYNC_CLIENT = AsyncOpenAI()
 
 
-def _get_memory_context() -> str:
+@traced("llm.memory_context")
+def _get_memory_context(query: str = "") -> str:
     """
     Получает контекст воспоминаний для добавления в системные сообщения.
-    
+    Если воспоминаний больше MEMORY_RETRIEVAL_MIN_COUNT, добавляются только относящиеся к запросу
+    (TF-IDF по расшифровке, упомянутым категориям и счетам) в пределах MEMORY_CONTEXT_MAX_TOKENS.
+
+    Args:
+        query (str): Расшифровка сообщения пользователя.
+
     Returns:
         str: Форматированная строка с воспоминаниями или пустая строка.
     """
     try:
-        memories = get_memories()
+        memories = _select_memories(get_memories(), query)
         if memories:
             memory_text = "ПРИОРИТЕТНЫЕ ИНСТРУКЦИИ (воспоминания пользователя):\n"
             for i, memory in enumerate(memories, 1):
@@ -55,12 +73,12 @@ def text2text(prompt: str, model: str = "gpt-4o-mini") -> str:
     response = CLIENT.chat.completions.create(
         model=model,
         messages=[
-            {"role": "system", "content": _get_memory_context() + "Ты должен ответить только в формате JSON, строго по схеме. Не добавляй никакого текста вне JSON. Если не хватает данных — используй значения по умолчанию, указанные в схеме."},
+            {"role": "system", "content": _get_memory_context(prompt) + "Ты должен ответить только в формате JSON, строго по схеме. Не добавляй никакого текста вне JSON. Если не хватает данных — используй значения по умолчанию, указанные в схеме."},
             {"role": "user", "content": prompt}
         ],
     )
 
-    LOGGER.info(f"{response=}")
+    log_payload(LOGGER, "OpenAI response", response)
 
     message = response.choices[0].message.content
     return message
@@ -85,7 +103,7 @@ def audio2text(audio_path: str, prompt: str = "") -> str:
         prompt=prompt
     )
 
-    LOGGER.info(transcription)
+    log_payload(LOGGER, "Whisper transcription", transcription)
 
     return transcription.text
 
@@ -100,17 +118,108 @@ def audio2text_for_finance(audio_path: str):
     Returns:
         str: Распознанный текст с учётом категорий расходов, доходов и счетов.
     """
-    prompt = f"Ты помощник, который транскрибирует запрос пользователя о денежной операции. Используй следующие " \
-             f"категории расходов, доходов, а также список счетов для лучшего понимания контекста:\n" \
-             f"Категории расходов: {google_utilities.get_values(cell_range=ConfigRange.expenses,transform_to_single_list=True)}" \
-             f"Категории доходов: {google_utilities.get_values(cell_range=ConfigRange.incomes, transform_to_single_list=True)}\n" \
-             f"Счета: {google_utilities.get_values(cell_range=ConfigRange.accounts, transform_to_single_list=True)}"
-    return audio2text(audio_path, prompt=prompt)
+    return audio2text(audio_path, prompt=_get_finance_prompt())
+
+
+@traced("whisper.transcribe")
+async def audio2text_segments(wav_segments: list[bytes], prompt: str = "") -> str:
+    """
+    Параллельно распознаёт фрагменты одной записи с помощью OpenAI Whisper и склеивает текст.
+
+    Args:
+        wav_segments (list[bytes]): Фрагменты записи в формате WAV (см. vad_utilities.split_speech).
+        prompt (str): Контекст для распознавания.
+
+    Returns:
+        str: Распознанный текст фрагментов в исходном порядке.
+    """
+    transcriptions = await asyncio.gather(*[
+        ASYNC_CLIENT.audio.transcriptions.create(model="whisper-1",
+                                                 file=(f"segment_{i}.wav", segment),
+                                                 prompt=prompt)
+        for i, segment in enumerate(wav_segments)
+    ])
+
+    log_payload(LOGGER, "Whisper transcriptions", transcriptions)
+
+    return " ".join(transcription.text.strip() for transcription in transcriptions)
+
+
+async def audio2text_segments_for_finance(wav_segments: list[bytes]) -> str:
+    """
+    То же, что audio2text_for_finance, но для фрагментов записи, распознаваемых параллельно.
+    """
+    prompt = await asyncio.to_thread(_get_finance_prompt)  # может обновлять категории из Google Sheets
+    return await audio2text_segments(wav_segments, prompt=prompt)
+
+
+def get_finance_prompt() -> str:
+    """
+    Подсказка для распознавания речи: категории расходов, доходов и счета из снимка Category
+    (используется и локальными бэкендами Whisper). Пересобирается только при смене версии снимка.
+    """
+    return _get_finance_prompt()
 
 
 # private
 
 
+def _get_finance_prompt() -> str:
+    global _USAGE_RETRY_AT
+    version = Category.get_version()
+    if time.monotonic() < _USAGE_RETRY_AT:  # частоты недавно не прочитались: не ждём Google Sheets снова
+        return _compose_finance_prompt(Counter())
+    try:
+        return _build_finance_prompt(version)
+    except Exception as e:
+        # подсказка без частот не кешируется в _build_finance_prompt: частоты запрашиваются снова
+        # через WHISPER_PROMPT_USAGE_RETRY секунд
+        LOGGER.warning(f"Failed to get category usage, keeping sheet order for {WHISPER_PROMPT_USAGE_RETRY} s: {e}")
+        _USAGE_RETRY_AT = time.monotonic() + WHISPER_PROMPT_USAGE_RETRY
+        return _compose_finance_prompt(Counter())
+
+
+_USAGE_RETRY_AT = 0.0
+
+
+@lru_cache(maxsize=1)
+def _build_finance_prompt(version: int) -> str:
+    """
+    Подсказка Whisper из снимка категорий (Category) версии version с учётом частоты использования.
+    Ошибка get_usage_counts пробрасывается, чтобы lru_cache не запомнил подсказку без частот.
+    """
+    prompt = _compose_finance_prompt(google_utilities.get_usage_counts(WHISPER_PROMPT_USAGE_ROWS))
+    LOGGER.info(f"Whisper prompt rebuilt for categories version {version}: {len(prompt)} chars")
+    return prompt
+
+
+@traced("whisper.prompt")
+def _compose_finance_prompt(usage: Counter) -> str:
+    """
+    Whisper учитывает только последние WHISPER_PROMPT_MAX_TOKENS токенов подсказки, поэтому в неё попадают
+    самые частые (по usage) категории и счета, пока подсказка помещается в лимит.
+    """
+    sections = {"Категории расходов": Category.get_expenses(),
+                "Категории доходов": Category.get_incomes(),
+                "Счета": Category.get_accounts()}
+    candidates = [(title, name) for title, names in sections.items() for name in names]
+    candidates.sort(key=lambda candidate: -usage[candidate[1]])  # sort стабилен: при равенстве - порядок таблицы
+
+    selected = {title: [] for title in sections}
+    budget = WHISPER_PROMPT_MAX_TOKENS - sum(estimate_tokens(f"{title}: .\n") for title in sections)
+    for title, name in candidates:
+        cost = estimate_tokens(f"{name}, ")
+        if cost > budget:
+            continue
+        selected[title].append(name)
+        budget -= cost
+
+    prompt = "\n".join(f"{title}: {', '.join(names)}." for title, names in selected.items() if names)
+    set_span_attribute("items", sum(map(len, selected.values())))
+    set_span_attribute("skipped", len(candidates) - sum(map(len, selected.values())))
+    return prompt
+
+
 def _get_adjustment_response_format() -> dict:
     response_format = {
         "type": "json_schema",
@@ -506,7 +615,22 @@ def _get_finance_operation_response_format() -> dict:
     return response_format
 
 
-def _get_finance_operation_message(user_message) -> list:
+def _select_memories(memories: list[str], query: str) -> list[str]:
+    if len(memories) <= MEMORY_RETRIEVAL_MIN_COUNT:
+        return memories
+
+    # названия категорий и счетов, упомянутых в запросе, добавляются целиком (в том числе составные)
+    query_words = set(tokenize(query, MemoryIndex.STEM_LENGTH))
+    names = [name for name in Category.get_expenses() + Category.get_incomes() + Category.get_accounts()
+             if query_words & set(tokenize(name, MemoryIndex.STEM_LENGTH))]
+
+    selected = get_memory_index(tuple(memories)).search(" ".join([query, *names]), MEMORY_CONTEXT_MAX_TOKENS)
+    set_span_attribute("memories", len(memories))
+    set_span_attribute("selected", len(selected))
+    return selected
+
+
+def _get_finance_operation_message(user_message, memory_context: str = None) -> list:
     messages = [
         {
             "role": "user",
@@ -522,7 +646,7 @@ def _get_finance_operation_message(user_message) -> list:
             "content": [
                 {
                     "type": "text",
-                    "text": _get_memory_context() + "Ты - связующее звено между пользователем и Google Tables. Твоя задача - точно и "
+                    "text": _get_memory_context_or(memory_context, user_message) + "Ты - связующее звено между пользователем и Google Tables. Твоя задача - точно и "
                             "уверенно определить:\n"
                             "1) Относится ли сообщение пользователя к следующим темам: доходы, расходы, бюджет,"
                             "финансы. Пользователь мог записать сообщения в шутку. Также сообщение может быть "
@@ -537,7 +661,7 @@ def _get_finance_operation_message(user_message) -> list:
     return messages
 
 
-def _get_basic_message(user_message) -> list:
+def _get_basic_message(user_message, memory_context: str = None) -> list:
     messages = [
         {
             "role": "user",
@@ -553,7 +677,7 @@ def _get_basic_message(user_message) -> list:
             "content": [
                 {
                     "type": "text",
-                    "text": _get_memory_context() + "Твоя задача точно и уверенно написать json ответ на основе предварительного анализа "
+                    "text": _get_memory_context_or(memory_context, user_message) + "Твоя задача точно и уверенно написать json ответ на основе предварительного анализа "
                             "преобразованного в текст голосового сообщения от пользователя."
                 }
             ]
@@ -563,6 +687,10 @@ def _get_basic_message(user_message) -> list:
     return messages
 
 
+def _get_memory_context_or(memory_context: Optional[str], user_message) -> str:
+    return _get_memory_context(user_message) if memory_context is None else memory_context
+
+
 # public
 
 
@@ -571,8 +699,9 @@ class MessageRequest:
     Класс для формирования сообщений-запросов к OpenAI.
     """
     def __init__(self, user_message):
-        self.finance_operation_request_message: list = _get_finance_operation_message(user_message)
-        self.basic_request_message: list = _get_basic_message(user_message)
+        memory_context = _get_memory_context(user_message)  # общий для обоих сообщений: один запрос к таблице
+        self.finance_operation_request_message: list = _get_finance_operation_message(user_message, memory_context)
+        self.basic_request_message: list = _get_basic_message(user_message, memory_context)
 
 
 class ResponseFormat:
@@ -601,6 +730,60 @@ class Model:
     o4_mini: str = "o4-mini"  # 1.10$
 
 
+class Stage:
+    """
+    Класс с названиями этапов конвейера, для которых задаются дедлайны и собирается статистика задержек.
+    """
+    classification: str = "classification"  # определение типа операции
+    extraction: str = "extraction"  # извлечение данных для Google Tables
+
+
+class ModelRoutingPolicy(BaseModel):
+    """
+    Политика выбора модели для каждого этапа конвейера и типа операции.
+
+    Args:
+        stage_models (dict): Модель по умолчанию для этапа (Stage).
+        operation_models (dict): Переопределение модели этапа извлечения данных по типу операции.
+        fallback_models (dict): Более быстрая модель для хеджирующего запроса.
+        escalation_model (str): Модель для повторного извлечения, если валидация не прошла.
+    """
+    stage_models: dict = {Stage.classification: Model.gpt_4_1_mini,
+                          Stage.extraction: Model.gpt_4_1_mini}
+    operation_models: dict = {OperationTypes.transfers.value: Model.gpt_4_1,
+                              OperationTypes.adjustment.value: Model.gpt_4_1}
+    fallback_models: dict = {Model.gpt_4_1: Model.gpt_4_1_mini,
+                             Model.gpt_4_1_mini: Model.gpt_4o_mini}
+    escalation_model: str = Model.gpt_4_1
+
+    def get_model(self, stage: str, operation_type: str = None) -> str:
+        # str() приводит OperationTypes к значению: хеш str-Enum не совпадает с хешем строки
+        if stage == Stage.extraction and str(operation_type) in self.operation_models:
+            return self.operation_models[str(operation_type)]
+        return self.stage_models.get(stage, Model.gpt_4_1)
+
+    def get_fallback_model(self, model: str) -> Optional[str]:
+        return self.fallback_models.get(model)
+
+    def get_escalation_model(self, model: str) -> Optional[str]:
+        """
+        Возвращает модель для эскалации или None, если модель уже самая сильная.
+        """
+        return self.escalation_model if model != self.escalation_model else None
+
+    def get_request_builder(self, stage: str, message_request: list, response_format: dict,
+                            operation_type: str = None, model: str = None) -> "RequestBuilder":
+        """
+        Создаёт RequestBuilder с моделью и fallback-моделью, выбранными политикой.
+        """
+        model = model or self.get_model(stage, operation_type)
+        return RequestBuilder(message_request=message_request,
+                              response_format=response_format,
+                              model=model,
+                              stage=stage,
+                              fallback_model=self.get_fallback_model(model))
+
+
 class RequestBuilder(BaseModel):
     """
     Дата-класс для построения запроса к OpenAI.
@@ -609,22 +792,34 @@ class RequestBuilder(BaseModel):
         message_request (list): Сообщение-запрос.
         response_format (dict): Формат ответа.
         model (str): Название модели.
+        stage (str): Этап конвейера (определяет дедлайн и окно статистики).
+        fallback_model (str, optional): Более быстрая модель для хеджирующего запроса. None - без хеджирования.
     """
     message_request: list  # use MessageRequest().attribute
     response_format: dict  # use ResponseFormat().attribute
     model: str = Model().gpt_4_1  # use Model().attribute
+    stage: str = Stage.extraction  # use Stage().attribute
+    fallback_model: Optional[str] = Model().gpt_4_1_mini
 
 
-def request_data(request_builder: RequestBuilder) -> dict:
+async def request_data(request_builder: RequestBuilder) -> dict:
     """
     Отправляет запрос к OpenAI API и возвращает ответ в формате JSON.
 
+    Запрос ограничен дедлайном этапа (LLM_STAGE_TIMEOUTS). Если основная модель не ответила за p90
+    своих недавних задержек, параллельно отправляется запрос к fallback_model; побеждает первый
+    успешный ответ, проигравший запрос отменяется. Если основная модель сразу ответила ошибкой,
+    запрос повторяется с fallback_model.
+
     Args:
         request_builder (RequestBuilder): Объект с параметрами запроса к OpenAI.
 
     Returns:
         dict: Ответ от OpenAI API в формате JSON.
 
+    Raises:
+        asyncio.TimeoutError: Если ни одна модель не ответила до дедлайна этапа.
+
     Note:
         Использует следующие параметры для запроса:
         - temperature: 0.05 (низкая температура для более детерминированных ответов)
@@ -633,8 +828,58 @@ def request_data(request_builder: RequestBuilder) -> dict:
         - frequency_penalty: 0 (без штрафа за частоту)
         - presence_penalty: 0 (без штрафа за присутствие)
     """
-    response = CLIENT.chat.completions.create(
-        model=request_builder.model,
+    stage = request_builder.stage
+    deadline = LLM_STAGE_TIMEOUTS.get(stage, LLM_DEFAULT_TIMEOUT)
+    started = time.monotonic()
+
+    with span(f"llm.{stage}", model=request_builder.model) as current:
+        try:
+            response = await asyncio.wait_for(_hedged_completion(request_builder, deadline), timeout=deadline)
+        except asyncio.TimeoutError:
+            increment(f"llm.{stage}.timeouts")
+            LOGGER.error(f"LLM request for stage '{stage}' exceeded deadline {deadline}s")
+            raise
+        current.set_attribute("response_model", response.model)
+        if response.usage:
+            current.set_attribute("total_tokens", response.usage.total_tokens)
+
+    observe_latency(f"llm.{stage}.total", time.monotonic() - started)
+    log_payload(LOGGER, f"LLM response ({stage})", response)
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug("LLM latency report: %s", get_llm_latency_report(stage))
+
+    message = response.choices[0].message.content
+
+    return json.loads(message)
+
+
+def get_llm_latency_report(stage: str) -> dict:
+    """
+    Возвращает статистику задержек этапа: итоговую (с хеджированием) и основной модели отдельно.
+    Разница p99 этих окон показывает выигрыш от хеджирования на хвосте распределения.
+
+    Args:
+        stage (str): Этап конвейера (Stage).
+
+    Returns:
+        dict: Перцентили задержек и счётчики хеджирующих запросов.
+    """
+    return {
+        "total": get_latency_window(f"llm.{stage}.total").summary(),
+        "primary": get_latency_window(f"llm.{stage}.primary").summary(),
+        "hedges_fired": get_counter(f"llm.{stage}.hedges_fired"),
+        "hedges_won": get_counter(f"llm.{stage}.hedges_won"),
+        "fallbacks": get_counter(f"llm.{stage}.fallbacks"),
+        "timeouts": get_counter(f"llm.{stage}.timeouts"),
+    }
+
+
+# private
+
+
+async def _create_completion(request_builder: RequestBuilder, model: str, timeout: float):
+    return await ASYNC_CLIENT.chat.completions.create(
+        model=model,
         messages=request_builder.message_request,
         response_format=request_builder.response_format,
         temperature=0.05,
@@ -642,10 +887,79 @@ def request_data(request_builder: RequestBuilder) -> dict:
         top_p=0.25,
         frequency_penalty=0,
         presence_penalty=0,
+        timeout=timeout,
     )
 
-    LOGGER.info(response)
 
-    message = response.choices[0].message.content
+def _get_hedge_delay(stage: str) -> float:
+    """
+    Задержка перед хеджирующим запросом: p90 задержек основной модели этапа,
+    либо LLM_HEDGE_DEFAULT_DELAY, пока статистики недостаточно.
+    """
+    window = get_latency_window(f"llm.{stage}.primary")
+    if len(window) < LLM_HEDGE_MIN_SAMPLES:
+        return LLM_HEDGE_DEFAULT_DELAY
+    return max(LLM_HEDGE_MIN_DELAY, window.percentile(LLM_HEDGE_PERCENTILE))
 
-    return json.loads(message)
+
+async def _hedged_completion(request_builder: RequestBuilder, timeout: float):
+    stage = request_builder.stage
+    started = time.monotonic()
+    primary = asyncio.create_task(_create_completion(request_builder, request_builder.model, timeout))
+    tasks = {primary}
+
+    try:
+        has_fallback = request_builder.fallback_model not in (None, request_builder.model)
+        use_hedge = LLM_HEDGE_ENABLED and has_fallback
+        await asyncio.wait(tasks, timeout=_get_hedge_delay(stage) if use_hedge else None)
+        if primary.done():
+            if primary.exception() is None or not has_fallback:
+                response = await primary
+                observe_latency(f"llm.{stage}.primary", time.monotonic() - started)
+                return response
+
+            # основная модель ответила ошибкой (4xx/5xx, сеть) до хеджирования: сразу пробуем fallback_model
+            LOGGER.warning(f"LLM '{request_builder.model}' failed on stage '{stage}' "
+                           f"({type(primary.exception()).__name__}), falling back to '{request_builder.fallback_model}'")
+            increment(f"llm.{stage}.fallbacks")
+            set_span_attribute("fallback", True)
+            return await _create_completion(request_builder, request_builder.fallback_model, timeout)
+
+        LOGGER.warning(f"LLM '{request_builder.model}' is slow on stage '{stage}', "
+                       f"hedging with '{request_builder.fallback_model}'")
+        increment(f"llm.{stage}.hedges_fired")
+        set_span_attribute("hedged", True)
+        tasks.add(asyncio.create_task(_create_completion(request_builder, request_builder.fallback_model, timeout)))
+        winner = await _first_successful(tasks)
+
+        if winner is primary:
+            observe_latency(f"llm.{stage}.primary", time.monotonic() - started)
+        else:
+            increment(f"llm.{stage}.hedges_won")
+        return winner.result()
+
+    finally:
+        if not primary.done():
+            # основная модель не успела: фиксируем нижнюю границу её задержки
+            observe_latency(f"llm.{stage}.primary", time.monotonic() - started)
+        # отменяем проигравший запрос (и все запросы при отмене по дедлайну)
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def _first_successful(tasks: set) -> asyncio.Task:
+    """
+    Ожидает первую успешно завершённую задачу. Ошибка одной задачи не прерывает ожидание остальных.
+    """
+    pending = set(tasks)
+    error = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.cancelled():
+                continue
+            if task.exception() is None:
+                return task
+            error = task.exception()
+    raise error or asyncio.CancelledError()
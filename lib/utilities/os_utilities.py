@@ -1,4 +1,5 @@
 import os
+import json
 from datetime import datetime
 import enum
 import platform
@@ -27,6 +28,24 @@ def get_voice_messages_path(create: bool = False) -> str:
     return voice_messages_path
 
 
+def get_cache_path(create: bool = False) -> str:
+    """
+    Возвращает путь к папке с локальными кэшами (транскрипции и т.п.). Создаёт папку при необходимости.
+
+    Args:
+        create (bool): Создать папку, если не существует.
+
+    Returns:
+        str: Путь к папке cache.
+    """
+    cache_path = os.path.join(_get_root_path(), "cache")
+
+    if create:
+        os.makedirs(cache_path, exist_ok=True)
+
+    return cache_path
+
+
 def get_ffmpeg_executable_path() -> str:
     """
     Возвращает путь к исполняемому файлу ffmpeg в зависимости от ОС.
@@ -47,14 +66,17 @@ def get_ffmpeg_executable_path() -> str:
         return "ffmpeg"
 
 
-def get_vosk_model_path() -> str:
+def get_vosk_model_path(model_name: str = VOSK_MODEL) -> str:
     """
     Возвращает путь к модели Vosk. Бросает ошибку, если модель не найдена.
 
+    Args:
+        model_name (str): Имя папки модели в models/.
+
     Returns:
         str: Путь к модели Vosk.
     """
-    vosk_model_path = os.path.join(_get_root_path(), "models", VOSK_MODEL)
+    vosk_model_path = os.path.join(_get_root_path(), "models", model_name)
 
     if not os.path.exists(vosk_model_path):
         raise FileNotFoundError(f"Модель не найдена: {vosk_model_path}")
@@ -62,6 +84,43 @@ def get_vosk_model_path() -> str:
     return vosk_model_path
 
 
+def append_jsonl(path: str, record: dict) -> None:
+    """
+    Дописывает запись в JSONL-файл, создавая папку при необходимости.
+
+    Args:
+        path (str): Путь к JSONL-файлу.
+        record (dict): Запись для сохранения.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+def remove_jsonl(path: str, key: str, value) -> int:
+    """
+    Удаляет из JSONL-файла записи, у которых поле key равно value (файл переписывается целиком).
+
+    Args:
+        path (str): Путь к JSONL-файлу.
+        key (str): Поле записи.
+        value: Значение поля удаляемых записей.
+
+    Returns:
+        int: Количество удалённых записей.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, encoding="utf-8") as file:
+        lines = [line for line in file if line.strip()]
+    kept = [line for line in lines if json.loads(line).get(key) != value]
+    if len(kept) != len(lines):
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            file.writelines(kept)
+        os.replace(path + ".tmp", path)
+    return len(lines) - len(kept)
+
+
 # private
 
 
@@ -0,0 +1,159 @@
+import asyncio
+import itertools
+import time
+from typing import Awaitable, Callable, Optional
+
+from lib.utilities.metrics_utilities import observe_latency, increment, set_gauge
+from lib.utilities.tracing_utilities import set_span_attribute
+
+
+# LOGGING
+
+
+from lib.utilities.log_utilities import get_logger
+LOGGER = get_logger(__name__)
+
+
+# public
+
+
+class ChatWorkQueue:
+    """
+    Планировщик тяжёлых задач (голосовые сообщения): внутри одного чата задачи выполняются
+    строго по очереди (FIFO), а общее число одновременно выполняемых задач ограничено.
+    Все ожидающие задачи стоят в одной общей очереди по времени постановки: освободившийся слот
+    получает первая задача, чат которой сейчас ничего не выполняет.
+
+    Args:
+        max_concurrency (int): Максимальное число одновременно выполняемых задач.
+        name (str): Имя очереди для метрик.
+    """
+    def __init__(self, max_concurrency: int, name: str = "voice"):
+        self._name = name
+        self._max_concurrency = max_concurrency
+        # job_id -> (chat_id, on_position, future запуска); порядок словаря - порядок постановки
+        self._pending: dict[int, tuple[int, Optional[Callable[[int], Awaitable]], asyncio.Future]] = {}
+        self._running_chats: dict[int, None] = {}  # чаты с выполняемой задачей в порядке запуска
+        self._job_ids = itertools.count()
+
+    @property
+    def depth(self) -> int:
+        """
+        Количество задач, ожидающих выполнения.
+        """
+        return len(self._pending)
+
+    @property
+    def running(self) -> int:
+        return len(self._running_chats)
+
+    def get_position(self, job_id: int) -> int:
+        """
+        Позиция ожидающей задачи (0 - задача не ожидает): номер её запуска среди ожидающих задач.
+        Порядок запуска моделируется так же, как его выбирает очередь (см. _dispatch), в предположении,
+        что выполняемые задачи завершаются в порядке запуска.
+        """
+        if job_id not in self._pending:
+            return 0
+        return self._get_dispatch_order().index(job_id) + 1
+
+    async def run(self, chat_id: int, job: Callable[[], Awaitable],
+                  on_position: Callable[[int], Awaitable] = None):
+        """
+        Ставит задачу в очередь и выполняет её, когда подойдёт очередь и освободится слот.
+
+        Args:
+            chat_id (int): Идентификатор чата.
+            job (Callable): Корутинная функция без аргументов.
+            on_position (Callable, optional): Корутина, получающая позицию задачи в очереди: сразу после
+                постановки (если задача не начинает выполняться сразу) и каждый раз, когда одна из задач
+                начинает выполняться.
+
+        Returns:
+            Результат job().
+        """
+        job_id = next(self._job_ids)
+        started = asyncio.get_running_loop().create_future()
+        self._pending[job_id] = (chat_id, on_position, started)
+        enqueued = time.monotonic()
+        increment(f"queue.{self._name}.enqueued")
+        self._dispatch()
+
+        # позиция считается сразу после постановки, без await между ними
+        position = self.get_position(job_id)
+        set_span_attribute("queue_position", position)
+        if position:
+            self._notify_position(job_id, position)
+
+        try:
+            await started
+        except asyncio.CancelledError:
+            if self._pending.pop(job_id, None) is None:  # задачу запустили, но отменили раньше, чем она началась
+                self._finish(chat_id)
+            else:
+                self._dispatch()
+            raise
+
+        waited = time.monotonic() - enqueued
+        observe_latency(f"queue.{self._name}.wait", waited)
+        set_span_attribute("queue_wait_ms", round(waited * 1000))
+        try:
+            return await job()
+        finally:
+            self._finish(chat_id)
+
+    def _dispatch(self) -> None:
+        # свободные слоты получают первые по времени постановки задачи чатов, которые сейчас ничего не выполняют
+        started = False
+        for job_id, (chat_id, _, future) in list(self._pending.items()):
+            if len(self._running_chats) >= self._max_concurrency:
+                break
+            if chat_id in self._running_chats:
+                continue
+            del self._pending[job_id]
+            self._running_chats[chat_id] = None
+            future.set_result(None)
+            started = True
+        self._update_gauges()
+        if started:
+            self._notify_positions()
+
+    def _finish(self, chat_id: int) -> None:
+        del self._running_chats[chat_id]
+        self._dispatch()
+
+    def _get_dispatch_order(self) -> list[int]:
+        running = list(self._running_chats)
+        waiting = [(job_id, chat_id) for job_id, (chat_id, _, _) in self._pending.items()]
+        order = []
+        while waiting:
+            if len(running) >= self._max_concurrency:
+                running.pop(0)
+            item = next((item for item in waiting if item[1] not in running), None)
+            if item is None:  # все ожидающие задачи - из чатов с выполняемой задачей
+                running.pop(0)
+                continue
+            waiting.remove(item)
+            order.append(item[0])
+            running.append(item[1])
+        return order
+
+    def _notify_positions(self) -> None:
+        for position, job_id in enumerate(self._get_dispatch_order(), start=1):
+            self._notify_position(job_id, position)
+
+    def _notify_position(self, job_id: int, position: int) -> None:
+        if on_position := self._pending[job_id][1]:
+            asyncio.create_task(self._safe_call(job_id, on_position, position))
+
+    async def _safe_call(self, job_id: int, on_position: Callable[[int], Awaitable], position: int) -> None:
+        if job_id not in self._pending:  # задача уже начала выполняться
+            return
+        try:
+            await on_position(position)
+        except Exception as e:
+            LOGGER.warning(f"Failed to report queue position: {e}")
+
+    def _update_gauges(self) -> None:
+        set_gauge(f"queue.{self._name}.depth", self.depth)
+        set_gauge(f"queue.{self._name}.running", self.running)
@@ -0,0 +1,63 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+# public
+
+
+class Priority:
+    """
+    Приоритеты запросов к ограниченному API (меньше - важнее).
+    """
+    user_write = 0  # запись операции пользователя
+    user_read = 1  # чтение, которого ждёт пользователь
+    background = 2  # фоновое обновление (например, категорий)
+
+
+class PriorityTokenBucket:
+    """
+    Потокобезопасный token bucket: не более rate_per_minute запросов в минуту с запасом burst.
+    Если токенов не хватает, ожидающие получают их в порядке приоритета, а при равном приоритете -
+    в порядке очереди.
+
+    Args:
+        rate_per_minute (float): Скорость пополнения (токенов в минуту).
+        burst (int, optional): Ёмкость ведра. По умолчанию - скорость за 10 секунд.
+    """
+    def __init__(self, rate_per_minute: float, burst: int = None):
+        self._rate = rate_per_minute / 60
+        self._capacity = burst or max(1, int(self._rate * 10))
+        self._tokens = float(self._capacity)
+        self._updated = time.monotonic()
+        self._condition = threading.Condition()
+        self._waiters = []  # heap (priority, seq)
+        self._seq = itertools.count()
+
+    def acquire(self, priority: int = Priority.user_read) -> float:
+        """
+        Блокирует поток до получения токена.
+
+        Returns:
+            float: Время ожидания в секундах.
+        """
+        started = time.monotonic()
+        ticket = (priority, next(self._seq))
+        with self._condition:
+            heapq.heappush(self._waiters, ticket)
+            while True:
+                self._refill()
+                if self._waiters[0] == ticket and self._tokens >= 1:
+                    heapq.heappop(self._waiters)
+                    self._tokens -= 1
+                    self._condition.notify_all()
+                    return time.monotonic() - started
+                # первый в очереди ждёт пополнения, остальные - пока он не заберёт токен
+                is_first = self._waiters[0] == ticket
+                self._condition.wait(timeout=(1 - self._tokens) / self._rate if is_first else None)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
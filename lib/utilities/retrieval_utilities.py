@@ -0,0 +1,102 @@
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+
+
+# LOGGING
+
+
+from lib.utilities.log_utilities import get_logger
+LOGGER = get_logger(__name__)
+
+
+# public
+
+
+class MemoryIndex:
+    """
+    TF-IDF индекс воспоминаний пользователя для отбора правил, относящихся к запросу.
+    Слова сравниваются по основе (первые STEM_LENGTH букв), чтобы "продукты" и "продуктов" совпадали.
+
+    Args:
+        memories (tuple[str, ...]): Воспоминания в исходном порядке.
+    """
+    STEM_LENGTH = 5
+
+    def __init__(self, memories: tuple[str, ...]):
+        self.memories = memories
+        documents = [Counter(tokenize(memory, self.STEM_LENGTH)) for memory in memories]
+        document_frequency = Counter(term for document in documents for term in document)
+        self._idf = {term: math.log((1 + len(documents)) / (1 + frequency)) + 1
+                     for term, frequency in document_frequency.items()}
+        self._vectors = [self._get_vector(document) for document in documents]
+
+    def search(self, query: str, max_tokens: int) -> list[str]:
+        """
+        Отбирает воспоминания, похожие на запрос (косинусная близость TF-IDF), от самых близких,
+        пока их суммарный размер не превысит max_tokens.
+
+        Args:
+            query (str): Текст запроса (расшифровка сообщения, названия категорий и счетов).
+            max_tokens (int): Ограничение суммарного размера отобранных воспоминаний.
+
+        Returns:
+            list[str]: Отобранные воспоминания в исходном порядке.
+        """
+        query_vector = self._get_vector(Counter(tokenize(query, self.STEM_LENGTH)))
+        scores = [(sum(weight * vector.get(term, 0.0) for term, weight in query_vector.items()), index)
+                  for index, vector in enumerate(self._vectors)]
+
+        selected = []
+        for score, index in sorted(scores, key=lambda item: (-item[0], item[1])):
+            if score <= 0:
+                break
+            cost = estimate_tokens(self.memories[index])
+            if cost > max_tokens:
+                continue
+            selected.append(index)
+            max_tokens -= cost
+        return [self.memories[index] for index in sorted(selected)]
+
+    def _get_vector(self, term_counts: Counter) -> dict[str, float]:
+        vector = {term: count * self._idf[term] for term, count in term_counts.items() if term in self._idf}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+
+@lru_cache(maxsize=1)
+def get_memory_index(memories: tuple[str, ...]) -> MemoryIndex:
+    """
+    Индекс строится заново, только когда список воспоминаний изменился.
+    """
+    LOGGER.info(f"Building memory index for {len(memories)} memories")
+    return MemoryIndex(memories)
+
+
+def tokenize(text: str, stem_length: int = None) -> list[str]:
+    """
+    Разбивает текст на слова (от двух букв или цифр) в нижнем регистре, "ё" заменяется на "е".
+
+    Args:
+        text (str): Текст.
+        stem_length (int, optional): Обрезать слова до первых stem_length символов.
+
+    Returns:
+        list[str]: Слова текста.
+    """
+    words = _WORD_PATTERN.findall(text.lower().replace("ё", "е"))
+    return [word[:stem_length] for word in words] if stem_length else words
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Оценка сверху числа токенов (byte-level BPE): кириллица ~2 байта на символ, ~3 байта на токен.
+    """
+    return len(text.encode("utf-8")) // 3 + 1
+
+
+# private
+
+
+_WORD_PATTERN = re.compile(r"\w{2,}")
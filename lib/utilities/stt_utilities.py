@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import importlib
+import os
+import threading
+import time
+from types import ModuleType
+from typing import Awaitable, Callable, Optional
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from lib.utilities.cache_utilities import get_cached_transcription, get_file_hash
+from lib.utilities.checkpoint_utilities import Checkpoint, VoiceStage
+from lib.utilities.ffmpeg_utilities import convert_oga_to_wav, decode_to_pcm, read_wav_pcm, SAMPLE_RATE
+from lib.utilities.janitor_utilities import remove_voice_files
+from lib.utilities.metrics_utilities import observe_latency
+from lib.utilities.telegram_utilities import download_voice_message, download_voice_to_memory, is_voice_in_memory
+
+
+# LOGGING
+
+
+from lib.utilities.log_utilities import get_logger
+LOGGER = get_logger(__name__)
+
+
+# public
+
+
+class Audio2TextModels:
+    """
+    Класс для выбора модели преобразования аудио в текст.
+    """
+    whisper = "whisper"
+    vosk = "vosk"
+    local_whisper = "local_whisper"
+
+
+class VoiceAudio:
+    """
+    Декодированное голосовое сообщение для бэкенда распознавания.
+
+    Args:
+        pcm (bytes): PCM s16le моно.
+        sample_rate (int): Частота дискретизации.
+        content_hash (str): sha256 исходного аудиофайла.
+        cached_text (str, optional): Текст из кэша транскрипций (тогда pcm пустой).
+    """
+    def __init__(self, pcm: bytes, sample_rate: int, content_hash: str, cached_text: Optional[str] = None):
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+        self.content_hash = content_hash
+        self.cached_text = cached_text
+
+
+def register_backend(model: str, module_name: str) -> None:
+    """
+    Регистрирует бэкенд распознавания. Модуль бэкенда импортируется только при первом использовании и
+    должен содержать корутину transcribe_voice(update, context, on_partial=None, checkpoint=None) -> (текст, sha256)
+    и, при необходимости, функцию warm_up() для загрузки модели.
+
+    Args:
+        model (str): Имя модели (Audio2TextModels).
+        module_name (str): Полное имя модуля.
+    """
+    _BACKEND_MODULES[model] = module_name
+
+
+def get_backend(model: str) -> ModuleType:
+    """
+    Возвращает модуль бэкенда, импортируя его при первом обращении.
+    """
+    with _LOCK:
+        if model not in _BACKENDS:
+            if model not in _BACKEND_MODULES:
+                raise ValueError(f"Unknown audio2text model: {model}")
+            started = time.monotonic()
+            _BACKENDS[model] = importlib.import_module(_BACKEND_MODULES[model])
+            observe_latency(f"stt.{model}.import", time.monotonic() - started)
+            LOGGER.info(f"Speech backend '{model}' imported in {time.monotonic() - started:.2f}s")
+        return _BACKENDS[model]
+
+
+def load_backend(model: str) -> ModuleType:
+    """
+    Импортирует бэкенд и загружает его модель (warm_up), чтобы первое сообщение не ждало загрузки.
+    Блокирует поток: из event loop вызывается через asyncio.to_thread.
+    """
+    backend = get_backend(model)
+    if warm_up := getattr(backend, "warm_up", None):
+        started = time.monotonic()
+        warm_up()
+        LOGGER.info(f"Speech backend '{model}' loaded in {time.monotonic() - started:.2f}s")
+    return backend
+
+
+async def transcribe_voice(model: str,
+                           update: Update,
+                           context: ContextTypes.DEFAULT_TYPE,
+                           on_partial: Optional[Callable[[str], Awaitable[None]]] = None,
+                           checkpoint: Checkpoint = None) -> tuple[str, str]:
+    """
+    Распознаёт голосовое сообщение выбранным бэкендом.
+
+    Args:
+        model (str): Имя модели (Audio2TextModels).
+        update (Update): Объект обновления Telegram.
+        context (ContextTypes.DEFAULT_TYPE): Контекст Telegram.
+        on_partial (Callable, optional): Корутина для промежуточного текста (если бэкенд его отдаёт).
+        checkpoint (Checkpoint, optional): Контрольная точка для сохранения скачанного файла.
+
+    Returns:
+        tuple[str, str]: Распознанный текст и sha256 аудиофайла.
+    """
+    backend = get_backend(model) if model in _BACKENDS else await asyncio.to_thread(get_backend, model)
+    return await backend.transcribe_voice(update, context, on_partial=on_partial, checkpoint=checkpoint)
+
+
+async def load_voice_pcm(update: Update,
+                         context: ContextTypes.DEFAULT_TYPE,
+                         model: str,
+                         checkpoint: Checkpoint = None) -> VoiceAudio:
+    """
+    Скачивает и декодирует голосовое сообщение в PCM. Обычное голосовое обрабатывается в памяти;
+    необычно длинное (VOICE_MEMORY_MAX_*) - через файл, который сохраняется в checkpoint (этап download).
+    Если транскрипция этого содержимого уже есть в кэше модели, декодирование пропускается.
+
+    Args:
+        update (Update): Объект обновления Telegram.
+        context (ContextTypes.DEFAULT_TYPE): Контекст Telegram.
+        model (str): Имя модели для кэша транскрипций.
+        checkpoint (Checkpoint, optional): Контрольная точка.
+
+    Returns:
+        VoiceAudio: PCM, частота дискретизации, sha256 и текст из кэша.
+    """
+    oga_audio_file = checkpoint.get(VoiceStage.download) if checkpoint else None
+    if is_voice_in_memory(update.message.voice) and not oga_audio_file:
+        async with download_voice_to_memory(update, context) as oga_audio:
+            content_hash = hashlib.sha256(oga_audio).hexdigest()
+            if (cached_text := get_cached_transcription(model, content_hash=content_hash)) is not None:
+                return VoiceAudio(b"", SAMPLE_RATE, content_hash, cached_text)
+            return VoiceAudio(await asyncio.to_thread(decode_to_pcm, oga_audio), SAMPLE_RATE, content_hash)
+
+    if not oga_audio_file or not os.path.exists(oga_audio_file):
+        oga_audio_file = await download_voice_message(update, context)
+        if checkpoint:
+            checkpoint.save(VoiceStage.download, oga_audio_file)
+
+    content_hash = get_file_hash(oga_audio_file)
+    if (cached_text := get_cached_transcription(model, content_hash=content_hash)) is not None:
+        return VoiceAudio(b"", SAMPLE_RATE, content_hash, cached_text)
+
+    wav_audio_file = await asyncio.to_thread(convert_oga_to_wav, oga_audio_file)
+    pcm, sample_rate = read_wav_pcm(wav_audio_file)
+    remove_voice_files(wav_audio_file)  # .oga остаётся в checkpoint до конца обработки сообщения
+    return VoiceAudio(pcm, sample_rate, content_hash)
+
+
+# private
+
+
+_LOCK = threading.Lock()
+_BACKENDS: dict[str, ModuleType] = {}
+_BACKEND_MODULES: dict[str, str] = {
+    Audio2TextModels.whisper: "lib.utilities.whisper_utilities",
+    Audio2TextModels.vosk: "lib.utilities.vosk_utilities",
+    Audio2TextModels.local_whisper: "lib.utilities.local_whisper_utilities",
+}
@@ -1,12 +1,34 @@
+import asyncio
+import io
 import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from datetime import datetime
+from typing import AsyncIterator, Iterable, Optional
+from urllib.parse import urlsplit, urlunsplit, quote
 
-from telegram import Update
-from telegram.ext import ContextTypes
+import httpx
+from telegram import Update, Message, InlineKeyboardMarkup, Voice
+from telegram.error import BadRequest, RetryAfter
+from telegram.ext import ContextTypes, Application, ApplicationHandlerStop, BaseHandler, CallbackQueryHandler, \
+    CommandHandler, MessageHandler
 
+from config import TELEGRAM_EDIT_DEBOUNCE, TELEGRAM_CHAT_EDIT_INTERVAL, TELEGRAM_EDIT_MAX_RETRIES, \
+    VOICE_MEMORY_MAX_DURATION, VOICE_MEMORY_MAX_BYTES, VOICE_BUFFER_POOL_SIZE
+from lib.utilities.metrics_utilities import increment, observe_latency
 from lib.utilities.os_utilities import get_voice_messages_path
+from lib.utilities.tracing_utilities import traced, span
 
 
+# LOGGING
+
+
+from lib.utilities.log_utilities import get_logger
+LOGGER = get_logger(__name__)
+
+
+@traced("telegram.download")
 async def download_voice_message(
         update: Update,
         context: ContextTypes.DEFAULT_TYPE) -> str:
@@ -30,3 +52,319 @@ async def download_voice_message(
     await voice_message.download_to_drive(voice_message_path)
 
     return voice_message_path
+
+
+def is_voice_in_memory(voice: Voice) -> bool:
+    """
+    Проверяет, можно ли скачать голосовое сообщение в память (иначе - в файл, см. VOICE_MEMORY_MAX_*).
+    """
+    return (voice.duration or 0) <= VOICE_MEMORY_MAX_DURATION and (voice.file_size or 0) <= VOICE_MEMORY_MAX_BYTES
+
+
+@asynccontextmanager
+async def download_voice_to_memory(
+        update: Update,
+        context: ContextTypes.DEFAULT_TYPE) -> AsyncIterator[memoryview]:
+    """
+    Скачивает голосовое сообщение (.oga) в буфер из пула и отдаёт memoryview его содержимого без копирования
+    (подходит для hashlib и stdin ffmpeg). memoryview действителен только внутри блока async with.
+
+    Args:
+        update (Update): Объект обновления Telegram.
+        context (ContextTypes.DEFAULT_TYPE): Контекст Telegram.
+
+    Yields:
+        memoryview: Содержимое .oga файла.
+    """
+    buffer = _BUFFER_POOL.acquire()
+    try:
+        with span("telegram.download", in_memory=True):
+            voice_message = await context.bot.get_file(update.message.voice.file_id)
+            await voice_message.download_to_memory(buffer)
+
+        with buffer.getbuffer() as data, data[:buffer.tell()] as view:
+            yield view
+    finally:
+        _BUFFER_POOL.release(buffer)
+
+
+async def stream_voice_message(
+        update: Update,
+        context: ContextTypes.DEFAULT_TYPE,
+        chunk_size: int = 16 * 1024) -> AsyncIterator[bytes]:
+    """
+    Скачивает голосовое сообщение из Telegram потоком, отдавая байты по мере поступления.
+    Позволяет начать декодирование до окончания загрузки.
+
+    Args:
+        update (Update): Объект обновления Telegram.
+        context (ContextTypes.DEFAULT_TYPE): Контекст Telegram.
+        chunk_size (int): Размер отдаваемого блока в байтах.
+
+    Yields:
+        bytes: Очередной блок .oga файла.
+    """
+    voice_message = await context.bot.get_file(update.message.voice.file_id)
+
+    async with _get_http_client().stream("GET", _get_encoded_url(voice_message.file_path)) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes(chunk_size):
+            yield chunk
+
+
+async def close_http_client() -> None:
+    """
+    Закрывает HTTP клиент потоковой загрузки голосовых (stream_voice_message). Вызывается при остановке бота.
+    """
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is not None:
+        await _HTTP_CLIENT.aclose()
+        _HTTP_CLIENT = None
+
+
+def get_allowed_updates(application: Application) -> list[str]:
+    """
+    Возвращает типы обновлений, которые обрабатывают зарегистрированные обработчики
+    (для allowed_updates: Telegram не присылает остальные, например правки и реакции).
+    """
+    allowed_updates = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            allowed_updates.update(_get_handler_update_types(handler))
+    return sorted(allowed_updates)
+
+
+class UpdateFilter:
+    """
+    Дешёвая ранняя фильтрация обновлений: неподходящий тип обновления или чат вне списка
+    отбрасываются до любых обработчиков (и до запросов к Google Sheets/OpenAI).
+
+    Args:
+        allowed_updates (Iterable[str]): Разрешённые типы обновлений (Update.MESSAGE, ...).
+        allowed_chat_ids (Iterable[int], optional): Разрешённые чаты; None - все чаты.
+    """
+    def __init__(self, allowed_updates: Iterable[str], allowed_chat_ids: Optional[Iterable[int]] = None):
+        self.allowed_updates = set(map(str, allowed_updates))
+        self.allowed_chat_ids = set(allowed_chat_ids) if allowed_chat_ids is not None else None
+
+    def is_raw_update_allowed(self, data: dict) -> bool:
+        """
+        Проверяет обновление в виде JSON от Telegram (webhook), не создавая объект Update.
+        """
+        update_type = next((key for key in data if key != "update_id"), None)
+        if update_type not in self.allowed_updates:
+            return self._drop(update_type, "type")
+        payload = data[update_type]
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat") or {}
+        return self._is_chat_allowed(chat.get("id"), update_type)
+
+    def is_update_allowed(self, update: Update) -> bool:
+        update_type = next((key for key in self.allowed_updates if getattr(update, key, None) is not None), None)
+        if update_type is None:
+            return self._drop("other", "type")
+        chat_id = update.effective_chat.id if update.effective_chat else None
+        return self._is_chat_allowed(chat_id, update_type)
+
+    async def handle(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        Обработчик для TypeHandler(Update, ...) в группе -1: прерывает обработку отброшенного обновления.
+        """
+        if not self.is_update_allowed(update):
+            raise ApplicationHandlerStop
+
+    def _is_chat_allowed(self, chat_id: Optional[int], update_type: str) -> bool:
+        if self.allowed_chat_ids is None or chat_id in self.allowed_chat_ids:
+            return True
+        return self._drop(update_type, "chat")
+
+    @staticmethod
+    def _drop(update_type: str, reason: str) -> bool:
+        increment(f"updates.dropped.{reason}")
+        LOGGER.debug(f"Update dropped by {reason} filter: {update_type}")
+        return False
+
+
+class MessageRenderer:
+    """
+    Объединяет правки сообщений Telegram: правки одного сообщения в течение debounce секунд
+    сливаются в один вызов edit_text (текст и клавиатура вместе), правка, не меняющая сообщение,
+    не отправляется, а в одном чате правки идут не чаще раза в chat_interval секунд
+    (при RetryAfter чат ставится на паузу на указанное Telegram время).
+
+    Args:
+        debounce (float): Время ожидания следующей правки того же сообщения в секундах.
+        chat_interval (float): Минимальный интервал между правками в одном чате в секундах.
+        max_retries (int): Количество повторов после RetryAfter.
+    """
+    def __init__(self, debounce: float = TELEGRAM_EDIT_DEBOUNCE, chat_interval: float = TELEGRAM_CHAT_EDIT_INTERVAL,
+                 max_retries: int = TELEGRAM_EDIT_MAX_RETRIES, max_rendered: int = 1000):
+        self._debounce = debounce
+        self._chat_interval = chat_interval
+        self._max_retries = max_retries
+        self._max_rendered = max_rendered
+        self._pending: dict[tuple[int, int], _PendingEdit] = {}
+        self._rendered: OrderedDict[tuple[int, int], tuple] = OrderedDict()  # последнее отправленное состояние
+        self._chat_next_edit: dict[int, float] = {}  # chat_id -> время (monotonic), когда разрешена правка
+
+    async def edit(self, message: Message, text: str, parse_mode: str = None,
+                   reply_markup: InlineKeyboardMarkup = None, wait: bool = True) -> None:
+        """
+        Планирует правку сообщения. Отправляется последнее запланированное состояние сообщения.
+
+        Args:
+            message (Message): Сообщение Telegram для редактирования.
+            text (str): Новый текст сообщения.
+            parse_mode (str, optional): Режим разметки текста.
+            reply_markup (InlineKeyboardMarkup, optional): Клавиатура; None убирает кнопки.
+            wait (bool): Отправить без ожидания debounce и дождаться отправки (ошибки пробрасываются).
+                Если False - правка промежуточная: ошибки только логируются.
+        """
+        key = (message.chat_id, message.message_id)
+        state = (text, parse_mode, reply_markup.to_json() if reply_markup else None)
+
+        pending = self._pending.get(key)
+        if pending is None:
+            if self._rendered.get(key) == state:
+                increment("telegram.edits.skipped")
+                return
+            pending = _PendingEdit(message)
+            self._pending[key] = pending
+            asyncio.create_task(self._flush(key, pending))
+        else:
+            increment("telegram.edits.coalesced")
+        pending.update(text, parse_mode, reply_markup, state)
+
+        if wait:
+            pending.is_awaited = True
+            pending.is_urgent.set()
+            await asyncio.shield(pending.done)
+
+    async def _flush(self, key: tuple[int, int], pending: "_PendingEdit") -> None:
+        try:
+            try:
+                await asyncio.wait_for(pending.is_urgent.wait(), self._debounce)
+            except asyncio.TimeoutError:
+                pass
+            await self._wait_chat_turn(key[0])
+            # следующие правки попадут в новый вызов, эта отправляет последнее состояние
+            del self._pending[key]
+            await self._send(key, pending)
+        except Exception as e:
+            if self._pending.get(key) is pending:
+                del self._pending[key]
+            if pending.is_awaited:
+                pending.done.set_exception(e)
+            else:
+                LOGGER.warning(f"Failed to edit message {key[1]} in chat {key[0]}: {e}")
+                pending.done.set_result(None)
+        else:
+            pending.done.set_result(None)
+
+    async def _send(self, key: tuple[int, int], pending: "_PendingEdit") -> None:
+        if self._rendered.get(key) != pending.state and await self._edit_text(key, pending):
+            increment("telegram.edits.sent")
+        else:
+            increment("telegram.edits.skipped")
+
+        self._rendered[key] = pending.state
+        self._rendered.move_to_end(key)
+        while len(self._rendered) > self._max_rendered:
+            self._rendered.popitem(last=False)
+
+    async def _edit_text(self, key: tuple[int, int], pending: "_PendingEdit") -> bool:
+        """
+        Returns:
+            bool: False, если Telegram ответил, что сообщение уже в этом состоянии.
+        """
+        for attempt in range(self._max_retries + 1):
+            started = time.monotonic()
+            try:
+                await pending.message.edit_text(pending.text, parse_mode=pending.parse_mode,
+                                                reply_markup=pending.reply_markup)
+                return True
+            except RetryAfter as e:
+                increment("telegram.edits.retry_after")
+                if attempt == self._max_retries:
+                    raise
+                LOGGER.warning(f"Flood control in chat {key[0]}, retry in {e.retry_after}s")
+                self._chat_next_edit[key[0]] = time.monotonic() + e.retry_after + self._chat_interval
+                await asyncio.sleep(e.retry_after)
+            except BadRequest as e:
+                if "message is not modified" in str(e).lower():
+                    return False
+                raise
+            finally:
+                observe_latency("telegram.edit", time.monotonic() - started)
+
+    async def _wait_chat_turn(self, chat_id: int) -> None:
+        now = time.monotonic()
+        allowed = max(now, self._chat_next_edit.get(chat_id, 0.0))
+        self._chat_next_edit[chat_id] = allowed + self._chat_interval
+        if allowed > now:
+            await asyncio.sleep(allowed - now)
+
+
+# private
+
+
+def _get_handler_update_types(handler: BaseHandler) -> set[str]:
+    if isinstance(handler, CallbackQueryHandler):
+        return {Update.CALLBACK_QUERY}
+    if isinstance(handler, (MessageHandler, CommandHandler)):
+        # правки сообщений не обрабатываются: обработчики рассчитаны на новые сообщения
+        return {Update.MESSAGE}
+    return set()
+
+
+class _PendingEdit:
+    def __init__(self, message: Message):
+        self.message = message
+        self.text = None
+        self.parse_mode = None
+        self.reply_markup = None
+        self.state = None
+        self.is_awaited = False
+        self.is_urgent = asyncio.Event()
+        self.done = asyncio.get_running_loop().create_future()
+
+    def update(self, text: str, parse_mode: Optional[str], reply_markup: Optional[InlineKeyboardMarkup],
+               state: tuple) -> None:
+        self.text, self.parse_mode, self.reply_markup, self.state = text, parse_mode, reply_markup, state
+
+
+class _BufferPool:
+    """
+    Свободные буферы BytesIO для скачивания голосовых: память под буфер выделяется один раз
+    и переиспользуется (буфер не обрезается, длина данных - позиция после записи).
+    """
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._free: list[io.BytesIO] = []
+
+    def acquire(self) -> io.BytesIO:
+        buffer = self._free.pop() if self._free else io.BytesIO()
+        buffer.seek(0)
+        return buffer
+
+    def release(self, buffer: io.BytesIO) -> None:
+        if len(self._free) < self._max_size:
+            self._free.append(buffer)
+
+
+_BUFFER_POOL = _BufferPool(VOICE_BUFFER_POOL_SIZE)
+_HTTP_CLIENT = None
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        _HTTP_CLIENT = httpx.AsyncClient(timeout=httpx.Timeout(30.0))
+    return _HTTP_CLIENT
+
+
+def _get_encoded_url(file_path: str) -> str:
+    """
+    Кодирует не-ASCII символы пути файла Telegram (аналог telegram.File._get_encoded_url).
+    """
+    url = urlsplit(str(file_path))
+    return urlunsplit((url.scheme, url.netloc, quote(url.path), url.query, url.fragment))
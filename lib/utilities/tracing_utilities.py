@@ -0,0 +1,183 @@
+import asyncio
+import atexit
+import contextvars
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Optional
+
+from config import TRACE_ENABLED, TRACE_MAX_BYTES
+from lib.utilities.metrics_utilities import observe_latency, increment
+from lib.utilities.os_utilities import get_cache_path
+
+
+# LOGGING
+
+
+from lib.utilities.log_utilities import get_logger
+LOGGER = get_logger(__name__)
+
+
+TRACE_PATH = os.getenv("TRACE_PATH") or os.path.join(get_cache_path(), "traces.jsonl")
+
+
+# public
+
+
+class Span:
+    """
+    Интервал выполнения одного этапа (в духе OpenTelemetry): имя, длительность, атрибуты
+    и ссылка на родительский интервал того же trace.
+    """
+    def __init__(self, name: str, parent: Optional["Span"] = None, attributes: dict = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+        self.start_time = time.time()
+        self.duration = None
+        self._started = time.perf_counter()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def end(self, error: BaseException = None) -> None:
+        self.duration = time.perf_counter() - self._started
+        if error is not None:
+            self.status = "error"
+            self.attributes["error"] = type(error).__name__
+
+    def to_dict(self) -> dict:
+        return {"trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                "name": self.name,
+                "start_time": self.start_time,
+                "duration_ms": round(self.duration * 1000, 2),
+                "status": self.status,
+                "attributes": self.attributes}
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Измеряет блок кода как дочерний интервал текущего (или начинает новый trace).
+    Длительность записывается в метрики (span.<name>) и в JSONL-файл TRACE_PATH.
+
+    Пример:
+        with span("stage.transcribe", model="whisper") as current:
+            current.set_attribute("segments", 3)
+    """
+    current = Span(name, parent=_CURRENT_SPAN.get(), attributes=attributes)
+    token = _CURRENT_SPAN.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(error=e)
+        increment(f"span.{name}.errors")
+        raise
+    else:
+        current.end()
+    finally:
+        _CURRENT_SPAN.reset(token)
+        observe_latency(f"span.{name}", current.duration)
+        if TRACE_ENABLED:
+            _EXPORTER.export(current)
+
+
+def traced(name: str):
+    """
+    Декоратор: оборачивает каждый вызов функции (обычной или корутины) в span(name).
+    """
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+            @wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_current_span() -> Optional[Span]:
+    return _CURRENT_SPAN.get()
+
+
+def set_span_attribute(key: str, value: Any) -> None:
+    """
+    Добавляет атрибут текущему интервалу (если он есть).
+    """
+    if current := _CURRENT_SPAN.get():
+        current.set_attribute(key, value)
+
+
+# private
+
+
+_CURRENT_SPAN: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class _JsonlSpanExporter:
+    """
+    Дописывает завершённые интервалы в JSONL-файл из отдельного потока (без сети и без блокировки
+    event loop). При превышении max_bytes файл переименовывается в <path>.1.
+    """
+    def __init__(self, path: str, max_bytes: int):
+        self._path = path
+        self._max_bytes = max_bytes
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, finished_span: Span) -> None:
+        self._start()
+        self._queue.put(finished_span.to_dict())
+
+    def flush(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while (record := self._queue.get()) is not None:
+            records = [record]
+            # забираем всё накопившееся, чтобы писать пачками
+            while not self._queue.empty() and (record := self._queue.get()) is not None:
+                records.append(record)
+            try:
+                self._write(records)
+            except OSError as e:
+                LOGGER.error(f"Failed to export spans to {self._path}: {e}")
+            if record is None:
+                break
+
+    def _write(self, records: list[dict]) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self._path)), exist_ok=True)
+        if os.path.exists(self._path) and os.path.getsize(self._path) > self._max_bytes:
+            os.replace(self._path, self._path + ".1")
+        with open(self._path, "a", encoding="utf-8") as file:
+            file.writelines(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in records)
+
+
+_EXPORTER = _JsonlSpanExporter(TRACE_PATH, TRACE_MAX_BYTES)
+atexit.register(_EXPORTER.flush)
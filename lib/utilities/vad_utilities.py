@@ -0,0 +1,189 @@
+import sys
+from array import array
+from math import sqrt
+from operator import mul
+from typing import AsyncIterator
+
+from config import VAD_FRAME_MS, VAD_MIN_ENERGY, VAD_NOISE_RATIO, VAD_MIN_SILENCE_MS, VAD_PADDING_MS, \
+    VAD_MAX_SEGMENT_SEC
+from lib.utilities.tracing_utilities import traced
+
+
+# public
+
+
+def get_frame_energies(pcm: bytes, sample_rate: int = 16000, frame_ms: int = VAD_FRAME_MS) -> list[float]:
+    """
+    Считает RMS-энергию каждого кадра PCM (s16le моно).
+
+    Args:
+        pcm (bytes): Аудио в формате PCM s16le моно.
+        sample_rate (int): Частота дискретизации.
+        frame_ms (int): Длина кадра в миллисекундах.
+
+    Returns:
+        list[float]: RMS каждого кадра (последний неполный кадр отбрасывается).
+    """
+    samples = _to_samples(pcm)
+    frame_size = sample_rate * frame_ms // 1000
+    return [_get_rms(samples[start:start + frame_size])
+            for start in range(0, len(samples) - frame_size + 1, frame_size)]
+
+
+def find_speech_segments(pcm: bytes, sample_rate: int = 16000, frame_ms: int = VAD_FRAME_MS) -> list[tuple[int, int]]:
+    """
+    Находит участки речи. Паузы короче VAD_MIN_SILENCE_MS не разрывают участок,
+    вокруг каждого участка сохраняется VAD_PADDING_MS тишины.
+
+    Args:
+        pcm (bytes): Аудио в формате PCM s16le моно.
+        sample_rate (int): Частота дискретизации.
+        frame_ms (int): Длина кадра в миллисекундах.
+
+    Returns:
+        list[tuple[int, int]]: Границы участков речи в байтах [start, end).
+    """
+    energies = get_frame_energies(pcm, sample_rate, frame_ms)
+    if not energies:
+        return []
+
+    # шум - p10 энергии; порог не выше половины p90, чтобы запись без пауз не считалась тишиной
+    ordered = sorted(energies)
+    noise_floor, loud_level = ordered[len(ordered) // 10], ordered[len(ordered) * 9 // 10]
+    threshold = max(VAD_MIN_ENERGY, min(_get_threshold(noise_floor), loud_level / 2))
+    speech_frames = [i for i, energy in enumerate(energies) if energy >= threshold]
+    frames = _merge_frames(speech_frames, max_gap=VAD_MIN_SILENCE_MS // frame_ms, padding=VAD_PADDING_MS // frame_ms,
+                           total=len(energies))
+
+    frame_bytes = 2 * sample_rate * frame_ms // 1000
+    return [(start * frame_bytes, min(len(pcm), end * frame_bytes)) for start, end in frames]
+
+
+def trim_silence(pcm: bytes, sample_rate: int = 16000) -> bytes:
+    """
+    Обрезает тишину в начале и в конце записи.
+
+    Returns:
+        bytes: PCM от начала первого до конца последнего участка речи (пусто, если речи нет).
+    """
+    segments = find_speech_segments(pcm, sample_rate)
+    return pcm[segments[0][0]:segments[-1][1]] if segments else b""
+
+
+@traced("vad.split")
+def split_speech(pcm: bytes, sample_rate: int = 16000, max_segment_sec: float = VAD_MAX_SEGMENT_SEC) -> list[bytes]:
+    """
+    Удаляет тишину и группирует участки речи во фрагменты не длиннее max_segment_sec
+    для параллельного распознавания. Короткая запись даёт один фрагмент.
+
+    Args:
+        pcm (bytes): Аудио в формате PCM s16le моно.
+        sample_rate (int): Частота дискретизации.
+        max_segment_sec (float): Максимальная длина фрагмента в секундах.
+
+    Returns:
+        list[bytes]: Фрагменты PCM в порядке следования (пустой список, если речи нет).
+    """
+    max_bytes = int(2 * sample_rate * max_segment_sec)
+    groups, current = [], b""
+
+    for start, end in find_speech_segments(pcm, sample_rate):
+        for piece in _split_long(pcm[start:end], max_bytes, sample_rate):
+            if current and len(current) + len(piece) > max_bytes:
+                groups.append(current)
+                current = b""
+            current += piece
+
+    if current:
+        groups.append(current)
+    return groups
+
+
+async def drop_silence(pcm_chunks: AsyncIterator[bytes], sample_rate: int = 16000,
+                       frame_ms: int = VAD_FRAME_MS) -> AsyncIterator[bytes]:
+    """
+    Потоковый фильтр: пропускает речь и не более VAD_MIN_SILENCE_MS тишины подряд,
+    отбрасывая начальную тишину и длинные паузы. Уровень шума оценивается на лету.
+
+    Args:
+        pcm_chunks (AsyncIterator[bytes]): Поток PCM s16le моно.
+        sample_rate (int): Частота дискретизации.
+        frame_ms (int): Длина кадра в миллисекундах.
+
+    Yields:
+        bytes: PCM без длинных пауз.
+    """
+    frame_bytes = 2 * sample_rate * frame_ms // 1000
+    max_silent_frames = VAD_MIN_SILENCE_MS // frame_ms
+    noise_floor, silent_frames, buffer = VAD_MIN_ENERGY / VAD_NOISE_RATIO, max_silent_frames, b""
+
+    async for chunk in pcm_chunks:
+        buffer += chunk
+        output = []
+        while len(buffer) >= frame_bytes:
+            frame, buffer = buffer[:frame_bytes], buffer[frame_bytes:]
+            energy = _get_rms(_to_samples(frame))
+            is_speech = energy >= _get_threshold(noise_floor)
+            noise_floor = _update_noise_floor(noise_floor, energy, is_speech)
+            silent_frames = 0 if is_speech else silent_frames + 1
+            if silent_frames < max_silent_frames:
+                output.append(frame)
+        if output:
+            yield b"".join(output)
+
+
+# private
+
+
+def _to_samples(pcm: bytes) -> array:
+    samples = array("h")
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % 2])
+    if sys.byteorder == "big":  # PCM s16le
+        samples.byteswap()
+    return samples
+
+
+def _get_rms(samples: array) -> float:
+    return sqrt(sum(map(mul, samples, samples)) / len(samples)) if samples else 0.0
+
+
+def _get_threshold(noise_floor: float) -> float:
+    return max(VAD_MIN_ENERGY, noise_floor * VAD_NOISE_RATIO)
+
+
+def _update_noise_floor(noise_floor: float, energy: float, is_speech: bool) -> float:
+    """
+    Уровень шума: сразу опускается до более тихого кадра и плавно следует за кадрами тишины.
+    Кадры речи уровень шума не поднимают.
+    """
+    if energy < noise_floor:
+        return energy
+    return noise_floor if is_speech else noise_floor + 0.05 * (energy - noise_floor)
+
+
+def _merge_frames(speech_frames: list[int], max_gap: int, padding: int, total: int) -> list[tuple[int, int]]:
+    """
+    Объединяет номера речевых кадров в интервалы [start, end) с учётом допустимых пауз и запаса.
+    """
+    intervals = []
+    for frame in speech_frames:
+        if intervals and frame - intervals[-1][1] <= max_gap:
+            intervals[-1][1] = frame + 1
+        else:
+            intervals.append([frame, frame + 1])
+    return [(max(0, start - padding), min(total, end + padding)) for start, end in intervals]
+
+
+def _split_long(pcm: bytes, max_bytes: int, sample_rate: int) -> list[bytes]:
+    """
+    Делит слишком длинный участок речи в самом тихом кадре второй половины допустимой длины.
+    """
+    pieces = []
+    frame_bytes = 2 * sample_rate * VAD_FRAME_MS // 1000
+    while len(pcm) > max_bytes:
+        energies = get_frame_energies(pcm[max_bytes // 2:max_bytes], sample_rate)
+        cut = max_bytes // 2 + energies.index(min(energies)) * frame_bytes if energies else max_bytes
+        cut -= cut % 2  # граница сэмпла s16le
+        pieces.append(pcm[:cut])
+        pcm = pcm[cut:]
+    return pieces + [pcm] if pcm else pieces
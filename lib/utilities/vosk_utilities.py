@@ -1,11 +1,28 @@
+import asyncio
+import hashlib
 import logging
 
 import wave
 import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import AsyncIterator, Awaitable, Callable, Optional
 
+from telegram import Update
+from telegram.ext import ContextTypes
 from vosk import Model, KaldiRecognizer
 
+from config import VOSK_MODEL, VOSK_LARGE_MODEL, VOSK_LARGE_MAX_DURATION, VOSK_LARGE_MAX_QUEUE_DEPTH, \
+    VOSK_LARGE_MAX_RUNNING, VOSK_GRAMMAR_ENABLED
+from lib.utilities.cache_utilities import hash_chunks
+from lib.utilities.checkpoint_utilities import Checkpoint
+from lib.utilities.ffmpeg_utilities import stream_to_pcm, SAMPLE_RATE
+from lib.utilities.google_utilities import Category
+from lib.utilities.metrics_utilities import increment, get_gauge, set_gauge, get_rss_bytes
 from lib.utilities.os_utilities import get_vosk_model_path
+from lib.utilities.telegram_utilities import stream_voice_message
+from lib.utilities.tracing_utilities import traced, set_span_attribute
+from lib.utilities.vad_utilities import drop_silence
 
 
 # LOGGING
@@ -26,9 +43,8 @@ def audio2text(wav_audio_file: str, frames: int = 4000) -> str:
     Returns:
         str: Распознанный текст из аудиофайла.
     """
-    model = Model(get_vosk_model_path())
     wf = wave.open(wav_audio_file, "rb")
-    rec = KaldiRecognizer(model, wf.getframerate())
+    rec = _create_recognizer(wf.getframerate())
 
     final_result = ""
 
@@ -38,13 +54,218 @@ def audio2text(wav_audio_file: str, frames: int = 4000) -> str:
             break
         if rec.AcceptWaveform(data):
             result = rec.Result()
-            text = json.loads(result)["text"]
+            text = _parse_text(result)
             final_result += text + " "
-        else:  # TODO: add logger
-            partial_result = rec.PartialResult()
+        else:
+            LOGGER.debug(f"Partial result: {_parse_text(rec.PartialResult(), 'partial')}")
 
-    final_result += json.loads(rec.FinalResult())["text"]
+    final_result += _parse_text(rec.FinalResult())
 
     LOGGER.info(final_result)
 
     return final_result
+
+
+@traced("vosk.stream")
+async def audio2text_stream(pcm_chunks: AsyncIterator[bytes],
+                            sample_rate: int = 16000,
+                            on_partial: Optional[Callable[[str], Awaitable[None]]] = None,
+                            model_name: str = VOSK_MODEL) -> str:
+    """
+    Распознаёт речь из потока PCM (s16le моно) по мере его поступления.
+
+    Args:
+        pcm_chunks (AsyncIterator[bytes]): Поток PCM, например из ffmpeg_utilities.stream_to_pcm.
+        sample_rate (int): Частота дискретизации потока.
+        on_partial (Callable, optional): Корутина, получающая текущий промежуточный текст
+            (уже распознанные фразы + rec.PartialResult()).
+        model_name (str): Модель (см. select_model).
+
+    Returns:
+        str: Распознанный текст.
+    """
+    rec = await asyncio.to_thread(_create_recognizer, sample_rate, model_name)
+    phrases = []
+
+    async for data in pcm_chunks:
+        # декодирование Kaldi блокирует, поэтому выполняется вне event loop
+        if await asyncio.to_thread(rec.AcceptWaveform, data):
+            phrases.append(_parse_text(rec.Result()))
+            partial = ""
+        else:
+            partial = _parse_text(rec.PartialResult(), "partial")
+
+        if on_partial:
+            await on_partial(" ".join(filter(None, phrases + [partial])))
+
+    phrases.append(_parse_text(rec.FinalResult()))
+    final_result = " ".join(filter(None, phrases))
+
+    LOGGER.info(final_result)
+
+    return final_result
+
+
+def audio2text_segments(pcm_segments: list[bytes], sample_rate: int = 16000, model_name: str = VOSK_MODEL) -> str:
+    """
+    Параллельно распознаёт фрагменты одной записи (отдельный распознаватель на фрагмент,
+    общая модель) и склеивает текст.
+
+    Args:
+        pcm_segments (list[bytes]): Фрагменты PCM s16le моно (см. vad_utilities.split_speech).
+        sample_rate (int): Частота дискретизации.
+        model_name (str): Модель (см. select_model).
+
+    Returns:
+        str: Распознанный текст фрагментов в исходном порядке.
+    """
+    if not pcm_segments:
+        return ""
+
+    with ThreadPoolExecutor(max_workers=len(pcm_segments)) as executor:
+        texts = list(executor.map(lambda segment: _recognize_pcm(segment, sample_rate, model_name), pcm_segments))
+
+    final_result = " ".join(filter(None, texts))
+
+    LOGGER.info(final_result)
+
+    return final_result
+
+
+async def transcribe_voice(update: Update,
+                           context: ContextTypes.DEFAULT_TYPE,
+                           on_partial: Optional[Callable[[str], Awaitable[None]]] = None,
+                           checkpoint: Checkpoint = None) -> tuple[str, str]:
+    """
+    Бэкенд "vosk" (stt_utilities): скачивание, декодирование и распознавание идут одновременно
+    (длинные паузы отбрасываются), промежуточный текст передаётся в on_partial.
+    Модель выбирается по длительности голосового и очереди (select_model).
+    Файл не сохраняется, поэтому checkpoint не используется.
+
+    Returns:
+        tuple[str, str]: Распознанный текст и sha256 аудиофайла.
+    """
+    model_name = select_model(update.message.voice.duration)
+    increment(f"vosk.model.{model_name}.messages")
+    set_span_attribute("vosk_model", model_name)
+
+    digest = hashlib.sha256()
+    oga_chunks = hash_chunks(stream_voice_message(update, context), digest)
+    pcm_chunks = drop_silence(stream_to_pcm(oga_chunks), SAMPLE_RATE)
+
+    text_from_audio = await audio2text_stream(pcm_chunks, sample_rate=SAMPLE_RATE, on_partial=on_partial,
+                                              model_name=model_name)
+    return text_from_audio, digest.hexdigest()
+
+
+def select_model(duration: float = None) -> str:
+    """
+    Выбирает модель для голосового сообщения. Если задана VOSK_LARGE_MODEL, короткие голосовые
+    (не длиннее VOSK_LARGE_MAX_DURATION) распознаются большой моделью, пока в очереди не больше
+    VOSK_LARGE_MAX_QUEUE_DEPTH сообщений и обрабатывается не больше VOSK_LARGE_MAX_RUNNING (включая текущее);
+    длинные голосовые и сообщения под нагрузкой - малой (VOSK_MODEL).
+
+    Args:
+        duration (float, optional): Длительность голосового в секундах.
+
+    Returns:
+        str: Имя модели.
+    """
+    if not VOSK_LARGE_MODEL or duration is None or duration > VOSK_LARGE_MAX_DURATION:
+        return VOSK_MODEL
+    if (get_gauge("queue.voice.depth") or 0) > VOSK_LARGE_MAX_QUEUE_DEPTH:
+        return VOSK_MODEL
+    if (get_gauge("queue.voice.running") or 0) > VOSK_LARGE_MAX_RUNNING:
+        return VOSK_MODEL
+    return VOSK_LARGE_MODEL
+
+
+def warm_up() -> None:
+    """
+    Загружает модели Vosk (VOSK_MODEL и VOSK_LARGE_MODEL) заранее (при старте бота), а не при первом сообщении.
+    """
+    for model_name in filter(None, (VOSK_MODEL, VOSK_LARGE_MODEL)):
+        _get_model(model_name)
+
+
+# private
+
+
+def _recognize_pcm(pcm: bytes, sample_rate: int, model_name: str = VOSK_MODEL, chunk_size: int = 8000) -> str:
+    rec = _create_recognizer(sample_rate, model_name)
+    phrases = []
+    for start in range(0, len(pcm), chunk_size):
+        if rec.AcceptWaveform(pcm[start:start + chunk_size]):
+            phrases.append(_parse_text(rec.Result()))
+    phrases.append(_parse_text(rec.FinalResult()))
+    return " ".join(filter(None, phrases))
+
+
+@lru_cache(maxsize=None)
+def _get_model(model_name: str = VOSK_MODEL) -> Model:
+    """
+    Загружает модель Vosk один раз за время жизни процесса. Прирост памяти процесса при загрузке
+    записывается в gauge vosk.model.<name>.rss_bytes.
+    """
+    rss_before = get_rss_bytes()
+    model = Model(get_vosk_model_path(model_name))
+    rss_after = get_rss_bytes()
+    set_gauge(f"vosk.model.{model_name}.rss_bytes", max(0, rss_after - rss_before))
+    set_gauge("process.rss_bytes", rss_after)
+    LOGGER.info(f"Vosk model '{model_name}' loaded, +{(rss_after - rss_before) / 1024 / 1024:.0f} MB RSS")
+    return model
+
+
+def _create_recognizer(sample_rate: int, model_name: str = VOSK_MODEL) -> KaldiRecognizer:
+    """
+    Распознаватель со свободным словарём или (VOSK_GRAMMAR_ENABLED) с грамматикой из категорий и счетов.
+    Грамматика применяется только к VOSK_MODEL: большие модели не поддерживают её во время выполнения.
+    Может обращаться к Google Sheets (обновление категорий), поэтому из event loop вызывается в потоке.
+    """
+    if VOSK_GRAMMAR_ENABLED and model_name == VOSK_MODEL:
+        return KaldiRecognizer(_get_model(model_name), sample_rate, _get_grammar(Category.get_version()))
+    return KaldiRecognizer(_get_model(model_name), sample_rate)
+
+
+@lru_cache(maxsize=1)
+def _get_grammar(version: int) -> str:
+    """
+    Грамматика Vosk (JSON-список фраз): названия категорий и счетов целиком и по словам, числительные,
+    валюты и служебные слова; "[unk]" - для остальных слов. Строится заново только при смене
+    версии снимка категорий (Category.get_version()).
+    """
+    phrases = set(_NUMBER_WORDS) | set(_FINANCE_WORDS)
+    for name in Category.get_expenses() + Category.get_incomes() + Category.get_accounts():
+        if phrase := _normalize_phrase(str(name)):
+            phrases.add(phrase)
+            phrases.update(phrase.split())
+
+    LOGGER.info(f"Vosk grammar built for categories version {version}: {len(phrases)} phrases")
+    return json.dumps(sorted(phrases) + [_UNKNOWN_WORD], ensure_ascii=False)
+
+
+def _parse_text(result: str, key: str = "text") -> str:
+    # в режиме грамматики слова вне словаря распознаются как "[unk]" - в текст они не попадают
+    return " ".join(word for word in json.loads(result)[key].split() if word != _UNKNOWN_WORD)
+
+
+def _normalize_phrase(text: str) -> str:
+    # в словаре модели только слова в нижнем регистре без знаков и эмодзи
+    return " ".join("".join(char if char.isalpha() else " " for char in text.lower()).split())
+
+
+_UNKNOWN_WORD = "[unk]"
+
+_NUMBER_WORDS = (
+    "ноль один одна одно два две три четыре пять шесть семь восемь девять десять одиннадцать двенадцать "
+    "тринадцать четырнадцать пятнадцать шестнадцать семнадцать восемнадцать девятнадцать двадцать тридцать "
+    "сорок пятьдесят шестьдесят семьдесят восемьдесят девяносто сто двести триста четыреста пятьсот шестьсот "
+    "семьсот восемьсот девятьсот тысяча тысячи тысяч миллион миллиона миллионов полторы полтора половина "
+    "десятка сотни"
+).split()
+
+_FINANCE_WORDS = (
+    "динар динара динаров евро доллар доллара долларов рубль рубля рублей копеек цент центов "
+    "минус плюс и с на в за из от со по перевод перевёл перевела потратил потратила заплатил заплатила "
+    "купил купила получил получила зарплата вчера сегодня позавчера корректировка баланс счёт карта наличные"
+).split()
@@ -0,0 +1,44 @@
+from typing import Awaitable, Callable, Optional
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from lib.utilities.checkpoint_utilities import Checkpoint
+from lib.utilities.ffmpeg_utilities import pcm_to_wav_bytes
+from lib.utilities.openai_utilities import audio2text_segments_for_finance
+from lib.utilities.stt_utilities import Audio2TextModels, load_voice_pcm
+from lib.utilities.vad_utilities import split_speech
+
+
+# LOGGING
+
+
+from lib.utilities.log_utilities import get_logger
+LOGGER = get_logger(__name__)
+
+
+# public
+
+
+async def transcribe_voice(update: Update,
+                           context: ContextTypes.DEFAULT_TYPE,
+                           on_partial: Optional[Callable[[str], Awaitable[None]]] = None,
+                           checkpoint: Checkpoint = None) -> tuple[str, str]:
+    """
+    Бэкенд "whisper" (OpenAI whisper-1): тишина вырезается, длинная речь делится на фрагменты,
+    распознаваемые параллельно. Промежуточного текста нет, on_partial не используется.
+
+    Returns:
+        tuple[str, str]: Распознанный текст и sha256 аудиофайла.
+    """
+    audio = await load_voice_pcm(update, context, Audio2TextModels.whisper, checkpoint)
+    if audio.cached_text is not None:
+        return audio.cached_text, audio.content_hash
+
+    segments = split_speech(audio.pcm, audio.sample_rate)
+    if not segments:
+        LOGGER.info("No speech detected in voice message")
+        return "", audio.content_hash
+
+    wav_segments = [pcm_to_wav_bytes(segment, audio.sample_rate) for segment in segments]
+    return await audio2text_segments_for_finance(wav_segments), audio.content_hash
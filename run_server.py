@@ -15,20 +15,17 @@ import logging
 from dotenv import load_dotenv
 
 from src import server
+from lib.utilities.log_utilities import setup_root_logging
 
 
 # LOGGING
 
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(name)s %(asctime)s %(levelname)s %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    # filename="mylog.log",  # TODO: save to file,
-)
+# сторонние библиотеки пишут в ту же очередь логов, что и get_logger (формат с correlation id)
+setup_root_logging(logging.INFO)  # TODO: save to file
 
 # set higher logging level for httpx to avoid all GET and POST requests being logged
-logging.getLogger("httpx").setLevel(logging.DEBUG)
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 
 # START
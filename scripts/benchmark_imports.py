@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк запуска: время импорта src.server и пиковая память (RSS) процесса с ленивой загрузкой
+бэкендов распознавания речи (stt_utilities) и после загрузки каждого бэкенда. Каждый замер -
+в отдельном процессе, выводится медиана.
+
+Запуск:
+    python scripts/benchmark_imports.py               # импорт бэкендов без загрузки моделей
+    python scripts/benchmark_imports.py --warm-up     # + загрузка моделей (для Vosk нужна модель в models/)
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD_CODE = """
+import json, resource, sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import src.server
+from lib.utilities import stt_utilities
+for model in {models!r}:
+    stt_utilities.{loader}(model)
+print(json.dumps({{"seconds": time.perf_counter() - started,
+                  "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  "modules": len(sys.modules)}}))
+"""
+
+
+def measure(models: list[str], warm_up: bool) -> dict:
+    code = CHILD_CODE.format(root=ROOT, models=models, loader="load_backend" if warm_up else "get_backend")
+    # ключ нужен только для создания клиента OpenAI при импорте, запросы не отправляются
+    env = {"OPENAI_API_KEY": "benchmark", **os.environ}
+    output = subprocess.run([sys.executable, "-c", code], env=env, cwd=ROOT, capture_output=True, text=True,
+                            check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def benchmark(scenarios: dict[str, list[str]], repeat: int, warm_up: bool) -> dict[str, dict]:
+    results = {}
+    for name, models in scenarios.items():
+        runs = [measure(models, warm_up) for _ in range(repeat)]
+        results[name] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+    return results
+
+
+def print_results(results: dict[str, dict]) -> None:
+    baseline = results["lazy"]
+    print(f"{'scenario':<24}{'seconds':>10}{'rss_mb':>10}{'modules':>10}")
+    for name, result in results.items():
+        print(f"{name:<24}{result['seconds']:>10.2f}{result['rss_mb']:>10.1f}{result['modules']:>10.0f}")
+    eager = results["eager (all backends)"]
+    print(f"\nLazy import saves {eager['seconds'] - baseline['seconds']:.2f}s "
+          f"and {eager['rss_mb'] - baseline['rss_mb']:.1f} MB compared to importing every backend")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="Количество замеров каждого сценария")
+    parser.add_argument("--warm-up", action="store_true", help="Загружать модели бэкендов (warm_up)")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from lib.utilities.stt_utilities import Audio2TextModels
+
+    backends = [Audio2TextModels.whisper, Audio2TextModels.vosk]
+    scenarios = {"lazy": [],
+                 **{f"+ {model}": [model] for model in backends},
+                 "eager (all backends)": backends}
+    print_results(benchmark(scenarios, args.repeat, args.warm_up))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк записи строки операции в Google Sheets без сети: время сборки тела batchUpdate на строку
+и размер тела (байт UTF-8) для каждого листа. Сравниваются:
+    dicts    - словари ячеек и json.dumps с настройками по умолчанию (как делает клиент Sheets API);
+    compact  - те же словари и кодировщик шаблонов (без экранирования кириллицы, компактные разделители);
+    template - прекомпилированный шаблон листа (google_utilities.RowTemplate).
+Разница в размере между dicts и compact - только экранирование и разделители; compact и template совпадают
+по размеру, а разница во времени между ними - выигрыш шаблона.
+
+Перед замером тело с кириллицей отправляется через клиент Sheets API (_RawJsonModel) на локальный
+HTTP-сервер: проверяются content-length и то, что сервер получил корректный JSON в UTF-8.
+
+Запуск:
+    python scripts/benchmark_row_templates.py
+    python scripts/benchmark_row_templates.py --rows 100000
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httplib2
+from dotenv import load_dotenv
+from googleapiclient.discovery import build
+
+load_dotenv()
+
+from lib.utilities.google_utilities import ListName, RequestData, TransferType, RawJson, \
+    get_values_to_update_for_request, _ROW_TEMPLATES, _RawJsonModel, _dumps
+
+
+def get_sample(list_name: ListName) -> RequestData:
+    if list_name == ListName.transfers:
+        return RequestData(list_name=list_name, transfer_type=TransferType.transfer, account="Тинькофф Black",
+                           replenishment_account="Наличные", amount=15000, replenishment_amount=15000,
+                           comment="Снял наличные", telegram_message_id="5f1c2a9b3e7d4c08")
+    return RequestData(list_name=list_name, expenses_category="Продукты", incomes_category="Зарплата",
+                       account="Тинькофф Black", amount=1234.5, comment="Ашан",
+                       telegram_message_id="5f1c2a9b3e7d4c08")
+
+
+def build_dicts(request_data: RequestData) -> str:
+    # значения ячеек, как раньше, сериализуются клиентом Sheets API через json.dumps
+    return json.dumps({"values": get_values_to_update_for_request(request_data)})
+
+
+def build_compact(request_data: RequestData) -> str:
+    return _dumps({"values": get_values_to_update_for_request(request_data)})
+
+
+def build_template(request_data: RequestData) -> str:
+    return f'{{"values":{_ROW_TEMPLATES[request_data.list_name].to_json(request_data)}}}'
+
+
+def check_client(request_data: RequestData) -> None:
+    """
+    Отправляет тело RawJson через настоящий клиент Sheets API на локальный сервер и сверяет то, что дошло.
+    """
+    received = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received["content-length"] = int(self.headers["content-length"])
+            received["body"] = self.rfile.read(received["content-length"])
+            self.send_response(200)
+            self.send_header("content-type", "application/json")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.handle_request, daemon=True).start()
+    try:
+        service = build("sheets", "v4", http=httplib2.Http(), static_discovery=True, model=_RawJsonModel(),
+                        client_options={"api_endpoint": f"http://127.0.0.1:{server.server_port}/"})
+        body = build_template(request_data)
+        service.spreadsheets().batchUpdate(spreadsheetId="benchmark", body=RawJson(body)).execute()
+    finally:
+        server.server_close()
+
+    assert received["content-length"] == len(received["body"]) == len(body.encode("utf-8")), received
+    assert json.loads(received["body"].decode("utf-8")) == json.loads(body)
+    print(f"client check: {received['content-length']} bytes UTF-8 received intact")
+
+
+def measure(function, request_data: RequestData, rows: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rows):
+        function(request_data)
+    return (time.perf_counter() - started) / rows
+
+
+def benchmark(rows: int) -> None:
+    check_client(get_sample(ListName.expenses))
+
+    print(f"{'sheet':<14}{'method':<10}{'us/row':>10}{'bytes':>10}")
+    for list_name in (ListName.expenses, ListName.incomes, ListName.transfers):
+        request_data = get_sample(list_name)
+        assert json.loads(build_dicts(request_data)) == json.loads(build_template(request_data))
+        assert build_compact(request_data) == build_template(request_data)
+        for method, function in (("dicts", build_dicts), ("compact", build_compact), ("template", build_template)):
+            seconds = measure(function, request_data, rows)
+            size = len(function(request_data).encode("utf-8"))
+            print(f"{list_name.name:<14}{method:<10}{seconds * 1e6:>10.2f}{size:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000, help="Количество строк на замер")
+    args = parser.parse_args()
+
+    benchmark(args.rows)
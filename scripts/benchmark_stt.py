@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк бэкендов распознавания речи на своих записях: время распознавания и WER (доля ошибок в словах)
+для OpenAI whisper-1, Vosk и локального Whisper (faster-whisper, int8 на CPU).
+Эталонный текст записи берётся из файла рядом с ней: voice.oga -> voice.txt (без эталона WER не считается).
+Загрузка моделей в замер не входит. Для всех бэкендов используется одна и та же обрезка тишины (VAD).
+
+Запуск:
+    python scripts/benchmark_stt.py voice_messages/*.oga                       # все бэкенды
+    python scripts/benchmark_stt.py --backends vosk local_whisper recordings/*.oga
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from lib.utilities.ffmpeg_utilities import convert_oga_to_wav, read_wav_pcm, pcm_to_wav_bytes
+from lib.utilities.vad_utilities import split_speech
+
+
+def transcribe_whisper(segments: list[bytes], sample_rate: int) -> str:
+    from lib.utilities import openai_utilities
+
+    wav_segments = [pcm_to_wav_bytes(segment, sample_rate) for segment in segments]
+    return asyncio.run(openai_utilities.audio2text_segments_for_finance(wav_segments))
+
+
+def transcribe_vosk(segments: list[bytes], sample_rate: int) -> str:
+    from lib.utilities import vosk_utilities
+
+    return vosk_utilities.audio2text_segments(segments, sample_rate)
+
+
+def transcribe_local_whisper(segments: list[bytes], sample_rate: int) -> str:
+    from lib.utilities import local_whisper_utilities
+
+    return local_whisper_utilities.audio2text_segments(segments)
+
+
+BACKENDS = {"whisper": transcribe_whisper, "vosk": transcribe_vosk, "local_whisper": transcribe_local_whisper}
+
+
+def warm_up(backend: str) -> None:
+    from lib.utilities.openai_utilities import get_finance_prompt
+    from lib.utilities.stt_utilities import load_backend
+
+    if backend != "whisper":
+        load_backend(backend)
+    get_finance_prompt()  # подсказка из Google Sheets не должна попадать в первый замер
+
+
+def get_word_error_rate(reference: str, hypothesis: str) -> float:
+    """
+    WER: расстояние Левенштейна по словам, делённое на число слов эталона.
+    """
+    reference_words, hypothesis_words = normalize(reference).split(), normalize(hypothesis).split()
+    distances = list(range(len(hypothesis_words) + 1))
+    for i, reference_word in enumerate(reference_words, start=1):
+        previous, distances[0] = distances[0], i
+        for j, hypothesis_word in enumerate(hypothesis_words, start=1):
+            previous, distances[j] = distances[j], min(distances[j] + 1,
+                                                       distances[j - 1] + 1,
+                                                       previous + (reference_word != hypothesis_word))
+    return distances[-1] / max(1, len(reference_words))
+
+
+def normalize(text: str) -> str:
+    text = text.lower().replace("ё", "е")
+    return "".join(char if char.isalnum() or char.isspace() else " " for char in text)
+
+
+def load_segments(path: str) -> tuple[list[bytes], int, float]:
+    wav_path = path if path.endswith(".wav") else convert_oga_to_wav(path)
+    pcm, sample_rate = read_wav_pcm(wav_path)
+    return split_speech(pcm, sample_rate), sample_rate, len(pcm) / (2 * sample_rate)
+
+
+def load_reference(path: str) -> str | None:
+    reference_path = os.path.splitext(path)[0] + ".txt"
+    if os.path.exists(reference_path):
+        with open(reference_path, encoding="utf-8") as file:
+            return file.read().strip()
+    return None
+
+
+def benchmark(files: list[str], backends: list[str]) -> dict[str, dict]:
+    for backend in backends:
+        warm_up(backend)
+
+    results = {backend: {"seconds": 0.0, "audio": 0.0, "errors": 0.0, "words": 0} for backend in backends}
+    for path in files:
+        segments, sample_rate, duration = load_segments(path)
+        reference = load_reference(path)
+        for backend in backends:
+            started = time.perf_counter()
+            text = BACKENDS[backend](segments, sample_rate) if segments else ""
+            elapsed = time.perf_counter() - started
+
+            result = results[backend]
+            result["seconds"] += elapsed
+            result["audio"] += duration
+            line = f"{os.path.basename(path)} [{backend}] {elapsed:.2f}s"
+            if reference is not None:
+                words = len(normalize(reference).split())
+                wer = get_word_error_rate(reference, text)
+                result["errors"] += wer * words
+                result["words"] += words
+                line += f" WER={wer:.2f}"
+            print(f"{line}: {text}")
+    return results
+
+
+def print_results(results: dict[str, dict]) -> None:
+    print(f"\n{'backend':<16}{'seconds':>10}{'RTF':>8}{'WER':>8}")
+    for backend, result in results.items():
+        rtf = result["seconds"] / result["audio"] if result["audio"] else 0.0  # доля длительности записи
+        wer = f"{result['errors'] / result['words']:.3f}" if result["words"] else "-"
+        print(f"{backend:<16}{result['seconds']:>10.2f}{rtf:>8.2f}{wer:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="Аудиофайлы (.oga, .wav и др.) и эталоны <имя>.txt рядом")
+    parser.add_argument("--backends", nargs="+", choices=list(BACKENDS), default=list(BACKENDS),
+                        help="Бэкенды для сравнения")
+    args = parser.parse_args()
+
+    print_results(benchmark(args.files, args.backends))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк VAD: сравнивает время распознавания полной записи и записи после обрезки тишины
+с разбиением на фрагменты, распознаваемые параллельно.
+
+Запуск:
+    python scripts/benchmark_vad.py voice_messages/*.oga            # Vosk (нужна модель в models/)
+    python scripts/benchmark_vad.py --whisper voice_messages/*.oga  # + OpenAI Whisper (нужен .env)
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from lib.utilities.ffmpeg_utilities import convert_oga_to_wav, read_wav_pcm, pcm_to_wav_bytes
+from lib.utilities.vad_utilities import split_speech
+
+
+def measure(function, *args) -> tuple[float, object]:
+    started = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - started, result
+
+
+def load_pcm(path: str) -> tuple[bytes, int]:
+    wav_path = path if path.endswith(".wav") else convert_oga_to_wav(path)
+    return read_wav_pcm(wav_path)
+
+
+def benchmark_vosk(pcm: bytes, sample_rate: int, segments: list[bytes]) -> dict:
+    from lib.utilities import vosk_utilities
+
+    vosk_utilities._get_model()  # загрузка модели не должна попадать в замер
+    full_time, _ = measure(vosk_utilities.audio2text_segments, [pcm], sample_rate)
+    vad_time, _ = measure(vosk_utilities.audio2text_segments, segments, sample_rate)
+    return {"vosk full": full_time, "vosk vad": vad_time}
+
+
+def benchmark_whisper(pcm: bytes, sample_rate: int, segments: list[bytes]) -> dict:
+    from lib.utilities import openai_utilities
+
+    def transcribe(pieces: list[bytes]):
+        wav_pieces = [pcm_to_wav_bytes(piece, sample_rate) for piece in pieces]
+        return asyncio.run(openai_utilities.audio2text_segments(wav_pieces))
+
+    full_time, _ = measure(transcribe, [pcm])
+    vad_time, _ = measure(transcribe, segments)
+    return {"whisper full": full_time, "whisper vad": vad_time}
+
+
+def benchmark_file(path: str, use_vosk: bool, use_whisper: bool) -> dict:
+    pcm, sample_rate = load_pcm(path)
+    split_time, segments = measure(split_speech, pcm, sample_rate)
+    result = {"duration": len(pcm) / (2 * sample_rate),
+              "speech": sum(map(len, segments)) / (2 * sample_rate),
+              "segments": len(segments),
+              "vad": split_time}
+    if use_vosk:
+        result.update(benchmark_vosk(pcm, sample_rate, segments))
+    if use_whisper:
+        result.update(benchmark_whisper(pcm, sample_rate, segments))
+    return result
+
+
+def print_results(results: dict[str, dict]) -> None:
+    totals = {}
+    for path, result in results.items():
+        print(f"{os.path.basename(path)}: " + ", ".join(f"{key}={value:.2f}" for key, value in result.items()))
+        for key, value in result.items():
+            totals[key] = totals.get(key, 0) + value
+    print("TOTAL: " + ", ".join(f"{key}={value:.2f}" for key, value in totals.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="Аудиофайлы (.oga, .wav и др.)")
+    parser.add_argument("--no-vosk", action="store_true", help="Не замерять Vosk")
+    parser.add_argument("--whisper", action="store_true", help="Замерять OpenAI Whisper")
+    args = parser.parse_args()
+
+    print_results({path: benchmark_file(path, not args.no_vosk, args.whisper) for path in args.files})
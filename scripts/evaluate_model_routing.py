@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Offline-оценка политик выбора моделей (ModelRoutingPolicy) на корпусе записанных транскриптов.
+Для каждой политики измеряет точность классификации и извлечения данных, а также задержки этапов.
+
+Корпус - JSONL, который пишет сервер при заданной переменной TRANSCRIPT_CORPUS_PATH:
+    {"id": "voice:...:0", "text": "...", "operations": [{"operation_type": "Расходы",
+                                    "fields": {"expenses_category": "Кофе", "account": "...", "amount": 300}}]}
+
+Эталонные значения корпуса сгенерированы моделью, работавшей в тот момент на сервере, и лишь подтверждены
+пользователем: записываются операции, сохранённые в Google Sheets (автоматически или кнопкой "Принять"),
+а удалённые пользователем кнопкой "Удалить" убираются из корпуса. Поэтому "точность" - это
+согласие с подтверждёнными ответами прежней модели, а не проверенная разметка; для строгой оценки
+поля корпуса нужно проверить вручную.
+
+Запуск (нужны те же .env и ключ Google, что и для сервера):
+    python scripts/evaluate_model_routing.py --corpus voice_messages/transcripts.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from lib.utilities.google_utilities import OperationTypes
+from lib.utilities.metrics_utilities import LatencyWindow, get_counter
+from lib.utilities.openai_utilities import ModelRoutingPolicy, Model, Stage
+from src.server import classify_operations, extract_operation_data
+
+
+# Хеджирование отключено (fallback_models={}), чтобы измерять задержки самих моделей.
+POLICIES = {
+    "baseline (gpt-4.1 everywhere)": ModelRoutingPolicy(
+        stage_models={Stage.classification: Model.gpt_4_1, Stage.extraction: Model.gpt_4_1},
+        operation_models={},
+        fallback_models={}),
+    "routed (default policy)": ModelRoutingPolicy(fallback_models={}),
+}
+
+
+def load_corpus(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def is_value_equal(expected, actual) -> bool:
+    if isinstance(expected, (int, float)) and isinstance(actual, (int, float)):
+        return abs(expected - actual) < 1e-6
+    return str(expected).strip().lower() == str(actual).strip().lower()
+
+
+def is_fields_equal(expected: dict, actual: dict) -> bool:
+    return all(is_value_equal(value, actual.get(key)) for key, value in expected.items())
+
+
+async def evaluate_item(item: dict, policy: ModelRoutingPolicy, stats: dict) -> None:
+    expected_types = [operation["operation_type"] for operation in item["operations"]]
+
+    started = time.monotonic()
+    response = await classify_operations(item["text"], policy)
+    stats["classification_latency"].observe(time.monotonic() - started)
+
+    predicted_types = [operation.get("operation_type") for operation in response.get("operations", [])]
+    stats["classification_correct"] += sorted(predicted_types) == sorted(expected_types)
+
+    for operation in item["operations"]:
+        operation_type = OperationTypes.get_item(operation["operation_type"])
+        started = time.monotonic()
+        request_message = await extract_operation_data(operation_type, item["text"], policy)
+        stats["extraction_latency"].observe(time.monotonic() - started)
+        stats["extraction_total"] += 1
+        stats["extraction_correct"] += is_fields_equal(operation["fields"], request_message)
+
+
+async def evaluate_policy(corpus: list[dict], policy: ModelRoutingPolicy) -> dict:
+    stats = {"classification_latency": LatencyWindow(size=len(corpus) or 1),
+             "extraction_latency": LatencyWindow(size=10 * len(corpus) or 1),
+             "classification_correct": 0, "extraction_correct": 0, "extraction_total": 0}
+    escalations_before = get_counter("llm.extraction.escalations")
+
+    for item in corpus:
+        await evaluate_item(item, policy, stats)
+
+    stats["escalations"] = get_counter("llm.extraction.escalations") - escalations_before
+    return stats
+
+
+def print_report(name: str, stats: dict, corpus_size: int) -> None:
+    classification = stats["classification_latency"].summary()
+    extraction = stats["extraction_latency"].summary()
+    print(f"=== {name}")
+    print(f"classification accuracy: {stats['classification_correct']}/{corpus_size}")
+    print(f"extraction accuracy:     {stats['extraction_correct']}/{stats['extraction_total']}")
+    print(f"escalations:             {stats['escalations']}")
+    print(f"classification latency:  p50={classification['p50']:.2f}s p90={classification['p90']:.2f}s")
+    print(f"extraction latency:      p50={extraction['p50']:.2f}s p90={extraction['p90']:.2f}s")
+
+
+async def main(corpus_path: str, limit: int = None) -> None:
+    corpus = load_corpus(corpus_path)[:limit]
+    if not corpus:
+        sys.exit(f"Корпус пуст: {corpus_path}")
+
+    for name, policy in POLICIES.items():
+        stats = await evaluate_policy(corpus, policy)
+        print_report(name, stats, len(corpus))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", required=True, help="Путь к JSONL-корпусу транскриптов")
+    parser.add_argument("--limit", type=int, default=None, help="Ограничить количество записей")
+    args = parser.parse_args()
+    asyncio.run(main(args.corpus, args.limit))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Отчёт по трассам обработки голосовых сообщений (cache/traces.jsonl, см. tracing_utilities):
+перцентили длительности каждого интервала и его доля во времени обработки сообщения.
+С --baseline сравнивает p50/p90 с другим файлом трасс (поиск регрессий).
+
+Запуск:
+    python scripts/trace_report.py                                  # cache/traces.jsonl
+    python scripts/trace_report.py traces.jsonl --root voice_message
+    python scripts/trace_report.py traces.jsonl --baseline traces_old.jsonl
+    python scripts/trace_report.py traces.jsonl --trace <trace_id>  # дерево одной трассы
+"""
+
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.utilities.tracing_utilities import TRACE_PATH
+
+
+def load_spans(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(spans: list[dict], root: str) -> dict[str, dict]:
+    """
+    Для каждого имени интервала: количество, p50/p90/p99 (мс) и доля суммарного времени
+    корневых интервалов root.
+    """
+    durations = defaultdict(list)
+    for span in spans:
+        durations[span["name"]].append(span["duration_ms"])
+    root_total = sum(durations.get(root, [])) or None
+
+    return {name: {"count": len(values),
+                   "p50": percentile(values, 0.5),
+                   "p90": percentile(values, 0.9),
+                   "p99": percentile(values, 0.99),
+                   "share": sum(values) / root_total if root_total else None}
+            for name, values in durations.items()}
+
+
+def print_summary(summary: dict[str, dict], baseline: dict[str, dict] = None) -> None:
+    header = f"{'span':32} {'count':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'share':>6}"
+    print(header + (f" {'Δp50':>8} {'Δp90':>8}" if baseline else ""))
+    for name, row in sorted(summary.items(), key=lambda item: -item[1]["p90"]):
+        share = f"{row['share']:.0%}" if row["share"] is not None else "-"
+        line = f"{name:32} {row['count']:6} {row['p50']:9.1f} {row['p90']:9.1f} {row['p99']:9.1f} {share:>6}"
+        if baseline:
+            if old := baseline.get(name):
+                line += f" {_delta(row['p50'], old['p50']):>8} {_delta(row['p90'], old['p90']):>8}"
+            else:
+                line += f" {'new':>8}"
+        print(line)
+
+
+def print_trace(spans: list[dict], trace_id: str) -> None:
+    trace = [span for span in spans if span["trace_id"] == trace_id]
+    children = defaultdict(list)
+    for span in trace:
+        children[span["parent_id"]].append(span)
+
+    def print_node(span: dict, depth: int) -> None:
+        attributes = ", ".join(f"{key}={value}" for key, value in span["attributes"].items() if value is not None)
+        status = "" if span["status"] == "ok" else f" [{span['status']}]"
+        print(f"{'  ' * depth}{span['name']}: {span['duration_ms']:.1f} ms{status}"
+              + (f" ({attributes})" if attributes else ""))
+        for child in sorted(children[span["span_id"]], key=lambda item: item["start_time"]):
+            print_node(child, depth + 1)
+
+    span_ids = {span["span_id"] for span in trace}
+    for span in sorted(trace, key=lambda item: item["start_time"]):
+        if span["parent_id"] not in span_ids:
+            print_node(span, 0)
+
+
+def _delta(new: float, old: float) -> str:
+    return f"{(new - old) / old:+.0%}" if old else "-"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", default=TRACE_PATH, help="JSONL-файл трасс")
+    parser.add_argument("--root", default="voice_message", help="Корневой интервал для расчёта доли времени")
+    parser.add_argument("--baseline", help="Файл трасс для сравнения")
+    parser.add_argument("--trace", help="Вывести дерево интервалов одной трассы")
+    args = parser.parse_args()
+
+    spans = load_spans(args.path)
+    if args.trace:
+        print_trace(spans, args.trace)
+    else:
+        baseline = summarize(load_spans(args.baseline), args.root) if args.baseline else None
+        print_summary(summarize(spans, args.root), baseline)
@@ -1,24 +1,41 @@
+import asyncio
+import hashlib
+import html
 import logging
 import json
+import time
 import uuid
 import os
+import secrets
+import signal
 from functools import partial
+from urllib.parse import urlparse
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Message, BotCommand
-from telegram.ext import Application, ContextTypes, MessageHandler, filters, CallbackQueryHandler, CommandHandler
+from telegram.ext import Application, ContextTypes, MessageHandler, filters, CallbackQueryHandler, CommandHandler, \
+    TypeHandler
 
 from lib.utilities import google_utilities
-from lib.utilities.google_utilities import OperationTypes, Category, Status, RequestData, ListName, TransferType, insert_and_update_row_batch_update, delete_row_by_telegram_id, get_memories, add_memory, delete_memory
-from lib.utilities.openai_utilities import request_data, RequestBuilder, ResponseFormat, MessageRequest, \
-    audio2text_for_finance
-from lib.utilities.telegram_utilities import download_voice_message
-from lib.utilities.ffmpeg_utilities import convert_oga_to_wav
-from lib.utilities.vosk_utilities import audio2text
+from lib.utilities.google_utilities import OperationTypes, Category, Status, RequestData, ListName, TransferType, insert_and_update_row_batch_update, delete_row_by_telegram_id, get_memory_items, add_memory, delete_memory, Memory
+from lib.utilities.openai_utilities import request_data, ResponseFormat, MessageRequest, Stage, ModelRoutingPolicy
+from lib.utilities.metrics_utilities import increment, get_metrics_snapshot, get_counter, get_gauge, set_gauge, \
+    get_rss_bytes, render_prometheus, monitor_event_loop_lag
+from lib.utilities.http_utilities import HttpServer, HttpRequest, HttpResponse, get_ssl_context
+from lib.utilities.os_utilities import append_jsonl, remove_jsonl
+from lib.utilities.telegram_utilities import get_allowed_updates, UpdateFilter, MessageRenderer, close_http_client
+from lib.utilities.stt_utilities import Audio2TextModels, transcribe_voice, load_backend
+from lib.utilities.cache_utilities import get_cached_transcription, cache_transcription, transcription_lookup
+from lib.utilities.checkpoint_utilities import Checkpoint, VoiceStage, run_stage, has_stage, save_stage
+from lib.utilities.queue_utilities import ChatWorkQueue
+from lib.utilities.janitor_utilities import run_janitor, remove_voice_files
+from lib.utilities.tracing_utilities import span, traced
+from config import VOICE_MAX_CONCURRENCY, EVENT_LOOP_LAG_INTERVAL, HEALTH_MAX_EVENT_LOOP_LAG, AUDIO2TEXT_MODEL, \
+    VOSK_MODEL, VOSK_LARGE_MODEL
 
 # LOGGING
 
 
-from lib.utilities.log_utilities import get_logger
+from lib.utilities.log_utilities import get_logger, log_payload, set_correlation_id
 
 LOGGER = get_logger()
 
@@ -26,17 +43,24 @@ LOGGER = get_logger()
 
 
 VALIDATION_TEXT = "(невалидное значение)"
-
-
-# CLASSES
-
-
-class Audio2TextModels:
-    """
-    Класс для выбора модели преобразования аудио в текст.
-    """
-    whisper = "whisper"
-    vosk = "vosk"
+ROUTING_POLICY = ModelRoutingPolicy()
+TRANSCRIPT_CORPUS_PATH = os.getenv("TRANSCRIPT_CORPUS_PATH")  # запись транскриптов для offline-оценки моделей
+PROCESSING_START_TEXT = "1/3 Конвертирую аудио в текст. Ожидайте..."
+OPERATION_START_TEXT = "3/3 Определяю данные для Google Tables. Ожидайте..."
+VOICE_QUEUE = ChatWorkQueue(max_concurrency=VOICE_MAX_CONCURRENCY, name="voice")
+RENDERER = MessageRenderer()
+
+# HTTP: /health и /metrics всегда, webhook - если задан TELEGRAM_WEBHOOK_URL (иначе long polling)
+WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")  # публичный адрес, например https://example.com:8443/telegram
+WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+HTTP_HOST = os.getenv("HTTP_HOST", "0.0.0.0")
+HTTP_PORT = int(os.getenv("HTTP_PORT", "8080"))
+HTTP_CERT_PATH = os.getenv("HTTP_CERT_PATH")  # TLS без прокси; самоподписанный сертификат отправляется в Telegram
+HTTP_KEY_PATH = os.getenv("HTTP_KEY_PATH")
+
+# Фильтрация обновлений: по умолчанию - только типы, которые обрабатывают зарегистрированные обработчики
+ALLOWED_UPDATES = [value.strip() for value in os.getenv("TELEGRAM_ALLOWED_UPDATES", "").split(",") if value.strip()]
+ALLOWED_CHAT_IDS = [int(value) for value in os.getenv("TELEGRAM_ALLOWED_CHAT_IDS", "").split(",") if value.strip()]
 
 
 # FUNCTIONS
@@ -60,32 +84,62 @@ def replace_last_string(original_text: str, text_to_add: str):
         return "\n".join(texts[:-1] + [text_to_add])
 
 
-async def get_text_from_audio(update, context, audio2text_model: Audio2TextModels, custom_text: str = None):
+async def get_text_from_audio(update, context, audio2text_model: Audio2TextModels, custom_text: str = None,
+                              processing_message: Message = None, checkpoint: Checkpoint = None):
     """
     Получает текст из аудиосообщения с помощью выбранной модели.
 
+    Результат кэшируется по file_unique_id и sha256 содержимого: повторно отправленное или
+    пересланное сообщение не скачивается и не распознаётся заново.
+
     Args:
         update: Объект обновления Telegram.
         context: Контекст Telegram.
         audio2text_model (Audio2TextModels): Модель для преобразования аудио в текст.
         custom_text (str, optional): Пользовательский текст вместо распознавания.
+        processing_message (Message, optional): Сообщение "1/3" для вывода промежуточного текста.
+        checkpoint (Checkpoint, optional): Контрольная точка для сохранения скачанного файла.
 
     Returns:
         str: Распознанный текст.
     """
-    oga_audio_file = await download_voice_message(update, context)
-    wav_audio_file = convert_oga_to_wav(oga_audio_file)
-
     if custom_text:
-        text_from_audio = custom_text
-    elif audio2text_model == Audio2TextModels.whisper:
-        text_from_audio = audio2text_for_finance(wav_audio_file)
-    else:
-        text_from_audio = audio2text(wav_audio_file)
+        return custom_text
+
+    file_unique_id = update.message.voice.file_unique_id
+    with transcription_lookup():
+        if (cached_text := get_cached_transcription(audio2text_model, file_unique_id=file_unique_id)) is not None:
+            return cached_text
+
+        on_partial = get_partial_transcript_callback(processing_message) if processing_message else None
+        text_from_audio, content_hash = await transcribe_voice(audio2text_model, update, context,
+                                                               on_partial=on_partial, checkpoint=checkpoint)
+
+    if text_from_audio:
+        cache_transcription(text_from_audio, audio2text_model, file_unique_id=file_unique_id, content_hash=content_hash)
 
     return text_from_audio
 
 
+def get_partial_transcript_callback(processing_message: Message):
+    """
+    Создаёт корутину, которая выводит промежуточный текст распознавания в сообщение "1/3".
+    Частые обновления объединяет RENDERER: отправляется только последний текст.
+
+    Args:
+        processing_message (Message): Сообщение Telegram для редактирования.
+
+    Returns:
+        Callable: Корутина on_partial(text).
+    """
+    async def on_partial(text: str) -> None:
+        if text:
+            await RENDERER.edit(processing_message, f"1/3 Конвертирую аудио в текст...\n\n<i>{html.escape(text)}</i>",
+                                parse_mode="HTML", wait=False)
+
+    return on_partial
+
+
 def format_json_to_telegram_text(json: dict) -> str:
     """
     Форматирует JSON-словарь в текст для Telegram.
@@ -156,10 +210,12 @@ def set_status_to_text(text: str, status: str) -> str:
     return text.strip()
 
 
+@traced("telegram.edit_message")
 async def edit_message(message: Message, text: str, user_message: str = None, status: str = None,
-                       reply_markup: InlineKeyboardMarkup = None):
+                       reply_markup: InlineKeyboardMarkup = None, wait: bool = True):
     """
     Редактирует сообщение Telegram, добавляя текст, статус и разметку.
+    Правка проходит через RENDERER: промежуточные статусы (wait=False) объединяются с последующими.
 
     Args:
         message (Message): Сообщение Telegram для редактирования.
@@ -167,6 +223,7 @@ async def edit_message(message: Message, text: str, user_message: str = None, st
         user_message (str, optional): Исходное сообщение пользователя.
         status (str, optional): Статус для добавления.
         reply_markup (InlineKeyboardMarkup, optional): Клавиатура для сообщения.
+        wait (bool): Дождаться отправки правки; False - для промежуточных статусов.
 
     Returns:
         None
@@ -176,14 +233,12 @@ async def edit_message(message: Message, text: str, user_message: str = None, st
         new_text += f"<code>{user_message}</code>\n\n"
     new_text += text
 
-    LOGGER.info(f"Text before status: {new_text}")
-
     if status:
         new_text = set_status_to_text(new_text, status)
 
-    LOGGER.info(f"Text after status: {new_text}")
+    LOGGER.debug("Message text: %s", new_text)
 
-    await message.edit_text(new_text, parse_mode="HTML", reply_markup=reply_markup)
+    await RENDERER.edit(message, new_text, parse_mode="HTML", reply_markup=reply_markup, wait=wait)
 
 
 async def create_request_data_from_message(operation_type: OperationTypes, request_message: dict, telegram_message_id: str) -> RequestData:
@@ -406,6 +461,131 @@ def clarify_request_message(request_message: dict) -> dict:
     return result
 
 
+async def classify_operations(text: str, policy: ModelRoutingPolicy = ROUTING_POLICY) -> dict:
+    """
+    Первый запрос к ChatGPT: определяет типы операций и валидность текста.
+
+    Args:
+        text (str): Текст пользователя.
+        policy (ModelRoutingPolicy): Политика выбора модели.
+
+    Returns:
+        dict: {"operations": [...]} по формату finance_operation_response.
+    """
+    # MessageRequest и ResponseFormat читают воспоминания и категории (Google Sheets): собираются в потоке
+    message_request = await asyncio.to_thread(MessageRequest, text)
+    response_format = await asyncio.to_thread(ResponseFormat)
+    return await request_data(policy.get_request_builder(
+        stage=Stage.classification,
+        message_request=message_request.finance_operation_request_message,
+        response_format=response_format.finance_operation_response))
+
+
+async def extract_operation_data(operation_type: OperationTypes, source_inputted_text: str,
+                                 policy: ModelRoutingPolicy = ROUTING_POLICY) -> dict:
+    """
+    Второй запрос к ChatGPT: извлекает данные операции и валидирует их. Если валидация не прошла,
+    запрос повторяется моделью эскалации из политики.
+
+    Args:
+        operation_type (OperationTypes): Тип операции.
+        source_inputted_text (str): Текст операции.
+        policy (ModelRoutingPolicy): Политика выбора модели.
+
+    Returns:
+        dict: Валидированное сообщение запроса (см. clarify_request_message).
+    """
+    request_message = await request_operation_data(operation_type, source_inputted_text, policy)
+    return await validate_operation_data(operation_type, source_inputted_text, request_message, policy)
+
+
+async def request_operation_data(operation_type: OperationTypes, source_inputted_text: str,
+                                 policy: ModelRoutingPolicy = ROUTING_POLICY, model: str = None) -> dict:
+    """
+    Запрашивает у ChatGPT данные операции без валидации. По умолчанию модель выбирает политика.
+    """
+    message_request = await asyncio.to_thread(MessageRequest, source_inputted_text)
+    response_format = await asyncio.to_thread(get_response_format_according_to_operation_type, operation_type)
+    request_message = await request_data(policy.get_request_builder(
+        stage=Stage.extraction,
+        message_request=message_request.basic_request_message,
+        response_format=response_format,
+        operation_type=operation_type,
+        model=model))
+
+    log_payload(LOGGER, "Raw operation data", request_message)
+
+    return request_message
+
+
+async def validate_operation_data(operation_type: OperationTypes, source_inputted_text: str, request_message: dict,
+                                  policy: ModelRoutingPolicy = ROUTING_POLICY) -> dict:
+    """
+    Валидирует данные операции (clarify_request_message). Если валидация не прошла и политика
+    разрешает эскалацию, данные запрашиваются повторно более сильной моделью.
+    """
+    request_message = await asyncio.to_thread(clarify_request_message, request_message)
+
+    model = policy.get_model(Stage.extraction, operation_type)
+    escalation_model = policy.get_escalation_model(model)
+    if VALIDATION_TEXT in str(request_message) and escalation_model:
+        LOGGER.info(f"Validation failed for model '{model}', escalating to '{escalation_model}'")
+        increment("llm.extraction.escalations")
+        request_message = await request_operation_data(operation_type, source_inputted_text, policy,
+                                                       escalation_model)
+        request_message = await asyncio.to_thread(clarify_request_message, request_message)
+
+    return request_message
+
+
+def record_transcript(transcript_id: str, text: str, operation_type: OperationTypes, request_message: dict) -> None:
+    """
+    Дописывает сохранённую в Google Sheets операцию в корпус транскриптов (TRANSCRIPT_CORPUS_PATH),
+    если он задан. Пользователь видит каждую сохранённую операцию: если он удаляет её кнопкой "Удалить",
+    запись убирается из корпуса (drop_transcript), поэтому в корпусе остаются только принятые операции.
+    Корпус используется scripts/evaluate_model_routing.py.
+
+    Args:
+        transcript_id (str): Идентификатор операции: ключ checkpoint и номер операции в сообщении.
+    """
+    if not TRANSCRIPT_CORPUS_PATH:
+        return
+    fields = {key: value for key, value in request_message.items() if key not in ("final_answer", "comment")}
+    try:  # операция уже сохранена: ошибка записи корпуса не должна выглядеть как ошибка сохранения
+        append_jsonl(TRANSCRIPT_CORPUS_PATH, {"id": transcript_id, "text": text,
+                                              "operations": [{"operation_type": operation_type, "fields": fields}]})
+    except OSError as e:
+        LOGGER.warning(f"Failed to record transcript: {e}")
+
+
+def drop_transcript(transcript_id: str) -> None:
+    """
+    Убирает из корпуса транскриптов операцию, которую пользователь удалил из Google Sheets.
+    """
+    if not TRANSCRIPT_CORPUS_PATH:
+        return
+    try:
+        remove_jsonl(TRANSCRIPT_CORPUS_PATH, "id", transcript_id)
+    except OSError as e:
+        LOGGER.warning(f"Failed to drop transcript: {e}")
+
+
+def get_transcript_id(checkpoint_key: str, index: int) -> str:
+    return f"{checkpoint_key}:{index}"
+
+
+def is_transcript_saved(update: Update) -> bool:
+    """
+    Сохранён ли распознанный текст голосового сообщения (в checkpoint или в кэше транскрипций),
+    то есть поможет ли пользователю повторная отправка этого сообщения.
+    """
+    if not update.message or not update.message.voice:
+        return False
+    if has_stage(get_checkpoint_key(update), VoiceStage.transcribe):
+        return True
+    return get_cached_transcription(AUDIO2TEXT_MODEL, file_unique_id=update.message.voice.file_unique_id) is not None
+
+
 # HANDLES
 
 
@@ -416,9 +596,16 @@ async def global_error_handler(update: object, context: ContextTypes.DEFAULT_TYP
     try:
         if isinstance(update, Update):
             # Пытаемся отправить пользователю сообщение об ошибке
-            message = update.callback_query.message or update.message
-            await message.reply_text("Произошла ошибка при обработке вашего запроса. "
-                                     "Пожалуйста, попробуйте позже.")
+            message = update.effective_message
+            if message is None:
+                return
+            if is_transcript_saved(update):
+                await message.reply_text("Произошла ошибка при обработке вашего запроса. "
+                                         "Пожалуйста, попробуйте позже или перешлите голосовое сообщение ещё раз: "
+                                         "распознанный текст сохранён.")
+            else:
+                await message.reply_text("Произошла ошибка при обработке вашего запроса. "
+                                         "Пожалуйста, попробуйте позже.")
     except Exception as e:
         LOGGER.error(f"Ошибка при отправке сообщения пользователю: {e}")
 
@@ -438,39 +625,37 @@ async def memory_button_handler(update: Update, context: ContextTypes.DEFAULT_TY
         
     if callback_data.startswith("mem_del_"):
         try:
-            memory_index = int(callback_data.replace("mem_del_", ""))
-            memories = get_memories()
-            
-            if 0 <= memory_index < len(memories):
-                deleted_memory = memories[memory_index]
-                if delete_memory(memory_index):
-                    # Обновляем список
-                    memories = get_memories()
-                    if memories:
-                        keyboard = []
-                        message_text = "📝 Сохранённые воспоминания:\n\n"
-                        for i, memory in enumerate(memories):
-                            message_text += f"{i + 1}. {memory}\n"
-                            keyboard.append([InlineKeyboardButton(f"❌ Удалить {i + 1}", callback_data=f"mem_del_{i}")])
-                        keyboard.append([InlineKeyboardButton("✅ Готово", callback_data="mem_done")])
-                        reply_markup = InlineKeyboardMarkup(keyboard)
-                        await query.answer(f"✅ Удалено: {deleted_memory}")
-                        await query.edit_message_text(
-                            message_text + "\nВыберите воспоминание для удаления:",
-                            reply_markup=reply_markup
-                        )
-                    else:
-                        await query.answer("Все воспоминания удалены")
-                        await query.edit_message_text("📝 Все воспоминания удалены.")
+            memory_id = callback_data.replace("mem_del_", "")
+            if await asyncio.to_thread(delete_memory, memory_id):
+                # список обновляется из локального кэша, без повторного чтения листа
+                memories = await asyncio.to_thread(get_memory_items)
+                if memories:
+                    message_text, reply_markup = get_memory_list_message(memories)
+                    await query.answer("✅ Удалено")
+                    await query.edit_message_text(message_text, reply_markup=reply_markup)
                 else:
-                    await query.answer("❌ Ошибка при удалении воспоминания", show_alert=True)
+                    await query.answer("Все воспоминания удалены")
+                    await query.edit_message_text("📝 Все воспоминания удалены.")
             else:
-                await query.answer("❌ Неверный индекс воспоминания", show_alert=True)
+                await query.answer("❌ Воспоминание не найдено или не удалено", show_alert=True)
         except Exception as e:
             LOGGER.error(f"Error in memory deletion: {e}")
             await query.answer("❌ Ошибка при удалении", show_alert=True)
 
 
+def get_memory_list_message(memories: list[Memory]) -> tuple[str, InlineKeyboardMarkup]:
+    """
+    Текст списка воспоминаний и клавиатура с кнопками удаления (по идентификатору воспоминания).
+    """
+    keyboard = []
+    message_text = "📝 Сохранённые воспоминания:\n\n"
+    for i, memory in enumerate(memories):
+        message_text += f"{i + 1}. {memory.text}\n"
+        keyboard.append([InlineKeyboardButton(f"❌ Удалить {i + 1}", callback_data=f"mem_del_{memory.id}")])
+    keyboard.append([InlineKeyboardButton("✅ Готово", callback_data="mem_done")])
+    return message_text + "\nВыберите воспоминание для удаления:", InlineKeyboardMarkup(keyboard)
+
+
 async def operation_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Обработчик кнопок для финансовых операций.
@@ -478,7 +663,6 @@ async def operation_button_handler(update: Update, context: ContextTypes.DEFAULT
     """
     query = update.callback_query
     await query.answer()  # confirm button click
-    await query.edit_message_reply_markup(reply_markup=None)  # remove buttons
     
     reply_message: Message = query.message
     callback_data = query.data
@@ -486,6 +670,10 @@ async def operation_button_handler(update: Update, context: ContextTypes.DEFAULT
     # Extract action and message_id from callback_data
     parts = callback_data.split("_")
     action = parts[0]
+    if callback_data.startswith(("confirm", "delete_confirm")):
+        # запись в Google Sheets небыстрая: кнопки убираем сразу, чтобы исключить повторное нажатие.
+        # В остальных случаях кнопки меняются вместе с текстом одной правкой
+        await query.edit_message_reply_markup(reply_markup=None)
     
     if len(parts) >= 2:
         if action == "delete" and len(parts) >= 3:
@@ -532,7 +720,6 @@ async def operation_button_handler(update: Update, context: ContextTypes.DEFAULT
     
     elif action == "delete":
         # Don't remove buttons yet - we need confirmation
-        await query.edit_message_reply_markup(reply_markup=get_delete_confirmation_keyboard(message_id))
         await edit_message(message=reply_message,
                            text=message_text,
                            user_message=source_inputted_text,
@@ -545,7 +732,10 @@ async def operation_button_handler(update: Update, context: ContextTypes.DEFAULT
         if saved_to_sheets and list_name and message_id:
             try:
                 # Delete from Google Sheets
-                deleted = delete_row_by_telegram_id(list_name, message_id)
+                telegram_message_id = message_data.get("telegram_message_id", message_id)
+                deleted = await asyncio.to_thread(delete_row_by_telegram_id, list_name, telegram_message_id)
+                if message_data.get("checkpoint_key"):
+                    drop_transcript(get_transcript_id(message_data["checkpoint_key"], message_data.get("index")))
                 if deleted:
                     await edit_message(message=reply_message,
                                        text=message_text,
@@ -619,9 +809,21 @@ async def operation_button_handler(update: Update, context: ContextTypes.DEFAULT
     else:
         raise ValueError(f"Unsupported operation type: {operation_type}")
 
-    LOGGER.info(f"{google_request_data=}")
+    log_payload(LOGGER, "Google request data", google_request_data)
 
-    google_utilities.insert_and_update_row_batch_update(google_request_data)
+    if message_id:
+        google_request_data.telegram_message_id = message_data.get("telegram_message_id")
+
+    await asyncio.to_thread(google_utilities.insert_and_update_row_batch_update, google_request_data)
+    if message_id and message_data.get("checkpoint_key"):
+        # иначе повторная отправка того же голосового снова запишет эту операцию
+        save_stage(message_data["checkpoint_key"], VoiceStage.persist,
+                   {"list_name": google_request_data.list_name,
+                    "telegram_message_id": google_request_data.telegram_message_id},
+                   message_data.get("index"))
+    if message_id and message_data.get("checkpoint_key") and VALIDATION_TEXT not in str(request_message):
+        record_transcript(get_transcript_id(message_data["checkpoint_key"], message_data.get("index")),
+                          source_inputted_text, operation_type, request_message)
 
     await edit_message(message=reply_message,
                        text=message_text,
@@ -639,11 +841,8 @@ async def button_click_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     """
     Главный обработчик кнопок. Распределяет вызовы между специализированными обработчиками.
     """
-    LOGGER.info(f"Button clicked.")
-    LOGGER.info(f"{update=}")
-    LOGGER.info(f"{context=}")
-    
     callback_data = update.callback_query.data
+    LOGGER.info(f"Button clicked: {callback_data}")
     
     # Направляем в соответствующий обработчик
     if callback_data.startswith("mem_"):
@@ -664,24 +863,27 @@ async def expenses_status_handler(update: Update, context: ContextTypes.DEFAULT_
         # Читаем данные из Google Sheets
         # A2 - currency code
         currency_range = f"{ListName.expenses_status}!A2"
-        currency_data = google_utilities.get_values(currency_range)
+        currency_data = await asyncio.to_thread(google_utilities.get_values, currency_range)
         currency_code = currency_data[0][0] if currency_data and currency_data[0] else "RUB"
         
         # B2:B - expense categories (without header)
         categories_range = f"{ListName.expenses_status}!B2:B"
-        categories_data = google_utilities.get_values(categories_range, transform_to_single_list=True)
+        categories_data = await asyncio.to_thread(google_utilities.get_values, categories_range,
+                                                  transform_to_single_list=True)
         
         # C2:C - amounts per category (without header)
         amounts_range = f"{ListName.expenses_status}!C2:C"
-        amounts_data = google_utilities.get_values(amounts_range, transform_to_single_list=True)
+        amounts_data = await asyncio.to_thread(google_utilities.get_values, amounts_range,
+                                               transform_to_single_list=True)
         
         # D2:D - expected amounts per category (without header)
         expected_range = f"{ListName.expenses_status}!D2:D"
-        expected_data = google_utilities.get_values(expected_range, transform_to_single_list=True)
+        expected_data = await asyncio.to_thread(google_utilities.get_values, expected_range,
+                                                transform_to_single_list=True)
         
         # E2 - total amount
         total_range = f"{ListName.expenses_status}!E2"
-        total_data = google_utilities.get_values(total_range)
+        total_data = await asyncio.to_thread(google_utilities.get_values, total_range)
         total_amount = total_data[0][0] if total_data and total_data[0] else "0"
         
         # Формируем сообщение
@@ -724,7 +926,7 @@ async def memory_text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
             await update.message.reply_text("Пожалуйста, добавьте текст после # для сохранения в памяти.")
             return
         
-        if add_memory(memory_text):
+        if await asyncio.to_thread(add_memory, memory_text):
             await update.message.reply_text(f"✅ Память сохранена: {memory_text}")
             LOGGER.info(f"Memory added: {memory_text}")
         else:
@@ -741,144 +943,262 @@ async def memory_command_handler(update: Update, context: ContextTypes.DEFAULT_T
     Показывает сохранённые воспоминания с возможностью их удаления.
     """
     try:
-        memories = get_memories()
-        
+        memories = await asyncio.to_thread(get_memory_items)
+
         if not memories:
             await update.message.reply_text("📝 Нет сохранённых воспоминаний.\n\nОтправьте сообщение, начинающееся с #, чтобы добавить воспоминание.")
             return
-        
-        # Создаём клавиатуру с кнопками для удаления
-        keyboard = []
-        message_text = "📝 Сохранённые воспоминания:\n\n"
-        
-        for i, memory in enumerate(memories):
-            message_text += f"{i + 1}. {memory}\n"
-            keyboard.append([InlineKeyboardButton(f"❌ Удалить {i + 1}", callback_data=f"mem_del_{i}")])
-        
-        keyboard.append([InlineKeyboardButton("✅ Готово", callback_data="mem_done")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(
-            message_text + "\nВыберите воспоминание для удаления:",
-            reply_markup=reply_markup
-        )
-        
+
+        message_text, reply_markup = get_memory_list_message(memories)
+        await update.message.reply_text(message_text, reply_markup=reply_markup)
+
     except Exception as e:
         LOGGER.error(f"Error in memory_command_handler: {e}")
         await update.message.reply_text("Произошла ошибка при получении воспоминаний.")
 
 
+async def queued_voice_message_handler(
+        update: Update,
+        context: ContextTypes.DEFAULT_TYPE,
+        **kwargs) -> None:
+    """
+    Ставит голосовое сообщение в очередь VOICE_QUEUE: сообщения одного чата обрабатываются по порядку
+    (операции попадают в таблицу в том же порядке), общее число одновременно обрабатываемых
+    сообщений ограничено VOICE_MAX_CONCURRENCY. Пока сообщение ждёт, пользователь видит позицию в очереди.
+    """
+    chat_id = update.effective_chat.id
+    processing_message = await update.message.reply_text(PROCESSING_START_TEXT)
+    is_queued = False
+
+    async def on_position(position: int) -> None:
+        nonlocal is_queued
+        is_queued = True
+        await RENDERER.edit(processing_message, get_queue_position_text(position), wait=False)
+
+    async def job() -> None:
+        if is_queued:  # сообщение показывало позицию в очереди
+            await RENDERER.edit(processing_message, PROCESSING_START_TEXT, wait=False)
+        await voice_message_handler(update, context, processing_message=processing_message, **kwargs)
+
+    with span("voice_message", chat_id=chat_id,
+              duration_sec=update.message.voice.duration if update.message.voice else None):
+        await VOICE_QUEUE.run(chat_id, job, on_position=on_position)
+
+
+def get_queue_position_text(position: int) -> str:
+    return f"⏳ В очереди: {position}. Ожидайте..."
+
+
 async def voice_message_handler(
         update: Update,
         context: ContextTypes.DEFAULT_TYPE,
-        audio2text_model: Audio2TextModels = Audio2TextModels.whisper,
-        custom_text: str = None) -> None:
+        audio2text_model: Audio2TextModels = AUDIO2TEXT_MODEL,
+        custom_text: str = None,
+        processing_message: Message = None) -> None:
+    """
+    Обрабатывает голосовое сообщение по этапам: download -> transcribe -> classify, затем для каждой
+    операции extract -> validate -> persist -> render. Результат каждого этапа сохраняется в Checkpoint,
+    поэтому после ошибки или перезапуска повторно отправленное сообщение продолжает обработку
+    с последнего завершённого этапа, не оплачивая заново распознавание и запросы к LLM.
+    """
     # Step I. Convert voice message to text.
-    processing_message = await update.message.reply_text("1/3 Конвертирую аудио в текст. Ожидайте...")
+    if processing_message is None:
+        processing_message = await update.message.reply_text(PROCESSING_START_TEXT)
     context.user_data["reply_message"] = processing_message  # save message for next usage
-    text_from_audio = await get_text_from_audio(update, context, audio2text_model, custom_text)
+    checkpoint = Checkpoint(get_checkpoint_key(update, custom_text))
+
+    text_from_audio = await run_stage(checkpoint, VoiceStage.transcribe, get_text_from_audio,
+                                      update, context, audio2text_model, custom_text, processing_message, checkpoint)
 
     # Step II. First request to ChatGPT: get json data with operation type and text validity.
     # Text will be divided into parts if user ask for few request in one voice message.
     await edit_message(message=processing_message,
                        text="2/3 Определяю тип операции и валидность текста. Ожидайте...",
-                       user_message=text_from_audio)
-    finance_operation_request_message = request_data(
-        RequestBuilder(
-            message_request=MessageRequest(user_message=text_from_audio).finance_operation_request_message,
-            response_format=ResponseFormat().finance_operation_response
-        )
-    )
-    LOGGER.info(f"{finance_operation_request_message=}")
+                       user_message=text_from_audio,
+                       wait=False)
+    finance_operation_request_message = await run_stage(checkpoint, VoiceStage.classify,
+                                                        classify_operations, text_from_audio)
+    LOGGER.info("Classified %d operation(s)", len(finance_operation_request_message.get("operations", [])))
+    log_payload(LOGGER, "Classification", finance_operation_request_message)
 
     # Step III. Second requests to ChatGPT: get json data that will be added to Google Tables.
-    for _, finance_operations in finance_operation_request_message.items():
-        for finance_operation in finance_operations:
+    # Each operation is rendered in its own message; operations are processed concurrently,
+    # but saved to Google Sheets in their original order.
+    finance_operations = finance_operation_request_message.get("operations", [])
+    operation_messages = await create_operation_messages(update, processing_message, len(finance_operations))
+    persisted = [asyncio.Event() for _ in finance_operations]
+    # ошибка одной операции не прерывает остальные: каждая доводится до конца и выводит свой результат
+    results = await asyncio.gather(*(
+        process_finance_operation(context, operation_messages[index], checkpoint, index, finance_operation,
+                                  previous_persisted=persisted[index - 1] if index else None,
+                                  persisted=persisted[index])
+        for index, finance_operation in enumerate(finance_operations)), return_exceptions=True)
+
+    for index, result in enumerate(results):
+        if isinstance(result, BaseException):
+            LOGGER.error(f"Operation {index} failed", exc_info=result)
+            await report_operation_error(operation_messages[index], finance_operations[index], result)
+
+    if all(result is True for result in results):
+        remove_voice_files(checkpoint.get(VoiceStage.download))
+        checkpoint.clear()  # всё сохранено: повторять нечего
+
+
+async def report_operation_error(operation_message: Message, finance_operation: dict, error: BaseException) -> None:
+    """
+    Выводит ошибку операции в её сообщении. Выполненные этапы сохранены в checkpoint,
+    поэтому повторная отправка сообщения продолжит обработку с места ошибки.
+    """
+    try:
+        await edit_message(message=operation_message,
+                           text=f"❌ Ошибка обработки операции: {error}. Попробуйте отправить сообщение ещё раз.",
+                           user_message=finance_operation.get("source_inputted_text"))
+    except Exception as e:
+        LOGGER.error(f"Ошибка при отправке сообщения пользователю: {e}")
+
+
+async def create_operation_messages(update: Update, processing_message: Message, count: int) -> list[Message]:
+    """
+    Сообщения для вывода операций: первая операция выводится в processing_message,
+    для остальных параллельно создаются отдельные ответы на голосовое сообщение.
+    """
+    extra_messages = await asyncio.gather(*(update.message.reply_text(OPERATION_START_TEXT)
+                                            for _ in range(1, count)))
+    return [processing_message, *extra_messages]
 
-            LOGGER.info(f"{finance_operation=}")
 
-            operation_type: str = finance_operation.get("operation_type")
-            source_inputted_text: str = finance_operation.get("source_inputted_text")
-            message_to_user: str = finance_operation.get("message_to_user")
-            user_request_is_correct: bool = finance_operation.get("user_request_is_relevant")
+def get_checkpoint_key(update: Update, custom_text: str = None) -> str:
+    """
+    Ключ контрольной точки: file_unique_id голосового (одинаков у пересланных копий) или хеш custom_text.
+    """
+    if custom_text:
+        return "text:" + hashlib.sha256(custom_text.encode()).hexdigest()
+    return "voice:" + update.message.voice.file_unique_id
 
-            operation_type = await clarify_operation_type(operation_type, processing_message, source_inputted_text)
-            if not operation_type:
-                continue
 
-            if not user_request_is_correct:
-                await edit_message(message=processing_message,
-                                   text=f'Запрос некорректен. Ответ ChatGPT: "{message_to_user}"',
-                                   user_message=source_inputted_text)
-                continue
+async def process_finance_operation(context: ContextTypes.DEFAULT_TYPE, operation_message: Message,
+                                    checkpoint: Checkpoint, index: int, finance_operation: dict,
+                                    previous_persisted: asyncio.Event = None, persisted: asyncio.Event = None) -> bool:
+    """
+    Этапы extract -> validate -> persist -> render для одной операции.
 
-            await edit_message(message=processing_message,
-                               text=f"3/3 Определяю данные для Google Tables. Ожидайте...",
-                               user_message=source_inputted_text)
+    Args:
+        operation_message (Message): Сообщение Telegram, в котором выводится операция.
+        previous_persisted (asyncio.Event, optional): Событие предыдущей операции: запись в Google Sheets
+            начинается только после него, чтобы строки сохранялись в порядке операций.
+        persisted (asyncio.Event, optional): Устанавливается, когда операция прошла этап записи (или не требует его).
 
-            request_message = request_data(
-                RequestBuilder(
-                    message_request=MessageRequest(
-                        user_message=source_inputted_text).basic_request_message,
-                    response_format=get_response_format_according_to_operation_type(operation_type))
-            )
+    Returns:
+        bool: True, если операция обработана до конца (сохранена или не требует сохранения).
+    """
+    try:
+        return await _process_finance_operation(context, operation_message, checkpoint, index, finance_operation,
+                                                previous_persisted)
+    finally:
+        if previous_persisted:
+            await previous_persisted.wait()
+        if persisted:
+            persisted.set()
+
+
+async def _process_finance_operation(context: ContextTypes.DEFAULT_TYPE, operation_message: Message,
+                                     checkpoint: Checkpoint, index: int, finance_operation: dict,
+                                     previous_persisted: asyncio.Event = None) -> bool:
+    LOGGER.info("Processing operation %d: %s", index, finance_operation.get("operation_type"))
+
+    source_inputted_text: str = finance_operation.get("source_inputted_text")
+    message_to_user: str = finance_operation.get("message_to_user")
+    user_request_is_correct: bool = finance_operation.get("user_request_is_relevant")
+
+    operation_type = await clarify_operation_type(finance_operation.get("operation_type"), operation_message,
+                                                  source_inputted_text)
+    if not operation_type:
+        return True
+
+    if not user_request_is_correct:
+        await edit_message(message=operation_message,
+                           text=f'Запрос некорректен. Ответ ChatGPT: "{message_to_user}"',
+                           user_message=source_inputted_text)
+        return True
 
-            LOGGER.info(f"(RAW) {request_message=}")
+    await edit_message(message=operation_message,
+                       text=OPERATION_START_TEXT,
+                       user_message=source_inputted_text,
+                       wait=False)
+
+    raw_request_message = await run_stage(checkpoint, VoiceStage.extract, request_operation_data,
+                                          operation_type, source_inputted_text, index=index)
+    request_message = await run_stage(checkpoint, VoiceStage.validate, validate_operation_data,
+                                      operation_type, source_inputted_text, raw_request_message, index=index)
+    log_payload(LOGGER, "Operation data", request_message)
+
+    # save operation_type and request_message to use in button_click_handler().
+    # Key is unique per operation: user_data is shared by all chats of the user
+    operation_id = uuid.uuid4().hex[:16]
+    telegram_message_id = str(operation_message.message_id)
+    message_data = {
+        "operation_type": operation_type,
+        "request_message": request_message,
+        "body_text": format_json_to_telegram_text(request_message),
+        "source_inputted_text": source_inputted_text,
+        "telegram_message_id": telegram_message_id,
+        "checkpoint_key": checkpoint.key,  # кнопка "Принять" отмечает в checkpoint этап persist
+        "index": index
+    }
+    context.user_data[f"msg_{operation_id}"] = message_data
 
-            request_message = clarify_request_message(request_message)
+    if VALIDATION_TEXT in str(request_message):
+        # Data has validation errors - show old Accept/Decline buttons
+        await render_operation(operation_message, message_data, get_reply_keyboard_markup(False, True, operation_id),
+                               "ожидание ответа пользователя.")
+        return True
 
-            LOGGER.info(f"{request_message=}")
+    if previous_persisted:
+        await previous_persisted.wait()
+    try:
+        persisted = await run_stage(checkpoint, VoiceStage.persist, persist_operation,
+                                    operation_type, request_message, telegram_message_id, source_inputted_text,
+                                    get_transcript_id(checkpoint.key, index), index=index)
+    except Exception as e:
+        LOGGER.error(f"Failed to auto-save to Google Sheets: {e}")
+        # On error, show old Accept/Decline buttons
+        await render_operation(operation_message, message_data, get_reply_keyboard_markup(True, True, operation_id),
+                               "❌ Ошибка сохранения.")
+        return False
+
+    # Store that data was saved for potential deletion
+    message_data.update(saved_to_sheets=True, **persisted)
+    await render_operation(operation_message, message_data, get_delete_button_keyboard(operation_id),
+                           "✅ Сохранено в Google Sheets")
+    checkpoint.save(VoiceStage.render, True, index)
+    return True
+
+
+async def persist_operation(operation_type: OperationTypes, request_message: dict, telegram_message_id: str,
+                            source_inputted_text: str, transcript_id: str) -> dict:
+    """
+    Сохраняет операцию в Google Sheets и записывает её в корпус транскриптов (record_transcript).
+    При повторе из checkpoint этап не выполняется, поэтому операция записывается в корпус один раз.
 
-            # save operation_type and request_message to use in button_click_handler()
-            body_text = format_json_to_telegram_text(request_message)
-            
-            # Generate unique message ID for this specific message
-            message_id = str(processing_message.message_id)
-            
-            # Store message-specific data with unique key
-            message_data_key = f"msg_{message_id}"
-            context.user_data[message_data_key] = {
-                "operation_type": operation_type,
-                "request_message": request_message,
-                "body_text": body_text,
-                "source_inputted_text": source_inputted_text
-            }
-
-            if VALIDATION_TEXT in str(request_message):
-                # Data has validation errors - show old Accept/Decline buttons
-                keyboard = get_reply_keyboard_markup(False, True, message_id)
-                status_text = "ожидание ответа пользователя."
-            else:
-                # Data is valid - auto-save to Google Sheets
-                try:
-                    # Create RequestData and add telegram_message_id
-                    data = await create_request_data_from_message(
-                        operation_type, request_message, message_id
-                    )
-                    
-                    # Auto-save to Google Sheets
-                    insert_and_update_row_batch_update(data)
-                    
-                    # Store that data was saved for potential deletion
-                    context.user_data[message_data_key]["saved_to_sheets"] = True
-                    context.user_data[message_data_key]["list_name"] = data.list_name
-                    
-                    # Show Delete button and success status
-                    keyboard = get_delete_button_keyboard(message_id)
-                    status_text = "✅ Сохранено в Google Sheets"
-                except Exception as e:
-                    LOGGER.error(f"Failed to auto-save to Google Sheets: {e}")
-                    # On error, show old Accept/Decline buttons
-                    keyboard = get_reply_keyboard_markup(True, True, message_id)
-                    status_text = "❌ Ошибка сохранения."
-
-            # send message with buttons
-            await edit_message(message=processing_message,
-                               text=body_text,
-                               user_message=source_inputted_text,
-                               status=status_text,
-                               reply_markup=keyboard)
+    Returns:
+        dict: list_name и telegram_message_id сохранённой строки (нужны для удаления).
+    """
+    data = await create_request_data_from_message(operation_type, request_message, telegram_message_id)
+    await asyncio.to_thread(insert_and_update_row_batch_update, data)
+    record_transcript(transcript_id, source_inputted_text, operation_type, request_message)
+    return {"list_name": data.list_name, "telegram_message_id": telegram_message_id}
+
+
+async def render_operation(processing_message: Message, message_data: dict, keyboard: InlineKeyboardMarkup,
+                           status_text: str) -> None:
+    """
+    Выводит результат обработки операции с кнопками.
+    """
+    await edit_message(message=processing_message,
+                       text=message_data["body_text"],
+                       user_message=message_data["source_inputted_text"],
+                       status=status_text,
+                       reply_markup=keyboard)
 
 
 async def set_bot_commands(application: Application) -> None:
@@ -894,19 +1214,164 @@ async def set_bot_commands(application: Application) -> None:
     LOGGER.info("Bot commands have been set")
 
 
+async def correlation_id_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Помечает все записи лога обработки обновления идентификатором чата и сообщения.
+    """
+    message = update.effective_message
+    set_correlation_id(f"{message.chat_id}/{message.message_id}" if message else f"update/{update.update_id}")
+
+
+async def on_startup(application: Application) -> None:
+    """
+    Регистрирует команды бота, загружает выбранный бэкенд распознавания речи, запускает измерение
+    задержки event loop, очистку voice_messages и HTTP сервер (webhook, /health, /metrics).
+    """
+    await set_bot_commands(application)
+    await asyncio.to_thread(load_backend, AUDIO2TEXT_MODEL)
+
+    set_gauge("process.start_time", time.time())
+    application.bot_data["loop_lag_monitor"] = asyncio.create_task(monitor_event_loop_lag(EVENT_LOOP_LAG_INTERVAL))
+    application.bot_data["janitor"] = asyncio.create_task(run_janitor())
+
+    server = HttpServer()
+    server.add_route("GET", "/health", partial(health_handler, application))
+    server.add_route("GET", "/metrics", metrics_handler)
+    server.add_route("GET", "/metrics.json", metrics_json_handler)
+    if WEBHOOK_URL:
+        server.add_route("POST", urlparse(WEBHOOK_URL).path or "/", partial(webhook_handler, application))
+
+    ssl_context = get_ssl_context(HTTP_CERT_PATH, HTTP_KEY_PATH) if HTTP_CERT_PATH and HTTP_KEY_PATH else None
+    try:
+        await server.start(HTTP_HOST, HTTP_PORT, ssl_context)
+    except OSError as e:
+        if WEBHOOK_URL:
+            raise
+        # в режиме polling бот работает и без служебных маршрутов
+        LOGGER.error(f"HTTP server failed to start on port {HTTP_PORT}: {e}")
+        return
+    application.bot_data["http_server"] = server
+
+
+async def on_shutdown(application: Application) -> None:
+    if server := application.bot_data.pop("http_server", None):
+        await server.stop()
+    for task_name in ("loop_lag_monitor", "janitor"):
+        if task := application.bot_data.pop(task_name, None):
+            task.cancel()
+    await close_http_client()
+
+
+async def webhook_handler(application: Application, request: HttpRequest) -> HttpResponse:
+    """
+    Принимает обновление от Telegram и передаёт его в очередь обновлений приложения.
+    """
+    if request.headers.get("x-telegram-bot-api-secret-token") != WEBHOOK_SECRET:
+        return HttpResponse(status=403)
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return HttpResponse(status=400)
+    # отброшенное обновление подтверждается (200), иначе Telegram будет присылать его повторно
+    if application.bot_data["update_filter"].is_raw_update_allowed(data):
+        await application.update_queue.put(Update.de_json(data, application.bot))
+    return HttpResponse()
+
+
+async def health_handler(application: Application, request: HttpRequest) -> HttpResponse:
+    """
+    Состояние процесса для healthcheck: 503, пока приложение не запущено или если event loop
+    заблокирован дольше HEALTH_MAX_EVENT_LOOP_LAG.
+    """
+    loop_lag = get_gauge("event_loop.lag") or 0.0
+    if not application.running:
+        status = "starting"
+    elif loop_lag > HEALTH_MAX_EVENT_LOOP_LAG:
+        status = "degraded"
+    else:
+        status = "ok"
+
+    cache_hits, cache_misses = get_counter("cache.transcription.hits"), get_counter("cache.transcription.misses")
+    rss_bytes = get_rss_bytes()
+    set_gauge("process.rss_bytes", rss_bytes)
+    return HttpResponse.json({
+        "status": status,
+        "mode": "webhook" if WEBHOOK_URL else "polling",
+        "uptime": round(time.time() - (get_gauge("process.start_time") or time.time())),
+        "event_loop_lag": round(loop_lag, 3),
+        "voice_queue": {"depth": VOICE_QUEUE.depth, "running": VOICE_QUEUE.running},
+        "errors": {"sheets": get_counter("sheets.read.errors") + get_counter("sheets.write.errors"),
+                   "llm_timeouts": get_counter("llm.classification.timeouts") + get_counter("llm.extraction.timeouts"),
+                   "whisper": get_counter("span.whisper.transcribe.errors")},
+        "transcription_cache_hit_ratio": round(cache_hits / (cache_hits + cache_misses), 2)
+        if cache_hits + cache_misses else None,
+        "rss_mb": round(rss_bytes / 1024 / 1024),
+        "vosk_models_mb": {name: round((get_gauge(f"vosk.model.{name}.rss_bytes") or 0) / 1024 / 1024)
+                           for name in filter(None, (VOSK_MODEL, VOSK_LARGE_MODEL))
+                           if get_gauge(f"vosk.model.{name}.rss_bytes") is not None},
+    }, status=200 if status == "ok" else 503)
+
+
+async def metrics_handler(request: HttpRequest) -> HttpResponse:
+    """
+    Метрики в текстовом формате Prometheus.
+    """
+    set_gauge("process.rss_bytes", get_rss_bytes())
+    return HttpResponse(body=render_prometheus().encode(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+async def metrics_json_handler(request: HttpRequest) -> HttpResponse:
+    set_gauge("process.rss_bytes", get_rss_bytes())
+    return HttpResponse.json(get_metrics_snapshot())
+
+
+async def run_webhook(application: Application) -> None:
+    """
+    Жизненный цикл приложения в режиме webhook (аналог Application.run_polling): обновления приходят
+    на HTTP сервер, запущенный в on_startup.
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop_event.set)
+
+    await application.initialize()
+    try:
+        await application.post_init(application)
+        await application.start()
+        certificate = open(HTTP_CERT_PATH, "rb") if HTTP_CERT_PATH else None
+        try:
+            await application.bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET, certificate=certificate,
+                                              allowed_updates=sorted(application.bot_data["update_filter"].allowed_updates))
+        finally:
+            if certificate:
+                certificate.close()
+        LOGGER.info(f"Webhook set to {WEBHOOK_URL}")
+
+        await stop_event.wait()
+    finally:
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        await application.post_shutdown(application)
+
+
 def run() -> None:
-    application = Application.builder().token(os.getenv("TELEGRAM_TOKEN")).build()
+    # обновления обрабатываются параллельно; порядок голосовых внутри чата обеспечивает VOICE_QUEUE
+    application = (Application.builder()
+                   .token(os.getenv("TELEGRAM_TOKEN"))
+                   .concurrent_updates(True)
+                   .post_init(on_startup)
+                   .post_shutdown(on_shutdown)
+                   .build())
 
     # Устанавливаем глобальный обработчик ошибок
     application.add_error_handler(global_error_handler)
-    
-    # Регистрируем команды бота при старте
-    application.post_init = set_bot_commands
 
     # Используем functools.partial для передачи дополнительного аргумента
     handler_with_vosk = partial(
-        voice_message_handler,
-        audio2text_model=Audio2TextModels.whisper,
+        queued_voice_message_handler,
+        audio2text_model=AUDIO2TEXT_MODEL,
         # custom_text="1500 динар накопления кофе"
         # custom_text="300 динар кофе"
         # custom_text="2280 минус 400 динар накопления продукты"
@@ -932,5 +1397,15 @@ def run() -> None:
     # Обработчик для текстовых сообщений, начинающихся с #
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, memory_text_handler))
 
+    # Ранняя фильтрация: обновления других типов и чатов отбрасываются до всех обработчиков
+    update_filter = UpdateFilter(ALLOWED_UPDATES or get_allowed_updates(application), ALLOWED_CHAT_IDS or None)
+    application.bot_data["update_filter"] = update_filter
+    application.add_handler(TypeHandler(Update, correlation_id_handler), group=-2)
+    application.add_handler(TypeHandler(Update, update_filter.handle), group=-1)
+    LOGGER.info(f"Allowed updates: {sorted(update_filter.allowed_updates)}, allowed chats: {ALLOWED_CHAT_IDS or 'all'}")
+
     # run
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling(allowed_updates=sorted(update_filter.allowed_updates))